@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ClothingstoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'ClothingStore'
+
+    def ready(self):
+        from . import instrumentation, signals, sqlite  # noqa: F401
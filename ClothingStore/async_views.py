@@ -0,0 +1,70 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import check_password, identify_hasher, make_password
+from django.contrib.auth.views import redirect_to_login
+
+from .cart import SessionCart
+
+# Threads that hash passwords for the async login and signup views. A
+# PBKDF2 hash is tens of milliseconds of CPU: a burst of logins queues here
+# instead of blocking the event loop or taking a thread per request.
+PASSWORD_HASHING_WORKERS = 4
+
+_hashing_executor = None
+
+
+def resolve_request(view):
+    """
+    Load ``request.user`` and ``request.cart`` before an async view (and
+    the ETag function of its ``condition`` decorator) runs, so templates
+    and helpers reading them never query the database from the event loop.
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        request.user = await request.auser()
+        request.cart = await SessionCart.aload(request)
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def alogin_required(view):
+    """``login_required`` for async views; Django's own supports them from 5.1."""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+async def run_hashing(function, *args):
+    """Run a CPU-bound password hasher call on the bounded hashing pool."""
+    global _hashing_executor
+    if _hashing_executor is None:
+        _hashing_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASHING_WORKERS, thread_name_prefix='hashing')
+    return await asyncio.get_running_loop().run_in_executor(_hashing_executor, partial(function, *args))
+
+
+async def authenticate_user(username, password):
+    """
+    ``ModelBackend.authenticate`` for async views: the user is loaded with
+    the async ORM and only the hash check runs on the hashing pool.
+    """
+    UserModel = get_user_model()
+    try:
+        user = await UserModel._default_manager.aget(**{UserModel.USERNAME_FIELD: username})
+    except UserModel.DoesNotExist:
+        # Hash anyway so unknown usernames take as long as wrong passwords.
+        await run_hashing(make_password, password)
+        return None
+    if not await run_hashing(check_password, password, user.password) or not user.is_active:
+        return None
+    if identify_hasher(user.password).must_update(user.password):
+        user.password = await run_hashing(make_password, password)
+        await user.asave(update_fields=['password'])
+    user.backend = 'django.contrib.auth.backends.ModelBackend'
+    return user
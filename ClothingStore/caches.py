@@ -0,0 +1,26 @@
+import random
+
+from django.core.cache.backends.filebased import FileBasedCache
+
+
+class SessionFileCache(FileBasedCache):
+    """
+    A file-based cache that never evicts a live entry.
+
+    Sessions, and the carts kept in them, only exist in this cache, so the
+    stock cull (deleting a random share of the files once MAX_ENTRIES is
+    reached) would log visitors out and drop unflushed carts. Past
+    MAX_ENTRIES this cull opens the same random share of files and deletes
+    only the expired ones among them.
+    """
+
+    def _cull(self):
+        filelist = self._list_cache_files()
+        if len(filelist) < self._max_entries:
+            return
+        for fname in random.sample(filelist, len(filelist) // (self._cull_frequency or 1)):
+            try:
+                with open(fname, 'rb') as f:
+                    self._is_expired(f)
+            except FileNotFoundError:
+                pass
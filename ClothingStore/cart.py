@@ -0,0 +1,206 @@
+import time
+from decimal import Decimal
+from functools import cached_property
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import Case, DecimalField, ExpressionWrapper, F, PositiveIntegerField, Sum, Value, When, Window
+
+from .models import Cart, CartItem, Product
+
+CART_SESSION_KEY = 'cart'
+# Seconds a modified cart may stay unflushed before the next cart action
+# writes it behind to Cart/CartItem.
+CART_FLUSH_INTERVAL = 15 * 60
+
+
+class CartLine:
+    def __init__(self, product, quantity, total=None):
+        self.id = product.id
+        self.product = product
+        self.quantity = quantity
+        self.total = self.quantity * self.product.price if total is None else total
+
+    def get_total_item_price(self):
+        return self.total
+
+
+class SessionCart:
+    """
+    The live shopping cart, stored in the session rather than the database.
+
+    Cart clicks only touch the session. The ``Cart``/``CartItem`` rows are
+    written behind in one batch by ``flush()``: at checkout, at logout, or
+    on the first cart action after ``CART_FLUSH_INTERVAL`` of unflushed
+    changes. Anonymous carts live in the session as well and are merged
+    with the stored cart at login.
+
+    ``CartMiddleware`` attaches one lazily created instance to each request
+    as ``request.cart``, so the priced lines are fetched at most once per
+    request and reading the cart never writes to the database.
+    """
+
+    def __init__(self, request, user=None):
+        self.user = user or getattr(request, 'user', None)
+        self.session = request.session
+        data = self.session.get(CART_SESSION_KEY)
+        if data is None and self.user is not None and self.user.is_authenticated:
+            data = {'items': self._stored_items(self.user), 'dirty_since': None}
+            self.session[CART_SESSION_KEY] = data
+        data = data or {}
+        self.items = dict(data.get('items', {}))
+        self.dirty_since = data.get('dirty_since')
+
+    @classmethod
+    async def aload(cls, request):
+        """
+        Build the request's cart from async code, loading a stored cart
+        that is not in the session yet with the async ORM.
+        """
+        user = await request.auser()
+        # Loads the session if nothing has yet, which may do I/O.
+        data = await sync_to_async(request.session.get)(CART_SESSION_KEY)
+        if data is None and user.is_authenticated:
+            items = {str(product_id): quantity async for product_id, quantity in cls._stored_rows(user)}
+            request.session[CART_SESSION_KEY] = {'items': items, 'dirty_since': None}
+        return cls(request, user)
+
+    @staticmethod
+    def _stored_rows(user):
+        return CartItem.objects.filter(cart__user=user).values_list('product_id', 'quantity')
+
+    @classmethod
+    def _stored_items(cls, user):
+        return {str(product_id): quantity for product_id, quantity in cls._stored_rows(user)}
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, product_id):
+        return str(product_id) in self.items
+
+    def product_ids(self):
+        return {int(product_id) for product_id in self.items}
+
+    def quantities(self):
+        return {int(product_id): quantity for product_id, quantity in self.items.items()}
+
+    def _save(self, dirty=True):
+        self.__dict__.pop('summary', None)
+        if dirty and self.dirty_since is None:
+            self.dirty_since = time.time()
+        self.session[CART_SESSION_KEY] = {'items': self.items, 'dirty_since': self.dirty_since}
+        if dirty:
+            self.flush_if_idle()
+
+    def add(self, product_id, quantity=1):
+        key = str(product_id)
+        self.items[key] = self.items.get(key, 0) + quantity
+        self._save()
+
+    def set(self, product_id, quantity):
+        if quantity < 1:
+            self.remove(product_id)
+            return
+        self.items[str(product_id)] = quantity
+        self._save()
+
+    def remove(self, product_id):
+        if self.items.pop(str(product_id), None) is not None:
+            self._save()
+
+    def clear(self):
+        """Empty the cart once its stored rows have been consumed (checkout)."""
+        self.items = {}
+        self.dirty_since = None
+        self._save(dirty=False)
+
+    @cached_property
+    def summary(self):
+        """
+        Price every line and the cart total in one query.
+
+        Quantities from the session are fed in through a CASE expression and
+        the grand total is a window SUM, so no Product instance is loaded per
+        line and the database does the arithmetic.
+        """
+        quantities = self.quantities()
+        if not quantities:
+            return [], Decimal('0.00')
+        money = DecimalField(max_digits=12, decimal_places=2)
+        quantity = Case(
+            *[When(id=product_id, then=Value(qty)) for product_id, qty in quantities.items()],
+            output_field=PositiveIntegerField(),
+        )
+        line_total = ExpressionWrapper(F('price') * F('quantity'), output_field=money)
+        rows = (
+            Product.objects.filter(id__in=list(quantities))
+            .annotate(quantity=quantity)
+            .annotate(line_total=line_total, cart_total=Window(Sum(line_total), output_field=money))
+            .order_by('id')
+            .values('id', 'name', 'price', 'image', 'image_widths', 'quantity', 'line_total', 'cart_total')
+        )
+        lines = []
+        total = Decimal('0.00')
+        for row in rows:
+            product = Product(
+                id=row['id'], name=row['name'], price=row['price'], image=row['image'], image_widths=row['image_widths'],
+            )
+            lines.append(CartLine(product, row['quantity'], row['line_total']))
+            total = row['cart_total']
+        return lines, total
+
+    def lines(self):
+        return self.summary[0]
+
+    def total(self):
+        return self.summary[1]
+
+    @classmethod
+    def merge_at_login(cls, request, user):
+        """Fold the user's stored cart into the anonymous session cart."""
+        had_session_cart = CART_SESSION_KEY in request.session
+        cart = cls(request, user)
+        if not had_session_cart:
+            return cart
+        stored = cls._stored_items(user)
+        if not cart.items:
+            cart.items = stored
+            cart._save(dirty=False)
+        elif stored:
+            for product_id, quantity in stored.items():
+                cart.items[product_id] = cart.items.get(product_id, 0) + quantity
+            cart._save()
+        return cart
+
+    def store(self, cart):
+        """
+        Replace the rows of ``cart`` with the live cart in one batched upsert.
+
+        This only writes the rows; callers running it inside a larger
+        transaction (checkout) clear the session cart once that commits.
+        """
+        quantities = self.quantities()
+        product_ids = set(Product.objects.filter(id__in=list(quantities)).values_list('id', flat=True))
+        CartItem.objects.filter(cart=cart).exclude(product_id__in=product_ids).delete()
+        CartItem.objects.bulk_create(
+            [CartItem(cart=cart, product_id=product_id, quantity=quantities[product_id]) for product_id in product_ids],
+            update_conflicts=True,
+            unique_fields=['cart', 'product'],
+            update_fields=['quantity'],
+        )
+
+    def flush(self):
+        """Write the live cart to ``Cart``/``CartItem`` if it has unsaved changes."""
+        user = self.user
+        if user is None or not user.is_authenticated or self.dirty_since is None:
+            return
+        with transaction.atomic():
+            cart, created = Cart.objects.get_or_create(user=user)
+            self.store(cart)
+        self.dirty_since = None
+        self._save(dirty=False)
+
+    def flush_if_idle(self):
+        if self.dirty_since is not None and time.time() - self.dirty_since >= CART_FLUSH_INTERVAL:
+            self.flush()
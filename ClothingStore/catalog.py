@@ -0,0 +1,57 @@
+import time
+
+from django.core.cache import cache
+
+CATALOG_VERSION_KEY = 'catalog:version'
+PRODUCT_VERSION_KEY = 'catalog:product:%d'
+
+
+def _get_version(key):
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key)
+    return version
+
+
+def _bump_version(key):
+    _get_version(key)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Evicted between the read and the increment.
+        return _get_version(key)
+
+
+def get_catalog_version():
+    """
+    Return the global catalog version stamp.
+
+    The stamp lives in the default cache so every process sees the same value
+    when a shared (e.g. file-based) backend is configured. It is seeded from
+    the clock so a cleared cache never reissues a version that old fragments
+    were stored under.
+    """
+    return _get_version(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version():
+    return _bump_version(CATALOG_VERSION_KEY)
+
+
+def get_product_version(product_id):
+    """
+    Return the version stamp of one product page: the product row, its
+    stock and its reviews. Seeded from the clock like the catalog stamp.
+    """
+    return _get_version(PRODUCT_VERSION_KEY % product_id)
+
+
+def touch_products(product_ids):
+    """Move the version stamp of each of ``product_ids`` forward."""
+    for product_id in product_ids:
+        try:
+            cache.incr(PRODUCT_VERSION_KEY % product_id)
+        except ValueError:
+            # Never read or evicted: the next read seeds a fresh stamp.
+            pass
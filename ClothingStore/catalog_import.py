@@ -0,0 +1,296 @@
+import codecs
+import csv
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps
+
+from . import search
+from .images import build_derivatives, delete_derivatives
+from .catalog import bump_catalog_version, touch_products
+from .facets import facet_index
+from .forms import ProductImportRowForm
+from .models import Category, Product
+
+BATCH_SIZE = 500
+IMAGE_MAX_SIZE = 1600
+IMPORT_UPLOAD_TO = 'products/imported'
+MAX_REPORTED_ERRORS = 100
+# Image processes used by the staff upload view, to keep web workers light.
+IMPORT_VIEW_WORKERS = 2
+# Row fields that make up the content hash, together with the image digest.
+HASH_FIELDS = ('name', 'description', 'category', 'size', 'color', 'price', 'stock')
+UPDATE_FIELDS = ('name', 'description', 'category', 'size', 'color', 'price', 'stock', 'image', 'import_hash')
+
+
+class ImportReport:
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.error_count = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    def __str__(self):
+        return '%d created, %d updated, %d unchanged, %d errors' % (
+            self.created, self.updated, self.unchanged, self.error_count)
+
+
+def read_manifest(stream, name=''):
+    """
+    Yield ``(line_number, row)`` pairs from a binary CSV or JSON Lines manifest.
+
+    The manifest is decoded and parsed one line at a time. A JSON line that
+    is not an object is yielded with ``row=None`` so it is reported rather
+    than aborting the import.
+    """
+    lines = codecs.iterdecode(stream, 'utf-8-sig')
+    if name.lower().endswith('.csv'):
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row if isinstance(row, dict) else None
+
+
+@contextmanager
+def image_directory(source):
+    """Yield a directory of images for ``source``, a directory or a zip archive."""
+    if source is None or isinstance(source, str) and os.path.isdir(source):
+        yield source
+        return
+    tmpdir = tempfile.mkdtemp(prefix='catalog_import_')
+    try:
+        with zipfile.ZipFile(source) as archive:
+            archive.extractall(tmpdir)
+        yield tmpdir
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def process_image(source, destination, max_size=IMAGE_MAX_SIZE):
+    """
+    Normalize one product image into a web-ready JPEG. Runs in a worker
+    process, so it only touches files, never the database.
+    """
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_size, max_size))
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.save(destination, 'JPEG', quality=85, optimize=True, progressive=True)
+    return destination
+
+
+class CatalogImporter:
+    """
+    Stream a manifest into ``Product`` rows keyed by ``sku``.
+
+    Rows are validated as they are read and written in batches: one query
+    fetches the existing hashes of a batch, unchanged rows are skipped,
+    images of new and changed rows are processed in the process pool and
+    the rows are saved with ``bulk_create``/``bulk_update`` in one
+    transaction per batch. Categories are resolved from a dict loaded once
+    per import. Responsive derivatives of the saved rows' images are built
+    in the same pool at the end of the run.
+    """
+
+    def __init__(self, image_root=None, pool=None, batch_size=BATCH_SIZE):
+        self.image_root = os.path.abspath(image_root) if image_root else None
+        self.pool = pool
+        self.batch_size = batch_size
+        self.report = ImportReport()
+        self.categories = dict(Category.objects.values_list('name', 'id'))
+        self.product_ids = []
+        # Images of created and updated rows, whose derivatives are built last.
+        self.image_names = set()
+        # Futures of the images processed by this import, by stored name.
+        self.images = {}
+
+    def run(self, rows):
+        batch = {}
+        line_number = 0
+        try:
+            for line_number, row in rows:
+                data = self.validate(line_number, row)
+                if data is None:
+                    continue
+                batch[data['sku']] = (line_number, data)
+                if len(batch) >= self.batch_size:
+                    self.flush(batch)
+                    batch = {}
+        except UnicodeDecodeError:
+            # Rows read so far are still imported.
+            self.report.error(line_number + 1, 'Not UTF-8 text; the rest of the manifest was not read.')
+        if batch:
+            self.flush(batch)
+        if self.image_names:
+            build_derivatives(sorted(self.image_names), self.pool)
+        if self.product_ids:
+            bump_catalog_version()
+            facet_index.invalidate()
+            search.reindex_products(self.product_ids)
+            touch_products(self.product_ids)
+        return self.report
+
+    def validate(self, line_number, row):
+        if row is None:
+            self.report.error(line_number, 'Not a JSON object.')
+            return None
+        form = ProductImportRowForm({key: '' if value is None else value for key, value in row.items()})
+        if not form.is_valid():
+            message = '; '.join('%s: %s' % (field, ' '.join(errors)) for field, errors in form.errors.items())
+            self.report.error(line_number, message)
+            return None
+        return form.cleaned_data
+
+    def category_id(self, name):
+        if name not in self.categories:
+            self.categories[name] = Category.objects.create(name=name).id
+        return self.categories[name]
+
+    def resolve_image(self, name):
+        """Return ``(source_path, digest)`` for a new file or ``(None, digest)`` for stored media."""
+        if self.image_root:
+            path = os.path.abspath(os.path.join(self.image_root, name))
+            if path.startswith(self.image_root + os.sep) and os.path.isfile(path):
+                with open(path, 'rb') as image:
+                    return path, hashlib.file_digest(image, 'sha256').hexdigest()
+        if default_storage.exists(name):
+            return None, 'stored:%s' % name
+        raise FileNotFoundError(name)
+
+    def flush(self, batch):
+        existing = {
+            sku: (product_id, import_hash, image)
+            for sku, product_id, import_hash, image in
+            Product.objects.filter(sku__in=list(batch)).values_list('sku', 'id', 'import_hash', 'image')
+        }
+
+        pending = []
+        for sku, (line_number, data) in batch.items():
+            try:
+                source, digest = self.resolve_image(data['image'])
+            except FileNotFoundError:
+                self.report.error(line_number, 'image: %s not found.' % data['image'])
+                continue
+            except SuspiciousFileOperation:
+                self.report.error(line_number, 'image: %s is outside the media directory.' % data['image'])
+                continue
+            content_hash = hashlib.sha256(
+                json.dumps([str(data[field]) for field in HASH_FIELDS] + [digest]).encode()
+            ).hexdigest()
+            current = existing.get(sku)
+            if current and current[1] == content_hash:
+                self.report.unchanged += 1
+                continue
+            pending.append((line_number, data, source, digest, content_hash, current))
+
+        # Processed images are named after the source digest: rows sharing
+        # an image (e.g. colour variants) are processed once and a row
+        # whose other fields changed keeps its image.
+        images = {}
+        for line_number, data, source, digest, content_hash, current in pending:
+            name = data['image']
+            if source is not None:
+                name = '%s/%s.jpg' % (IMPORT_UPLOAD_TO, digest[:32])
+                if name not in self.images and not default_storage.exists(name):
+                    destination = os.path.join(settings.MEDIA_ROOT, name)
+                    self.images[name] = self.submit(process_image, source, destination)
+            images[data['sku']] = name
+
+        created, updated, replaced_images = [], [], []
+        for line_number, data, source, digest, content_hash, current in pending:
+            image = images[data['sku']]
+            if image in self.images:
+                try:
+                    self.images[image].result()
+                except Exception as e:
+                    self.report.error(line_number, 'image: %s' % e)
+                    continue
+            product = Product(
+                sku=data['sku'], name=data['name'], description=data['description'],
+                category_id=self.category_id(data['category']), size=data['size'], color=data['color'],
+                price=data['price'], stock=data['stock'], image=image, import_hash=content_hash,
+            )
+            if current:
+                product.id = current[0]
+                updated.append(product)
+                if current[2] != image and current[2].startswith(IMPORT_UPLOAD_TO + '/'):
+                    replaced_images.append(current[2])
+            else:
+                created.append(product)
+
+        with transaction.atomic():
+            Product.objects.bulk_create(created)
+            Product.objects.bulk_update(updated, UPDATE_FIELDS)
+            if replaced_images:
+                transaction.on_commit(lambda: self.delete_unused_images(replaced_images))
+        self.report.created += len(created)
+        self.report.updated += len(updated)
+        self.product_ids.extend(product.id for product in created + updated)
+        self.image_names.update(product.image.name for product in created + updated)
+
+    def delete_unused_images(self, names):
+        in_use = set(Product.objects.filter(image__in=names).values_list('image', flat=True))
+        for name in set(names) - in_use:
+            default_storage.delete(name)
+            delete_derivatives(name)
+
+    def submit(self, function, *args):
+        if self.pool is None:
+            return _Done(function, *args)
+        return self.pool.submit(function, *args)
+
+
+class _Done:
+    """Future-like wrapper used when no process pool is given."""
+
+    def __init__(self, function, *args):
+        try:
+            self._result, self._error = function(*args), None
+        except Exception as e:
+            self._result, self._error = None, e
+
+    def result(self):
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+def import_catalog(manifest, name, images=None, workers=None, batch_size=BATCH_SIZE):
+    """
+    Import a manifest file object named ``name`` with images from a directory
+    path or zip file (path or file object). ``workers=0`` processes images
+    in this process.
+    """
+    with image_directory(images) as image_root:
+        if workers == 0:
+            importer = CatalogImporter(image_root, None, batch_size)
+            return importer.run(read_manifest(manifest, name))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            importer = CatalogImporter(image_root, pool, batch_size)
+            return importer.run(read_manifest(manifest, name))
@@ -0,0 +1,67 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum, Window
+from django.utils import timezone
+
+from .models import Cart, CartItem, Order, OrderItem
+from .rollups import record_order
+from .stock import reserve_stock
+
+
+class EmptyCartError(Exception):
+    pass
+
+
+def place_order(session_cart, user, shipping_address, payment_method):
+    """
+    Turn the user's cart into an ``Order`` in one transaction.
+
+    The pipeline issues the same number of queries whatever the size of the
+    cart: lock the cart row, store the live session cart, price all
+    lines and the total in one query, reserve stock with one conditional
+    UPDATE, create the order, ``bulk_create`` its items with their
+    quantities, delete the cart rows and add the order to the sales
+    rollups. Any failure, including ``OutOfStockError``, rolls the whole
+    order back.
+    """
+    money = DecimalField(max_digits=12, decimal_places=2)
+    line_total = ExpressionWrapper(F('product__price') * F('quantity'), output_field=money)
+
+    with transaction.atomic():
+        cart, created = Cart.objects.select_for_update().get_or_create(user=user)
+        session_cart.store(cart)
+
+        cart_items = CartItem.objects.filter(cart=cart)
+        lines = list(
+            cart_items
+            .annotate(line_total=line_total, total_cost=Window(Sum(line_total), output_field=money))
+            .values_list('product_id', 'quantity', 'product__stock', 'line_total', 'total_cost')
+        )
+        if not lines:
+            raise EmptyCartError
+        total_cost = lines[0][4] or Decimal('0.00')
+
+        reserve_stock(
+            {product_id: quantity for product_id, quantity, *_ in lines},
+            {product_id: stock for product_id, _, stock, *_ in lines},
+        )
+
+        order = Order.objects.create(
+            user=user,
+            shipping_address=shipping_address,
+            payment_method=payment_method,
+            ordered_date=timezone.now(),
+            status='ordered',
+            total_cost=total_cost,
+            stock_reserved=True,
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product_id=product_id, quantity=quantity)
+            for product_id, quantity, *_ in lines
+        ])
+        cart_items.delete()
+        record_order(order, [(product_id, quantity, total) for product_id, quantity, _, total, _ in lines])
+
+    session_cart.clear()
+    return order
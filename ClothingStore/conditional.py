@@ -0,0 +1,132 @@
+import hashlib
+import json
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+from .catalog import get_catalog_version, get_product_version
+
+MEDIA_MAX_AGE = 60 * 60 * 24
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+RANGE_CHUNK_SIZE = 64 * 1024
+
+
+def _viewer(request):
+    """
+    What a catalog page shows about the visitor: the account, the cart
+    buttons and the CSRF cookie the page's forms are valid for. ``None``
+    when the page must be rendered: unsafe methods and pending messages,
+    which are consumed by the render.
+    """
+    if request.method not in ('GET', 'HEAD') or len(get_messages(request)):
+        return None
+    return [
+        request.user.pk,
+        sorted(request.cart.quantities().items()),
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+    ]
+
+
+def _etag(*parts):
+    return hashlib.md5(json.dumps(parts, default=str).encode()).hexdigest()
+
+
+def catalog_etag(request, *args, **kwargs):
+    """ETag of catalog listings: the catalog version stamp, the query and the viewer."""
+    viewer = _viewer(request)
+    if viewer is None:
+        return None
+    return _etag('catalog', get_catalog_version(), request.get_full_path(), viewer)
+
+
+def product_etag(request, product_id):
+    """ETag of a product page: the product's own version stamp, the query and the viewer."""
+    viewer = _viewer(request)
+    if viewer is None:
+        return None
+    return _etag('product', product_id, get_product_version(product_id), request.get_full_path(), viewer)
+
+
+def _byte_range(header, size):
+    """
+    Parse a single-range ``Range`` header into ``(start, end)`` inclusive.
+    Returns ``None`` to serve the whole file (no, invalid or multi-range
+    header) and ``(None, None)`` when the range cannot be satisfied.
+    """
+    match = RANGE_RE.match(header or '')
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    first, last = match.groups()
+    if first == '':
+        length = int(last)
+        if length == 0 or size == 0:
+            return None, None
+        return max(size - length, 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        return None, None
+    return start, min(int(last), size - 1) if last else size - 1
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(RANGE_CHUNK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def serve_media(request, path):
+    """
+    Serve an uploaded file from ``MEDIA_ROOT`` with an ``ETag`` and
+    ``Last-Modified`` taken from its stat, answering conditional requests
+    with 304 and single ``Range`` requests with 206.
+    """
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+        stat = os.stat(fullpath)
+    except (OSError, ValueError):
+        raise Http404('No such media file.')
+    if not os.path.isfile(fullpath):
+        raise Http404('No such media file.')
+
+    etag = quote_etag('%x-%x' % (stat.st_mtime_ns, stat.st_size))
+    last_modified = int(stat.st_mtime)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        return response
+
+    size = stat.st_size
+    byte_range = _byte_range(request.headers.get('Range'), size)
+    if_range = request.headers.get('If-Range')
+    if byte_range and if_range and if_range != etag and parse_http_date_safe(if_range) != last_modified:
+        byte_range = None
+
+    content_type = mimetypes.guess_type(fullpath)[0] or 'application/octet-stream'
+    if byte_range is None:
+        response = FileResponse(open(fullpath, 'rb'), content_type=content_type)
+    elif byte_range == (None, None):
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */%d' % size
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(_read_range(fullpath, start, end - start + 1), status=206, content_type=content_type)
+        response['Content-Length'] = end - start + 1
+        response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Accept-Ranges'] = 'bytes'
+    response['Cache-Control'] = 'public, max-age=%d' % MEDIA_MAX_AGE
+    return response
@@ -0,0 +1,142 @@
+import csv
+import datetime
+import zlib
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from .models import Order, OrderItem, Product, User
+
+# Rows fetched from the database cursor per round trip.
+CHUNK_SIZE = 2000
+# Encoded bytes collected before a chunk is handed to the response.
+FLUSH_BYTES = 64 * 1024
+
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+
+class Export:
+    """A flat, ``values_list``-based export of one model."""
+
+    def __init__(self, model, fields, date_field=None):
+        self.model = model
+        self.fields = fields
+        self.date_field = date_field
+
+    @property
+    def header(self):
+        return [field.replace('__', '_') for field in self.fields]
+
+    def rows(self, date_from=None, date_to=None):
+        queryset = self.model._default_manager.all()
+        tz = timezone.get_current_timezone()
+        if self.date_field and date_from:
+            start = datetime.datetime.combine(date_from, datetime.time(), tzinfo=tz)
+            queryset = queryset.filter(**{'%s__gte' % self.date_field: start})
+        if self.date_field and date_to:
+            end = datetime.datetime.combine(date_to + datetime.timedelta(days=1), datetime.time(), tzinfo=tz)
+            queryset = queryset.filter(**{'%s__lt' % self.date_field: end})
+        return queryset.order_by('pk').values_list(*self.fields).iterator(chunk_size=CHUNK_SIZE)
+
+
+EXPORTS = {
+    'orders': Export(Order, (
+        'id', 'user_id', 'user__username', 'ordered_date', 'status', 'total_cost',
+        'payment_method', 'shipping_address',
+    ), date_field='ordered_date'),
+    'order_items': Export(OrderItem, (
+        'id', 'order_id', 'order__ordered_date', 'order__status', 'product_id', 'product__name',
+        'product__price', 'quantity',
+    ), date_field='order__ordered_date'),
+    'products': Export(Product, (
+        'id', 'name', 'category__name', 'size', 'color', 'price', 'stock',
+    )),
+    'users': Export(User, (
+        'id', 'username', 'email', 'first_name', 'last_name', 'contact_number', 'is_staff', 'date_joined',
+    ), date_field='date_joined'),
+}
+
+
+class _Line:
+    """File-like target for ``csv.writer`` that hands back each written line."""
+
+    def write(self, value):
+        return value
+
+
+def _csv_lines(header, rows):
+    writer = csv.writer(_Line())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def _jsonl_lines(header, rows):
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for row in rows:
+        yield encoder.encode(dict(zip(header, row))) + '\n'
+
+
+def _batched(lines):
+    """Join encoded lines into chunks of roughly ``FLUSH_BYTES``."""
+    buffer = []
+    size = 0
+    for line in lines:
+        data = line.encode()
+        buffer.append(data)
+        size += len(data)
+        if size >= FLUSH_BYTES:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def _gzipped(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_export(name, format='csv', compress=True, date_from=None, date_to=None):
+    """
+    Yield the ``name`` export as bytes, optionally gzipped on the fly.
+
+    Rows come straight off a server-side cursor in ``CHUNK_SIZE`` batches
+    and are encoded and compressed as they arrive, so memory stays flat
+    however many rows are exported.
+    """
+    export = EXPORTS[name]
+    encode = _csv_lines if format == 'csv' else _jsonl_lines
+    chunks = _batched(encode(export.header, export.rows(date_from, date_to)))
+    return _gzipped(chunks) if compress else chunks
+
+
+async def astream_export(name, format='csv', compress=True, date_from=None, date_to=None):
+    """
+    ``stream_export`` for ASGI. Django 5.0 collects a sync iterator into a
+    list before sending it from ASGI, so each chunk is produced on the
+    sync thread and sent as soon as it is ready; memory stays flat as well.
+    """
+    chunks = stream_export(name, format, compress, date_from, date_to)
+    next_chunk = sync_to_async(next)
+    try:
+        while (chunk := await next_chunk(chunks, None)) is not None:
+            yield chunk
+    finally:
+        await sync_to_async(chunks.close)()
+
+
+def export_filename(name, format='csv', compress=True, date_from=None, date_to=None):
+    parts = [name]
+    if date_from or date_to:
+        parts.append('%s_%s' % (date_from or 'start', date_to or timezone.localdate()))
+    return '%s.%s%s' % ('-'.join(str(part) for part in parts), format, '.gz' if compress else '')
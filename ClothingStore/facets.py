@@ -0,0 +1,237 @@
+import threading
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+
+from asgiref.sync import sync_to_async
+from django.db import DEFAULT_DB_ALIAS
+
+from .catalog import get_catalog_version
+from .models import Product
+
+# Buckets offered in the price datalist on home.html.
+PRICE_BUCKETS = ((0, 50), (50, 100), (100, 200), (200, 500))
+# "N stars & up" options offered on home.html.
+RATING_FLOORS = (4, 3, 2, 1)
+
+
+def parse_price_range(price):
+    """``(min, max)`` of a "min-max" price filter; ``None`` when absent or not a valid range."""
+    if not price or price == 'Min-Max':
+        return None
+    try:
+        min_price, max_price = (Decimal(bound) for bound in price.split('-'))
+    except (ValueError, InvalidOperation):
+        return None
+    if not (min_price.is_finite() and max_price.is_finite()) or min_price > max_price:
+        return None
+    return min_price, max_price
+
+
+def parse_min_rating(rating):
+    return int(rating) if rating in {str(floor) for floor in RATING_FLOORS} else None
+
+
+class FacetIndex:
+    """
+    In-memory inverted index over the catalog columns home() filters on.
+
+    Every facet value maps to a set of product ids, and prices are kept as a
+    sorted list so arbitrary "min-max" ranges are answered with a bisect.
+    Average ratings are kept the same way for "N stars & up" filters and
+    for sorting by rating. The index is built from the database once and then patched by the
+    Product/Category signals in signals.py; it is rebuilt whenever the
+    catalog version stamp moves on without it.
+    """
+
+    FIELDS = ('category', 'color', 'size')
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._version = None
+        self._clear()
+
+    def _clear(self):
+        self.all_ids = set()
+        self.values = {field: defaultdict(set) for field in self.FIELDS}
+        self.rows = {}
+        self.prices = []
+        self.ratings = {}
+        self.averages = []
+
+    def build(self, version=None):
+        # From the primary even inside replica_reads views: a lagging replica
+        # would be stamped with a catalog version it has not caught up with.
+        rows = Product.objects.using(DEFAULT_DB_ALIAS).values_list(
+            'id', 'category__name', 'color', 'size', 'price', 'rating_count', 'rating_sum')
+        with self._lock:
+            self._clear()
+            for row in rows.iterator():
+                self.prices.append((self._add(*row[:5]), row[0]))
+                self.ratings[row[0]] = row[5:]
+            self.prices.sort()
+            self.averages = sorted(
+                (total / count, product_id) for product_id, (count, total) in self.ratings.items() if count
+            )
+            self._version = version
+
+    def invalidate(self):
+        with self._lock:
+            self._version = None
+
+    def ensure_built(self):
+        # Rebuild when another process has changed the catalog since we built.
+        version = get_catalog_version()
+        if self._version != version:
+            self.build(version)
+
+    def _add(self, product_id, category, color, size, price):
+        price = Decimal(price)
+        self.rows[product_id] = (category, color, size, price)
+        self.all_ids.add(product_id)
+        for field, value in zip(self.FIELDS, (category, color, size)):
+            self.values[field][value].add(product_id)
+        return price
+
+    def _remove(self, product_id):
+        row = self.rows.pop(product_id, None)
+        if row is None:
+            return
+        self.all_ids.discard(product_id)
+        for field, value in zip(self.FIELDS, row[:3]):
+            ids = self.values[field][value]
+            ids.discard(product_id)
+            if not ids:
+                del self.values[field][value]
+        _discard(self.prices, (row[3], product_id))
+        self._remove_rating(product_id)
+
+    def _remove_rating(self, product_id):
+        count, total = self.ratings.pop(product_id, (0, 0))
+        if count:
+            _discard(self.averages, (total / count, product_id))
+
+    def _set_rating(self, product_id, count, total):
+        self._remove_rating(product_id)
+        if product_id not in self.rows:
+            return
+        self.ratings[product_id] = (count, total)
+        if count:
+            insort(self.averages, (total / count, product_id))
+
+    def update_product(self, product, version):
+        with self._lock:
+            # Only patch in place if ours was the sole change since the build.
+            if self._version != version - 1:
+                self._version = None
+                return
+            # Ratings move through update_rating(); the instance's copy may be stale.
+            rating = self.ratings.get(product.pk, (product.rating_count, product.rating_sum))
+            self._remove(product.pk)
+            price = self._add(product.pk, product.category.name, product.color, product.size, product.price)
+            insort(self.prices, (price, product.pk))
+            self._set_rating(product.pk, *rating)
+            self._version = version
+
+    def update_rating(self, product_id, count_delta, sum_delta, version):
+        """Apply one review change that moved the catalog to ``version``."""
+        with self._lock:
+            if self._version != version - 1:
+                self._version = None
+                return
+            count, total = self.ratings.get(product_id, (0, 0))
+            self._set_rating(product_id, count + count_delta, total + sum_delta)
+            self._version = version
+
+    def remove_product(self, product_id, version):
+        with self._lock:
+            if self._version != version - 1:
+                self._version = None
+                return
+            self._remove(product_id)
+            self._version = version
+
+    def _price_ids(self, price_range):
+        min_price, max_price = price_range
+        lo = bisect_left(self.prices, (Decimal(min_price), 0))
+        hi = bisect_right(self.prices, (Decimal(max_price), float('inf')))
+        return {product_id for _, product_id in self.prices[lo:hi]}
+
+    def _rating_ids(self, min_rating):
+        lo = bisect_left(self.averages, (min_rating, 0))
+        return {product_id for _, product_id in self.averages[lo:]}
+
+    def _average(self, product_id):
+        count, total = self.ratings.get(product_id, (0, 0))
+        return total / count if count else 0
+
+    def _matching(self, filters, skip=None):
+        result = None
+        for field, value in filters.items():
+            if field == skip or not value:
+                continue
+            if field == 'price':
+                ids = self._price_ids(value)
+            elif field == 'rating':
+                ids = self._rating_ids(value)
+            else:
+                ids = self.values[field].get(value, set())
+            result = ids.copy() if result is None else result & ids
+            if not result:
+                break
+        return self.all_ids if result is None else result
+
+    def query(self, category='', color='', size='', price_range=None, min_rating=None, sort=''):
+        """
+        Return ``(sort_key, id)`` pairs for every match in ascending order,
+        plus per-facet counts.
+
+        The sort key is the id itself, or the negated average rating when
+        ``sort == 'rating'``. Each facet's counts are computed against the
+        other active filters, so the sidebar shows how many products
+        selecting that value would give.
+        """
+        self.ensure_built()
+        return self._query(category, color, size, price_range, min_rating, sort)
+
+    async def aquery(self, category='', color='', size='', price_range=None, min_rating=None, sort=''):
+        """``query`` for async views: a rebuild reads every product, so it runs in a thread."""
+        if self._version != get_catalog_version():
+            await sync_to_async(self.ensure_built)()
+        return self._query(category, color, size, price_range, min_rating, sort)
+
+    def _query(self, category, color, size, price_range, min_rating, sort):
+        filters = {'category': category, 'color': color, 'size': size, 'price': price_range, 'rating': min_rating}
+        with self._lock:
+            matching = self._matching(filters)
+            if sort == 'rating':
+                keys = sorted((-self._average(product_id), product_id) for product_id in matching)
+            else:
+                keys = [(product_id, product_id) for product_id in sorted(matching)]
+            counts = {}
+            for field in self.FIELDS:
+                base = self._matching(filters, skip=field)
+                counts[field] = {
+                    value: len(base & value_ids)
+                    for value, value_ids in self.values[field].items()
+                }
+            base = self._matching(filters, skip='price')
+            counts['price'] = [
+                {'min': low, 'max': high, 'count': len(base & self._price_ids((low, high)))}
+                for low, high in PRICE_BUCKETS
+            ]
+            base = self._matching(filters, skip='rating')
+            counts['rating'] = [
+                {'min': floor, 'count': len(base & self._rating_ids(floor))}
+                for floor in RATING_FLOORS
+            ]
+        return keys, counts
+
+
+def _discard(entries, entry):
+    pos = bisect_left(entries, entry)
+    if pos < len(entries) and entries[pos] == entry:
+        del entries[pos]
+
+
+facet_index = FacetIndex()
@@ -36,3 +36,25 @@ class CheckoutForm(forms.Form):
         ('cash_on_delivery', 'Cash on Delivery'),
         ('card', 'Credit Card')
     ], required=True)
+
+class ProductImportRowForm(forms.Form):
+    """Validates one row of a catalog import manifest."""
+    sku = forms.CharField(max_length=64)
+    name = forms.CharField(max_length=255)
+    description = forms.CharField()
+    category = forms.CharField(max_length=255)
+    size = forms.CharField(max_length=1)
+    color = forms.CharField(max_length=50)
+    price = forms.DecimalField(max_digits=10, decimal_places=2, min_value=0)
+    stock = forms.IntegerField(min_value=0, required=False)
+    image = forms.CharField(max_length=255)
+
+    def clean_color(self):
+        return self.cleaned_data['color'].lower()
+
+    def clean_size(self):
+        return self.cleaned_data['size'].upper()
+
+class ProductImportForm(forms.Form):
+    manifest = forms.FileField(help_text='CSV or JSON Lines, one product per row.')
+    images = forms.FileField(required=False, help_text='Zip archive with the images the manifest names.')
@@ -0,0 +1,56 @@
+import hashlib
+import re
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.template.loader import render_to_string
+from django.utils.http import urlencode
+from django.utils.safestring import mark_safe
+
+from .catalog import get_catalog_version
+from .models import Product
+from .pagination import KeysetPage, apaginate_keys, decode_cursor
+
+GRID_CACHE_TIMEOUT = 60 * 60
+CART_BUTTON_RE = re.compile(r'<!-- cart-button:(\d+) -->')
+
+
+def grid_cache_key(version, filters, cursor):
+    params = urlencode(sorted(filters.items()) + [('cursor', cursor or '')])
+    return 'product_grid:%s:%s' % (version, hashlib.md5(params.encode()).hexdigest())
+
+
+async def acached_product_grid(request, filters, keys):
+    """
+    Return the rendered product grid for one page and its ``KeysetPage``.
+
+    The fragment is shared by every visitor: it is keyed by the normalized
+    filters, the page cursor and the catalog version stamp, so any catalog
+    change makes old entries unreachable instead of having to delete them.
+    Per-user markup is left as ``<!-- cart-button:<id> -->`` placeholders for
+    ``layer_cart_buttons``.
+    """
+    cursor = decode_cursor(request.GET.get('cursor'))
+    key = grid_cache_key(get_catalog_version(), filters, cursor)
+    # Django's async cache API is a thread hop per call; the local-memory
+    # cache, like the version stamp lookup above, never blocks.
+    fragment = cache.get(key)
+    if fragment is None:
+        # Rendered from the primary, as the keys come from the facet index:
+        # a replica's rows may be older than the version the entry is keyed by.
+        page = await apaginate_keys(request, keys, Product.objects.using(DEFAULT_DB_ALIAS))
+        fragment = (render_to_string('product_grid.html', {'products': page}), page.next_cursor)
+        cache.set(key, fragment, GRID_CACHE_TIMEOUT)
+    html, next_cursor = fragment
+    return html, KeysetPage(request, [], next_cursor)
+
+
+def layer_cart_buttons(request, html, cart_product_ids):
+    def cart_button(match):
+        product_id = int(match.group(1))
+        return render_to_string('cart_button.html', {
+            'product_id': product_id,
+            'in_cart': product_id in cart_product_ids,
+        }, request=request)
+
+    return mark_safe(CART_BUTTON_RE.sub(cart_button, html))
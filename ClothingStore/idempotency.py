@@ -0,0 +1,79 @@
+import uuid
+from datetime import timedelta
+from functools import wraps
+
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, HttpResponseRedirect
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+IDEMPOTENCY_FIELD = 'idempotency_key'
+IDEMPOTENCY_TTL = 24 * 60 * 60
+
+
+def new_idempotency_key():
+    return uuid.uuid4().hex
+
+
+def _claim(key):
+    """
+    Claim ``key`` with a plain INSERT. The unique constraint makes exactly
+    one of several concurrent requests win; a claim older than the TTL is
+    replaced. Return ``None`` on success, or the losing side's row.
+    """
+    cutoff = timezone.now() - timedelta(seconds=IDEMPOTENCY_TTL)
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                IdempotencyKey.objects.create(key=key)
+            return None
+        except IntegrityError:
+            claim = IdempotencyKey.objects.filter(key=key).first()
+            if claim is not None and claim.created_at >= cutoff:
+                return claim
+            IdempotencyKey.objects.filter(key=key, created_at__lt=cutoff).delete()
+    return IdempotencyKey(key=key)
+
+
+def purge_expired_keys():
+    """Delete the claims older than the TTL; return how many went."""
+    cutoff = timezone.now() - timedelta(seconds=IDEMPOTENCY_TTL)
+    return IdempotencyKey.objects.filter(created_at__lt=cutoff).delete()[0]
+
+
+def idempotent(view):
+    """
+    Make a POST view safe to retry.
+
+    Forms carry a one-off ``idempotency_key``. The first request with a key
+    claims it by inserting an ``IdempotencyKey`` row, runs the view and
+    records the redirect it produced. A replay of the same key gets that
+    redirect back without the view (and so without any order writes)
+    running again. A replay that arrives while the first request is still
+    in flight gets a 409.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.POST.get(IDEMPOTENCY_FIELD) if request.method == 'POST' else None
+        if not key:
+            return view(request, *args, **kwargs)
+
+        claim_key = '%s:%s:%s' % (view.__name__, request.user.pk, key[:64])
+        claim = _claim(claim_key)
+        if claim is not None:
+            if claim.location:
+                return HttpResponseRedirect(claim.location)
+            return HttpResponse('This request is already being processed.', status=409)
+
+        try:
+            response = view(request, *args, **kwargs)
+        except Exception:
+            IdempotencyKey.objects.filter(key=claim_key).delete()
+            raise
+        if response.status_code in (301, 302, 303):
+            IdempotencyKey.objects.filter(key=claim_key).update(location=response['Location'])
+        else:
+            IdempotencyKey.objects.filter(key=claim_key).delete()
+        return response
+    return wrapper
@@ -0,0 +1,176 @@
+import logging
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from PIL import ExifTags, Image, ImageOps
+
+from .catalog import bump_catalog_version, touch_products
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+# Rendered widths in pixels; images narrower than a width get one at their own width.
+DERIVATIVE_WIDTHS = (160, 320, 640, 1280)
+# (extension, Pillow format, save options), preferred format first.
+DERIVATIVE_FORMATS = (
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    ('jpg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+DERIVATIVE_ROOT = 'derivatives'
+# Background processes used for uploads made through the staff views.
+DERIVATIVE_WORKERS = 2
+UPDATE_BATCH = 500
+
+_pool = None
+
+
+def derivative_directory(name):
+    return '%s/%s' % (DERIVATIVE_ROOT, os.path.splitext(name)[0])
+
+
+def derivative_name(name, width, extension):
+    """Storage name of the ``width`` pixel ``extension`` derivative of image ``name``."""
+    return '%s/%dw.%s' % (derivative_directory(name), width, extension)
+
+
+def derivative_widths(original_width):
+    return sorted({min(width, original_width) for width in DERIVATIVE_WIDTHS})
+
+
+def srcset(name, widths, extension):
+    return ', '.join(
+        '%s %dw' % (default_storage.url(derivative_name(name, width, extension)), width) for width in widths
+    )
+
+
+def generate_derivatives(media_root, name, force=False):
+    """
+    Write the WebP and JPEG derivatives of the stored image ``name`` and
+    return their widths. Runs in a worker process, so it only touches files,
+    never the database.
+
+    EXIF orientation is applied and all metadata (EXIF, ICC, comments) is
+    dropped. Large JPEGs are decoded at a reduced DCT scale, which makes the
+    decode of a multi-megapixel photo several times cheaper.
+    """
+    with Image.open(os.path.join(media_root, name)) as image:
+        width, height = image.size
+        if image.getexif().get(ExifTags.Base.Orientation) in (5, 6, 7, 8):
+            width, height = height, width
+        widths = derivative_widths(width)
+        targets = [
+            (size, os.path.join(media_root, derivative_name(name, size, extension)), format, options)
+            for size in widths for extension, format, options in DERIVATIVE_FORMATS
+        ]
+        if not force and all(os.path.exists(path) for _, path, _, _ in targets):
+            return widths
+
+        largest = widths[-1]
+        image.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        for size, path, format, options in targets:
+            resized = image.resize((size, max(1, round(image.height * size / image.width))), Image.LANCZOS, reducing_gap=3.0)
+            resized.info = {}
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            resized.save(path, format, **options)
+    return widths
+
+
+def record_derivatives(widths_by_name):
+    """Store the derivative widths of every product showing each image."""
+    names_by_widths = defaultdict(list)
+    for name, widths in widths_by_name.items():
+        names_by_widths[tuple(widths)].append(name)
+    for widths, names in names_by_widths.items():
+        for start in range(0, len(names), UPDATE_BATCH):
+            products = Product.objects.filter(image__in=names[start:start + UPDATE_BATCH])
+            products.update(image_widths=list(widths))
+            touch_products(products.values_list('id', flat=True))
+    if widths_by_name:
+        bump_catalog_version()
+
+
+def build_derivatives(names, pool=None, force=False):
+    """
+    Generate and record derivatives for image ``names``, in ``pool`` when
+    given. Returns ``(recorded, failures)`` where failures are ``(name, error)``;
+    products whose image failed keep showing the original.
+    """
+    media_root = str(settings.MEDIA_ROOT)
+    futures = {}
+    for name in names:
+        if pool is None:
+            futures[name] = partial(generate_derivatives, media_root, name, force)
+        else:
+            futures[name] = pool.submit(generate_derivatives, media_root, name, force).result
+    widths_by_name, failures = {}, []
+    for name, result in futures.items():
+        try:
+            widths_by_name[name] = result()
+        except Exception as e:
+            logger.warning('Could not generate derivatives of %s: %s', name, e)
+            failures.append((name, e))
+    record_derivatives(widths_by_name)
+    return len(widths_by_name), failures
+
+
+def delete_derivatives(name):
+    directory = derivative_directory(name)
+    try:
+        _, files = default_storage.listdir(directory)
+    except FileNotFoundError:
+        return
+    for filename in files:
+        default_storage.delete('%s/%s' % (directory, filename))
+
+
+def schedule_derivative_cleanup(name):
+    """
+    Delete the derivatives of replaced image ``name`` once the current
+    transaction commits, unless another product still shows the image.
+    """
+    def cleanup():
+        if not Product.objects.filter(image=name).exists():
+            delete_derivatives(name)
+
+    transaction.on_commit(cleanup)
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=DERIVATIVE_WORKERS)
+    return _pool
+
+
+def _derivatives_done(name, future):
+    # Runs on the pool's result thread, which has its own connection.
+    try:
+        record_derivatives({name: future.result()})
+    except Exception:
+        logger.exception('Could not generate derivatives of %s', name)
+    finally:
+        connections.close_all()
+
+
+def schedule_derivatives(name):
+    """
+    Generate the derivatives of a newly uploaded image in the background
+    once the current transaction commits. Until they are recorded the
+    templates fall back to the original image.
+    """
+    def submit():
+        if not DERIVATIVE_WORKERS:
+            build_derivatives([name])
+            return
+        _get_pool().submit(generate_derivatives, str(settings.MEDIA_ROOT), name).add_done_callback(
+            partial(_derivatives_done, name))
+
+    transaction.on_commit(submit)
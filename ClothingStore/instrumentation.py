@@ -0,0 +1,262 @@
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.template.backends.django import DjangoTemplates, Template
+
+from .middleware import HybridMiddleware
+
+# Upper bounds of the histogram buckets; the last bucket is open-ended.
+DURATION_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500)
+QUERY_BUCKETS = (1, 5, 10, 25, 50, 100)
+# The same statement this many times in one request is reported as an N+1.
+N_PLUS_ONE_THRESHOLD = 5
+# Repeated statements kept per view, most frequent first.
+MAX_FINGERPRINTS = 10
+FINGERPRINT_LENGTH = 300
+
+IN_LIST_RE = re.compile(r'\bIN \((?:%s, )*%s\)')
+LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+SPACE_RE = re.compile(r'\s+')
+
+_sample = ContextVar('request_sample', default=None)
+
+
+def fingerprint(sql, length=FINGERPRINT_LENGTH):
+    """``sql`` with its values and IN-list lengths removed, so repeats of one statement compare equal."""
+    sql = IN_LIST_RE.sub('IN (...)', sql)
+    sql = LITERAL_RE.sub('?', sql)
+    return SPACE_RE.sub(' ', sql).strip()[:length]
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Execute wrapper of every database connection: hands the query to the
+    current request's sample, if it is sampled. The sample travels in a
+    context variable, so queries run by ``sync_to_async`` on behalf of an
+    async view are recorded too.
+    """
+    sample = _sample.get()
+    if sample is None:
+        return execute(sql, params, many, context)
+    return sample(execute, sql, params, many, context)
+
+
+@receiver(connection_created)
+def install_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def _bucket(bounds, value):
+    for index, bound in enumerate(bounds):
+        if value <= bound:
+            return index
+    return len(bounds)
+
+
+class RequestSample:
+    """Queries and render time of one sampled request."""
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.statements = Counter()
+        self.render_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - started
+            self.queries += 1
+            self.statements[sql] += 1
+
+    def repeated(self):
+        repeated = Counter()
+        for sql, count in self.statements.items():
+            if count >= N_PLUS_ONE_THRESHOLD:
+                repeated[fingerprint(sql)] += count
+        return repeated
+
+
+class ViewMetrics:
+    def __init__(self):
+        self.requests = 0
+        self.sampled = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.queries = 0
+        self.max_queries = 0
+        self.durations = [0] * (len(DURATION_BUCKETS_MS) + 1)
+        self.query_counts = [0] * (len(QUERY_BUCKETS) + 1)
+        # Fingerprint -> (sampled requests that repeated it, most repeats in one).
+        self.n_plus_one = {}
+
+    def record(self, sample, elapsed):
+        self.sampled += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        self.sql_time += sample.sql_time
+        self.template_time += sample.template_time
+        self.queries += sample.queries
+        self.max_queries = max(self.max_queries, sample.queries)
+        self.durations[_bucket(DURATION_BUCKETS_MS, elapsed * 1000)] += 1
+        self.query_counts[_bucket(QUERY_BUCKETS, sample.queries)] += 1
+        for statement, count in sample.repeated().items():
+            requests, most = self.n_plus_one.get(statement, (0, 0))
+            self.n_plus_one[statement] = (requests + 1, max(most, count))
+        if len(self.n_plus_one) > MAX_FINGERPRINTS * 5:
+            self.n_plus_one = dict(self._top_n_plus_one())
+
+    def _top_n_plus_one(self):
+        return sorted(self.n_plus_one.items(), key=lambda item: item[1], reverse=True)[:MAX_FINGERPRINTS]
+
+    def percentile_ms(self, fraction):
+        """Upper bound of the duration bucket holding the ``fraction`` quantile."""
+        threshold = fraction * self.sampled
+        seen = 0
+        for bound, count in zip(DURATION_BUCKETS_MS + (None,), self.durations):
+            seen += count
+            if seen >= threshold and count:
+                return bound
+        return None
+
+    def as_dict(self, name):
+        sampled = self.sampled or 1
+        return {
+            'view': name,
+            'requests': self.requests,
+            'sampled': self.sampled,
+            'avg_ms': round(self.total_time * 1000 / sampled, 1),
+            'max_ms': round(self.max_time * 1000, 1),
+            'p50_ms': self.percentile_ms(0.5),
+            'p95_ms': self.percentile_ms(0.95),
+            'avg_queries': round(self.queries / sampled, 1),
+            'max_queries': self.max_queries,
+            'avg_sql_ms': round(self.sql_time * 1000 / sampled, 1),
+            'avg_template_ms': round(self.template_time * 1000 / sampled, 1),
+            'duration_histogram': dict(zip(['<=%d' % bound for bound in DURATION_BUCKETS_MS] + ['>%d' % DURATION_BUCKETS_MS[-1]], self.durations)),
+            'query_histogram': dict(zip(['<=%d' % bound for bound in QUERY_BUCKETS] + ['>%d' % QUERY_BUCKETS[-1]], self.query_counts)),
+            'n_plus_one': [
+                {'sql': statement, 'requests': requests, 'max_repeats': most}
+                for statement, (requests, most) in self._top_n_plus_one()
+            ],
+        }
+
+
+class MetricsRegistry:
+    """Per URL name request metrics of this process, kept in memory."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+        self.started = time.time()
+
+    def record(self, name, sample, elapsed):
+        with self._lock:
+            view = self._views.setdefault(name, ViewMetrics())
+            view.requests += 1
+            if sample is not None:
+                view.record(sample, elapsed)
+
+    def snapshot(self):
+        """Views as dicts, the ones taking the most total time first."""
+        with self._lock:
+            views = sorted(self._views.items(), key=lambda item: item[1].total_time, reverse=True)
+            return {
+                'since': self.started,
+                'sample_rate': sample_rate(),
+                'views': [view.as_dict(name) for name, view in views],
+            }
+
+    def reset(self):
+        with self._lock:
+            self._views = {}
+            self.started = time.time()
+
+
+metrics = MetricsRegistry()
+
+
+def sample_rate():
+    return getattr(settings, 'METRICS_SAMPLE_RATE', 0)
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<unresolved>'
+    return match.view_name or match._func_path
+
+
+class InstrumentationMiddleware(HybridMiddleware):
+    """
+    Record, for a ``METRICS_SAMPLE_RATE`` share of requests, the query count,
+    SQL time, template render time and repeated statements, aggregated per
+    URL name in ``metrics``. Unsampled requests are only counted.
+    """
+
+    def start(self):
+        if random.random() >= sample_rate():
+            return None, None
+        sample = RequestSample()
+        return sample, _sample.set(sample)
+
+    def finish(self, request, sample, token, started):
+        elapsed = time.perf_counter() - started
+        if sample is not None:
+            _sample.reset(token)
+        metrics.record(_view_name(request), sample, elapsed)
+
+    def handle(self, request):
+        started = time.perf_counter()
+        sample, token = self.start()
+        try:
+            return self.get_response(request)
+        finally:
+            self.finish(request, sample, token, started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        sample, token = self.start()
+        try:
+            return await self.get_response(request)
+        finally:
+            self.finish(request, sample, token, started)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        sample = _sample.get()
+        if sample is None:
+            return super().render(context, request)
+        # Templates rendered while rendering (e.g. by a tag) are already timed.
+        sample.render_depth += 1
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            sample.render_depth -= 1
+            if not sample.render_depth:
+                sample.template_time += time.perf_counter() - started
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, timing renders of sampled requests."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
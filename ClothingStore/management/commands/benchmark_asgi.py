@@ -0,0 +1,216 @@
+import asyncio
+import io
+import multiprocessing
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from importlib import import_module
+from wsgiref.util import setup_testing_defaults
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.db import connections
+from django.test import override_settings
+from django.urls import reverse
+
+from ClothingStore import search
+from ClothingStore.catalog import bump_catalog_version
+from ClothingStore.management.scratch import scratch_database, status_kb
+from ClothingStore.models import Category, Order, Product, User
+
+PAGES = ('home', 'product_search', 'product_detail', 'order_history')
+WARMUP_REQUESTS = 50
+COLORS = ('red', 'blue', 'black', 'white', 'green')
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+def _wsgi_requests(requests, concurrency, cookie):
+    application = get_wsgi_application()
+
+    def call(path, query):
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query,
+            'HTTP_HOST': 'testserver', 'HTTP_COOKIE': cookie, 'wsgi.input': io.BytesIO(),
+        }
+        setup_testing_defaults(environ)
+        status = []
+        started = time.perf_counter()
+        body = application(environ, lambda code, headers, exc_info=None: status.append(int(code[:3])))
+        try:
+            for _ in body:
+                pass
+        finally:
+            body.close()
+        return status[0], time.perf_counter() - started
+
+    for path, query in requests[:WARMUP_REQUESTS]:
+        call(path, query)
+    # Like a threaded WSGI server: one thread per concurrent request.
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        started = time.perf_counter()
+        results = list(pool.map(lambda request: call(*request), requests))
+        elapsed = time.perf_counter() - started
+        threads = threading.active_count()
+    return results, elapsed, threads
+
+
+def _asgi_requests(requests, concurrency, cookie):
+    application = get_asgi_application()
+
+    async def call(path, query):
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+            'root_path': '', 'headers': [(b'host', b'testserver'), (b'cookie', cookie.encode())],
+            'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+        }
+        sent = False
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            # The client stays connected until Django stops listening.
+            await asyncio.Event().wait()
+
+        status = []
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+
+        started = time.perf_counter()
+        await application(scope, receive, send)
+        return status[0], time.perf_counter() - started
+
+    async def run():
+        for path, query in requests[:WARMUP_REQUESTS]:
+            await call(path, query)
+        pending = iter(requests)
+        results = []
+
+        # Like an ASGI server: every concurrent request is a task on one loop.
+        async def worker():
+            for path, query in pending:
+                results.append(await call(path, query))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return results, time.perf_counter() - started, threading.active_count()
+
+    return asyncio.run(run())
+
+
+def _measure(mode, requests, concurrency, cookie, results):
+    """Serve ``requests`` through one handler in a forked child so its peak RSS is its own."""
+    baseline = status_kb('VmRSS')
+    run = _wsgi_requests if mode == 'wsgi' else _asgi_requests
+    responses, elapsed, threads = run(requests, concurrency, cookie)
+    connections.close_all()
+    results.put((responses, elapsed, threads, status_kb('VmHWM') - baseline))
+
+
+class Command(BaseCommand):
+    help = (
+        'Serve the same mix of catalog and order history requests through the '
+        'WSGI and the ASGI handler at high concurrency, each in its own process, '
+        'and report requests per second, latency, peak memory and threads.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=100, help='Requests in flight at once.')
+        parser.add_argument('--requests', type=int, default=3000)
+        parser.add_argument('--products', type=int, default=500)
+        parser.add_argument('--mix', default='home=4,product_search=2,product_detail=3,order_history=1',
+                            help='Relative weight of each page.')
+
+    def handle(self, *args, **options):
+        try:
+            mix = {name: int(weight) for name, weight in (part.split('=') for part in options['mix'].split(','))}
+        except ValueError:
+            raise CommandError('--mix must look like home=4,product_search=2,product_detail=3,order_history=1.')
+        if set(mix) - set(PAGES):
+            raise CommandError('--mix pages must be among: %s.' % ', '.join(PAGES))
+
+        caches = dict(settings.CACHES)
+        caches['sessions'] = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark_sessions'}
+        with override_settings(CACHES=caches, ALLOWED_HOSTS=settings.ALLOWED_HOSTS + ['testserver']), \
+                scratch_database('benchmark_asgi_'):
+            product_ids, cookie = self.seed(options)
+            requests = self.requests(mix, product_ids, options['requests'])
+            self.stdout.write('%-5s %9s %9s %8s %9s %9s %9s %15s %8s' % (
+                'mode', 'requests', 'time (s)', 'req/s', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)', 'peak RSS (MB)', 'threads'))
+            for mode in ('wsgi', 'asgi'):
+                self.report(mode, *self.measure(mode, requests, options['concurrency'], cookie))
+
+    def seed(self, options):
+        categories = [Category.objects.create(name=name) for name in ('female', 'male', 'kids')]
+        products = Product.objects.bulk_create([
+            Product(
+                name='Benchmark %s shirt %d' % (COLORS[i % len(COLORS)], i), description='Cotton shirt for the benchmark',
+                image='products/red.jpeg', category=categories[i % len(categories)], size='SML'[i % 3],
+                color=COLORS[i % len(COLORS)], price=Decimal(10 + i % 90), stock=100,
+            )
+            for i in range(options['products'])
+        ])
+        user = User.objects.create(username='benchmark', password='!')
+        Order.objects.bulk_create([
+            Order(user=user, shipping_address='1 Benchmark Road', payment_method='card', total_cost=Decimal('19.99'))
+            for _ in range(30)
+        ])
+        search.reindex_products([product.id for product in products])
+        bump_catalog_version()
+
+        store = import_module(settings.SESSION_ENGINE).SessionStore()
+        store[SESSION_KEY] = str(user.pk)
+        store[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+        store[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        store.create()
+        return [product.id for product in products], '%s=%s' % (settings.SESSION_COOKIE_NAME, store.session_key)
+
+    def requests(self, mix, product_ids, count):
+        rng = random.Random(0)
+        pages = list(mix)
+        weights = [mix[page] for page in pages]
+        requests = []
+        for page in rng.choices(pages, weights, k=count):
+            if page == 'home':
+                requests.append((reverse('home'), rng.choice(['', 'color=%s' % rng.choice(COLORS), 'size=M'])))
+            elif page == 'product_search':
+                requests.append((reverse('product_search'), 'q=%s+shirt' % rng.choice(COLORS)))
+            elif page == 'product_detail':
+                requests.append((reverse('product_detail', args=[rng.choice(product_ids)]), ''))
+            else:
+                requests.append((reverse('order_history'), ''))
+        return requests
+
+    def measure(self, mode, requests, concurrency, cookie):
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        process = context.Process(target=_measure, args=(mode, requests, concurrency, cookie, results))
+        process.start()
+        result = results.get()
+        process.join()
+        return result
+
+    def report(self, mode, responses, elapsed, threads, peak):
+        failed = sum(1 for status, _ in responses if status != 200)
+        if failed:
+            self.stderr.write('%s: %d responses were not 200 OK.' % (mode, failed))
+        latencies = [latency for _, latency in responses]
+        self.stdout.write('%-5s %9d %9.2f %8.1f %9.1f %9.1f %9.1f %15.1f %8d' % (
+            mode, len(responses), elapsed, len(responses) / elapsed,
+            _percentile(latencies, 0.5) * 1000, _percentile(latencies, 0.95) * 1000, _percentile(latencies, 0.99) * 1000,
+            peak / 1024, threads,
+        ))
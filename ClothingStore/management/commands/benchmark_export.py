@@ -0,0 +1,95 @@
+import multiprocessing
+import os
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from ClothingStore.exports import EXPORTS, stream_export
+from ClothingStore.management.scratch import scratch_database, status_kb
+from ClothingStore.models import Category, Order, OrderItem, Product, User
+
+SEED_BATCH = 5000
+
+
+def _measure(name, naive, results):
+    """Run one export in a forked child so its peak RSS is its own."""
+    baseline = status_kb('VmRSS')
+    started = time.perf_counter()
+    # What loading the whole table first costs: every row held at once.
+    rows = list(EXPORTS[name].rows()) if naive else None
+    size = 0
+    with open(os.devnull, 'wb') as output:
+        for chunk in stream_export(name, 'csv', compress=True):
+            output.write(chunk)
+            size += len(chunk)
+    elapsed = time.perf_counter() - started
+    del rows
+    connections.close_all()
+    results.put((status_kb('VmHWM') - baseline, elapsed, size))
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed growing numbers of orders into a throwaway SQLite database and '
+        'report the peak RSS and time of a streaming gzip CSV export at each size.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', default='10000,100000,500000', help='Comma-separated order counts to measure.')
+        parser.add_argument('--export', choices=sorted(EXPORTS), default='order_items')
+        parser.add_argument('--naive', action='store_true', help='Also measure loading every row into memory first.')
+
+    def handle(self, *args, **options):
+        try:
+            counts = sorted(int(count) for count in options['rows'].split(','))
+        except ValueError:
+            raise CommandError('--rows must be a comma-separated list of integers.')
+
+        with scratch_database('benchmark_export_'):
+            seeded = 0
+            self.stdout.write('%10s  %-9s  %14s  %9s  %12s' % ('orders', 'mode', 'peak RSS (MB)', 'time (s)', 'output (MB)'))
+            for count in counts:
+                seeded = self.seed(seeded, count)
+                modes = [('streaming', False)] + ([('naive', True)] if options['naive'] else [])
+                for mode, naive in modes:
+                    peak, elapsed, size = self.measure(options['export'], naive)
+                    self.stdout.write('%10d  %-9s  %14.1f  %9.2f  %12.1f' % (
+                        count, mode, peak / 1024, elapsed, size / 1024 / 1024))
+
+    def seed(self, seeded, count):
+        if not seeded:
+            category = Category.objects.create(name='benchmark')
+            Product.objects.bulk_create([
+                Product(
+                    name='Benchmark product %d' % i, description='Benchmark', image='products/red.jpeg',
+                    category=category, size='M', color='red', price=Decimal('19.99'),
+                )
+                for i in range(100)
+            ])
+            User.objects.create(username='benchmark', password='!')
+        user = User.objects.get(username='benchmark')
+        product_ids = list(Product.objects.values_list('id', flat=True))
+        while seeded < count:
+            batch = min(SEED_BATCH, count - seeded)
+            orders = Order.objects.bulk_create([
+                Order(user=user, shipping_address='1 Benchmark Road', payment_method='card', total_cost=Decimal('39.98'))
+                for _ in range(batch)
+            ])
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product_id=product_ids[(seeded + i) % len(product_ids)], quantity=2)
+                for i, order in enumerate(orders)
+            ])
+            seeded += batch
+        return seeded
+
+    def measure(self, name, naive):
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        process = context.Process(target=_measure, args=(name, naive, results))
+        process.start()
+        result = results.get()
+        process.join()
+        return result
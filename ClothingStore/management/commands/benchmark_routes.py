@@ -0,0 +1,415 @@
+import http.client
+import io
+import json
+import logging
+import random
+import tempfile
+import threading
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from decimal import Decimal
+from importlib import import_module
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+from django.db import connections
+from django.test import Client, override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.urls import URLPattern, reverse
+from django.utils.crypto import get_random_string
+from PIL import Image
+
+from ClothingStore import urls
+from ClothingStore.exports import EXPORTS
+from ClothingStore.instrumentation import metrics
+from ClothingStore.management.scratch import scratch_database
+from ClothingStore.management.seeding import COLORS, SEED_PASSWORD, seed_store
+from ClothingStore.models import Category, Order, OrderItem, Product, User
+
+WARMUP_REQUESTS = 5
+# Orders moved per bulk_update_order_status request.
+BULK_ORDERS = 10
+
+# One request of a route: which session sends it, and where.
+Request = namedtuple('Request', 'session method path data')
+
+
+def _upload():
+    image = io.BytesIO()
+    Image.new('RGB', (64, 64), 'red').save(image, 'JPEG')
+    return SimpleUploadedFile('benchmark.jpg', image.getvalue(), content_type='image/jpeg')
+
+
+def _product_form(store, rng):
+    return {
+        'name': 'Benchmark %s shirt' % rng.choice(COLORS), 'description': 'Added by the benchmark',
+        'category_id': rng.choice(store.category_ids), 'size': rng.choice('SML'), 'color': rng.choice(COLORS),
+        'price': '%d.99' % rng.randint(5, 99), 'stock': rng.randint(0, 100),
+    }
+
+
+# How each named route of ClothingStore/urls.py is driven. Routes that
+# delete or move rows take a fresh target per request from the pools the
+# benchmark seeds for them.
+ROUTES = {
+    'home': lambda store, rng: Request('anonymous', 'GET', reverse('home'), rng.choice([
+        {}, {'color': rng.choice(COLORS)}, {'size': rng.choice('SML')}, {'color': rng.choice(COLORS), 'size': 'M'},
+    ])),
+    'login': lambda store, rng: Request('anonymous', 'POST', reverse('login'), {
+        'username': store.customer.username, 'password': SEED_PASSWORD,
+    }),
+    'logout': lambda store, rng: Request('fresh', 'GET', reverse('logout'), {}),
+    'signup': lambda store, rng: Request('anonymous', 'POST', reverse('signup'), {
+        'username': 'benchmark-signup-%d' % store.take('signups'), 'email': 'signup@example.com',
+        'dob': '1990-01-01', 'contact_number': '5550000', 'address': '1 Benchmark Road',
+        'password1': 'tailored-linen-2024', 'password2': 'tailored-linen-2024',
+    }),
+    'forgot_password': lambda store, rng: Request('anonymous', 'POST', reverse('forgot_password'), {
+        'username': store.forgetful.username, 'dob': store.forgetful.dob.isoformat(),
+        'new_password': SEED_PASSWORD, 'confirm_password': SEED_PASSWORD,
+    }),
+    'profile': lambda store, rng: Request('customer', 'GET', reverse('profile'), {}),
+    'edit_profile': lambda store, rng: Request('customer', 'GET', reverse('edit_profile'), {}),
+    'cart': lambda store, rng: Request('customer', 'GET', reverse('cart'), {}),
+    'add_to_cart': lambda store, rng: Request('customer', 'GET', reverse('add_to_cart', args=[rng.choice(store.product_ids)]), {}),
+    'update_cart': lambda store, rng: Request('customer', 'POST', reverse('update_cart', args=[rng.choice(store.product_ids)]), {
+        'quantity': rng.randint(1, 3),
+    }),
+    'remove_from_cart': lambda store, rng: Request('customer', 'GET', reverse('remove_from_cart', args=[rng.choice(store.product_ids)]), {}),
+    'checkout': lambda store, rng: Request('customer', 'GET', reverse('checkout'), {}),
+    'order_placed': lambda store, rng: Request('customer', 'GET', reverse('order_placed', args=[rng.choice(store.customer_order_ids)]), {}),
+    'cancel_it': lambda store, rng: Request('customer', 'POST', reverse('cancel_it', args=[store.take('cancellable')]), {}),
+    'request_return': lambda store, rng: Request('customer', 'POST', reverse('request_return', args=[store.take('returnable')]), {}),
+    'order_history': lambda store, rng: Request('customer', 'GET', reverse('order_history'), {}),
+    'order_detail': lambda store, rng: Request('customer', 'GET', reverse('order_detail', args=[rng.choice(store.customer_order_ids)]), {}),
+    'admin_dashboard': lambda store, rng: Request('staff', 'GET', reverse('admin_dashboard'), {}),
+    'request_metrics': lambda store, rng: Request('staff', 'GET', reverse('request_metrics'), {}),
+    'request_metrics_json': lambda store, rng: Request('staff', 'GET', reverse('request_metrics_json'), {}),
+    'manage_products': lambda store, rng: Request('staff', 'GET', reverse('manage_products'), {}),
+    'add_product': lambda store, rng: Request('staff', 'POST', reverse('add_product'), dict(_product_form(store, rng), image=_upload())),
+    'update_product': lambda store, rng: Request('staff', 'POST', reverse('update_product', args=[rng.choice(store.product_ids)]), _product_form(store, rng)),
+    'delete_product': lambda store, rng: Request('staff', 'POST', reverse('delete_product', args=[store.take('products')]), {}),
+    'import_products': lambda store, rng: Request('staff', 'GET', reverse('import_products'), {}),
+    'manage_categories': lambda store, rng: Request('staff', 'GET', reverse('manage_categories'), {}),
+    'add_category': lambda store, rng: Request('staff', 'POST', reverse('add_category'), {'category_name': 'Benchmark category'}),
+    'update_category': lambda store, rng: Request('staff', 'POST', reverse('update_category', args=[rng.choice(store.category_ids)]), {
+        'category_name': 'Category %d' % rng.randint(1, 99),
+    }),
+    'delete_category': lambda store, rng: Request('staff', 'POST', reverse('delete_category', args=[store.take('categories')]), {}),
+    'manage_orders': lambda store, rng: Request('staff', 'GET', reverse('manage_orders'), rng.choice([
+        {}, {'status': rng.choice([status for status, _ in Order.STATUS_CHOICES])},
+    ])),
+    'update_order_status': lambda store, rng: Request('staff', 'POST', reverse('update_order_status', args=[store.take('shippable')]), {
+        'status': 'on_the_way',
+    }),
+    'bulk_update_order_status': lambda store, rng: Request('staff', 'POST', reverse('bulk_update_order_status'), {
+        'order_ids': [store.take('bulk_shippable') for _ in range(BULK_ORDERS)], 'status': 'on_the_way',
+    }),
+    'export_data': lambda store, rng: Request('staff', 'GET', reverse('export_data', args=[rng.choice(list(EXPORTS))]), {}),
+    'manage_users': lambda store, rng: Request('staff', 'GET', reverse('manage_users'), {}),
+    'promote_to_staff': lambda store, rng: Request('staff', 'POST', reverse('promote_to_staff', args=[store.take('users')]), {}),
+    'delete_user': lambda store, rng: Request('staff', 'POST', reverse('delete_user', args=[store.take('users')]), {}),
+    'product_detail': lambda store, rng: Request('anonymous', 'GET', reverse('product_detail', args=[rng.choice(store.product_ids)]), {}),
+    'product_search': lambda store, rng: Request('anonymous', 'GET', reverse('product_search'), {
+        'q': '%s %s' % (rng.choice(COLORS), rng.choice(('shirt', 'dress', 'jeans', 'jacket'))),
+    }),
+}
+
+
+def named_routes():
+    return [pattern.name for pattern in urls.urlpatterns if isinstance(pattern, URLPattern) and pattern.name]
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def _session_cookie(user):
+    store = import_module(settings.SESSION_ENGINE).SessionStore()
+    store[SESSION_KEY] = str(user.pk)
+    store[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+    store[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    store.create()
+    return '%s=%s' % (settings.SESSION_COOKIE_NAME, store.session_key)
+
+
+class BenchmarkStore:
+    """The seeded store, plus pools of rows that routes use up one per request."""
+
+    def __init__(self, seeded, customer, forgetful, customer_order_ids, pools):
+        self.staff = seeded.staff
+        self.product_ids = seeded.product_ids
+        self.category_ids = seeded.category_ids
+        self.customer = customer
+        self.forgetful = forgetful
+        self.customer_order_ids = customer_order_ids
+        self.pools = {name: iter(ids) for name, ids in pools.items()}
+
+    def take(self, pool):
+        return next(self.pools[pool])
+
+
+class ClientTransport:
+    """Requests through the Django test client, one client per thread."""
+
+    name = 'client'
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def __call__(self, request, cookie):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = Client(raise_request_exception=False)
+        send = client.get if request.method == 'GET' else client.post
+        response = send(request.path, request.data, HTTP_COOKIE=cookie)
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        response.close()
+        return response.status_code
+
+    def close(self):
+        pass
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class HttpTransport:
+    """Requests over HTTP to Django's threaded development server on a local port."""
+
+    name = 'http'
+
+    def __init__(self):
+        self.server = ThreadedWSGIServer(('127.0.0.1', 0), QuietRequestHandler, allow_reuse_address=False)
+        self.server.set_app(get_wsgi_application())
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        # An unmasked secret is a valid token: POSTs carry it as cookie and header.
+        self.csrf_token = get_random_string(32)
+
+    def __call__(self, request, cookie):
+        headers = {
+            'Cookie': '; '.join(filter(None, [cookie, '%s=%s' % (settings.CSRF_COOKIE_NAME, self.csrf_token)])),
+            'X-CSRFToken': self.csrf_token,
+        }
+        path, body = request.path, None
+        if request.method == 'GET':
+            if request.data:
+                path += '?' + urlencode(request.data, doseq=True)
+        elif any(hasattr(value, 'read') for value in request.data.values()):
+            body = encode_multipart(BOUNDARY, request.data)
+            headers['Content-Type'] = MULTIPART_CONTENT
+        else:
+            body = urlencode(request.data, doseq=True)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        connection = http.client.HTTPConnection('127.0.0.1', self.port)
+        try:
+            connection.request(request.method, path, body, headers)
+            response = connection.getresponse()
+            response.read()
+            return response.status
+        finally:
+            connection.close()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a throwaway database with a synthetic store, drive every named '
+        'route with the test client or over HTTP at the given concurrency, and '
+        'report latency percentiles, throughput and queries per route. Results '
+        'are saved as JSON and can be compared with an earlier run.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--transport', choices=('client', 'http'), default='client',
+                            help='Django test client in-process, or HTTP to a local development server.')
+        parser.add_argument('--concurrency', type=int, default=8, help='Requests in flight at once.')
+        parser.add_argument('--requests', type=int, default=100, help='Requests per route.')
+        parser.add_argument('--routes', help='Comma-separated route names; every named route by default.')
+        parser.add_argument('--users', type=int, default=500)
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--orders', type=int, default=2000)
+        parser.add_argument('--reviews', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the data and request generators.')
+        parser.add_argument('--output', default='benchmark_routes.json', help='Where to save the results.')
+        parser.add_argument('--compare', help='Results of an earlier run to compare with.')
+
+    def handle(self, *args, **options):
+        missing = set(named_routes()) - set(ROUTES)
+        if missing:
+            self.stderr.write('No benchmark plan for: %s.' % ', '.join(sorted(missing)))
+        routes = options['routes'].split(',') if options['routes'] else [name for name in named_routes() if name in ROUTES]
+        unknown = set(routes) - set(ROUTES)
+        if unknown:
+            raise CommandError('Unknown routes: %s.' % ', '.join(sorted(unknown)))
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as results:
+                    baseline = json.load(results)['routes']
+            except (OSError, ValueError, KeyError) as e:
+                raise CommandError('Cannot read %s: %s' % (options['compare'], e))
+
+        # The session cache in memory, uploads in a scratch directory,
+        # and every request instrumented for its query count.
+        caches = dict(settings.CACHES)
+        caches['sessions'] = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark_sessions'}
+        results = {}
+        with tempfile.TemporaryDirectory(prefix='benchmark_routes_media_') as media_root, override_settings(
+            CACHES=caches, MEDIA_ROOT=media_root, METRICS_SAMPLE_RATE=1,
+            ALLOWED_HOSTS=settings.ALLOWED_HOSTS + ['testserver', '127.0.0.1'],
+        ), scratch_database('benchmark_routes_'):
+            store = self.seed(options)
+            transport = HttpTransport() if options['transport'] == 'http' else ClientTransport()
+            # Set up after the server, whose WSGI handler configures logging:
+            # failures are counted in the results rather than logged.
+            request_logger = logging.getLogger('django.request')
+            request_logger_level = request_logger.level
+            request_logger.setLevel(logging.CRITICAL)
+            try:
+                self.stdout.write('%-26s %6s %8s %7s %8s %9s %9s %9s %8s %8s' % (
+                    'route', 'method', 'requests', 'errors', 'req/s', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)',
+                    'queries', 'max q'))
+                for name in routes:
+                    results[name] = self.run_route(name, store, transport, options)
+                    self.report(name, results[name], baseline)
+            finally:
+                request_logger.setLevel(request_logger_level)
+                transport.close()
+                connections.close_all()
+
+        with open(options['output'], 'w') as output:
+            json.dump({
+                'date': datetime.now().isoformat(timespec='seconds'),
+                'options': {name: options[name] for name in (
+                    'transport', 'concurrency', 'requests', 'users', 'products', 'orders', 'reviews', 'seed')},
+                'routes': results,
+            }, output, indent=2)
+        self.stdout.write(self.style.SUCCESS('Results saved to %s.' % options['output']))
+
+    def seed(self, options):
+        seeded = seed_store(
+            users=options['users'], products=options['products'], carts=min(100, options['users']),
+            orders=options['orders'], reviews=options['reviews'], seed=options['seed'],
+        )
+        pool_size = options['requests'] + WARMUP_REQUESTS
+        customer = User.objects.get(id=seeded.user_ids[0])
+        forgetful = User.objects.get(id=seeded.user_ids[1])
+
+        def orders(user, status, count):
+            created = Order.objects.bulk_create([
+                Order(user=user, shipping_address='1 Benchmark Road', payment_method='card',
+                      total_cost=Decimal('19.99'), status=status)
+                for _ in range(count)
+            ])
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product_id=seeded.product_ids[i % len(seeded.product_ids)])
+                for i, order in enumerate(created)
+            ])
+            return [order.id for order in created]
+
+        # Rows only the benchmark uses, so write routes never run out of targets.
+        cancellable = orders(customer, 'ordered', pool_size)
+        returnable = orders(customer, 'delivered', pool_size)
+        shippable = orders(forgetful, 'ordered', pool_size)
+        bulk_shippable = orders(forgetful, 'ordered', pool_size * BULK_ORDERS)
+        products = Product.objects.bulk_create([
+            Product(name='Disposable product %d' % i, description='Deleted by the benchmark', image='products/red.jpeg',
+                    category_id=seeded.category_ids[0], size='M', color='red', price=1)
+            for i in range(pool_size)
+        ])
+        categories = Category.objects.bulk_create([Category(name='Disposable category %d' % i) for i in range(pool_size)])
+        users = User.objects.bulk_create([User(username='disposable-%d' % i, password='!') for i in range(pool_size * 2)])
+        return BenchmarkStore(
+            seeded, customer, forgetful,
+            list(Order.objects.filter(user=customer).values_list('id', flat=True)),
+            {
+                'cancellable': cancellable, 'returnable': returnable, 'shippable': shippable,
+                'bulk_shippable': bulk_shippable, 'products': [product.id for product in products],
+                'categories': [category.id for category in categories], 'users': [user.id for user in users],
+                'signups': range(len(ROUTES) * pool_size),
+            },
+        )
+
+    def run_route(self, name, store, transport, options):
+        rng = random.Random('%s:%s' % (options['seed'], name))
+        requests = [ROUTES[name](store, rng) for _ in range(WARMUP_REQUESTS + options['requests'])]
+        cookies = {'anonymous': '', 'customer': _session_cookie(store.customer), 'staff': _session_cookie(store.staff)}
+        # Routes that end their session get one of their own per request.
+        sessions = [
+            _session_cookie(store.customer) if request.session == 'fresh' else cookies[request.session]
+            for request in requests
+        ]
+
+        def send(index):
+            started = time.perf_counter()
+            status = transport(requests[index], sessions[index])
+            return status, time.perf_counter() - started
+
+        for index in range(WARMUP_REQUESTS):
+            send(index)
+        metrics.reset()
+        pending = iter(range(WARMUP_REQUESTS, len(requests)))
+        responses = []
+
+        def worker(_):
+            try:
+                for index in pending:
+                    responses.append(send(index))
+            finally:
+                connections.close_all()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            list(pool.map(worker, range(options['concurrency'])))
+        elapsed = time.perf_counter() - started
+
+        view = next((view for view in metrics.snapshot()['views'] if view['view'] == name), None)
+        latencies = [latency for _, latency in responses]
+        return {
+            'method': requests[0].method,
+            'requests': len(responses),
+            'statuses': dict(Counter(str(status) for status, _ in responses)),
+            'errors': sum(1 for status, _ in responses if status >= 400),
+            'requests_per_second': round(len(responses) / elapsed, 1),
+            'p50_ms': round(_percentile(latencies, 0.5) * 1000, 1),
+            'p95_ms': round(_percentile(latencies, 0.95) * 1000, 1),
+            'p99_ms': round(_percentile(latencies, 0.99) * 1000, 1),
+            'avg_queries': view['avg_queries'] if view else None,
+            'max_queries': view['max_queries'] if view else None,
+        }
+
+    def report(self, name, result, baseline):
+        line = '%-26s %6s %8d %7d %8.1f %9.1f %9.1f %9.1f %8s %8s' % (
+            name, result['method'], result['requests'], result['errors'], result['requests_per_second'],
+            result['p50_ms'], result['p95_ms'], result['p99_ms'],
+            '-' if result['avg_queries'] is None else result['avg_queries'],
+            '-' if result['max_queries'] is None else result['max_queries'],
+        )
+        before = (baseline or {}).get(name)
+        if before and before['p95_ms'] and before['requests_per_second']:
+            line += '   p95 %+.0f%%, req/s %+.0f%%' % (
+                100 * (result['p95_ms'] / before['p95_ms'] - 1),
+                100 * (result['requests_per_second'] / before['requests_per_second'] - 1),
+            )
+        self.stdout.write(line)
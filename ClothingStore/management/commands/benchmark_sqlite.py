@@ -0,0 +1,155 @@
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from unittest import mock
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from ClothingStore.catalog import bump_catalog_version
+from ClothingStore.management.scratch import scratch_database
+from ClothingStore.models import Cart, Category, Product, User
+from ClothingStore.sqlite import SQLITE_PROFILES
+
+OPERATIONS = ('home', 'add_to_cart', 'checkout')
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive mixed home, add_to_cart and checkout traffic from several threads '
+        'against a throwaway SQLite database once per SQLite profile, and report '
+        'throughput and "database is locked" error rates.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', default='default,development,production', help='Comma-separated SQLite profiles to compare.')
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent customers, one per thread.')
+        parser.add_argument('--requests', type=int, default=300, help='Requests per thread.')
+        parser.add_argument('--products', type=int, default=50)
+        parser.add_argument('--mix', default='home=5,add_to_cart=4,checkout=1', help='Relative weight of each operation.')
+        parser.add_argument(
+            '--write-behind', action='store_true',
+            help='Keep the cart write-behind interval; by default every cart click is flushed to the database.',
+        )
+
+    def handle(self, *args, **options):
+        profiles = options['profiles'].split(',')
+        unknown = set(profiles) - set(SQLITE_PROFILES)
+        if unknown:
+            raise CommandError('Unknown SQLite profiles: %s.' % ', '.join(sorted(unknown)))
+        try:
+            mix = {name: int(weight) for name, weight in (part.split('=') for part in options['mix'].split(','))}
+        except ValueError:
+            raise CommandError('--mix must look like home=5,add_to_cart=4,checkout=1.')
+        if set(mix) - set(OPERATIONS):
+            raise CommandError('--mix operations must be among: %s.' % ', '.join(OPERATIONS))
+
+        # The session cache in memory: only the database is measured.
+        caches = dict(settings.CACHES)
+        caches['sessions'] = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark_sessions'}
+        flush_interval = mock.patch('ClothingStore.cart.CART_FLUSH_INTERVAL', 0)
+        # Lock errors are counted below rather than logged as server errors.
+        request_logger = logging.getLogger('django.request')
+        request_logger_level = request_logger.level
+        request_logger.setLevel(logging.CRITICAL)
+
+        self.stdout.write('%-12s %9s %9s %8s %12s %10s %10s' % (
+            'profile', 'requests', 'time (s)', 'ok/s', 'lock errors', 'p50 (ms)', 'p95 (ms)'))
+        with override_settings(CACHES=caches, ALLOWED_HOSTS=settings.ALLOWED_HOSTS + ['testserver']):
+            if not options['write_behind']:
+                flush_interval.start()
+            try:
+                for profile in profiles:
+                    self.run_profile(profile, mix, options)
+            finally:
+                if not options['write_behind']:
+                    flush_interval.stop()
+                request_logger.setLevel(request_logger_level)
+
+    def seed(self, options):
+        category = Category.objects.create(name='benchmark')
+        products = Product.objects.bulk_create([
+            Product(
+                name='Benchmark product %d' % i, description='Benchmark', image='products/red.jpeg',
+                category=category, size='M', color='red', price=Decimal('19.99'), stock=10 ** 9,
+            )
+            for i in range(options['products'])
+        ])
+        users = User.objects.bulk_create([
+            User(username='benchmark%d' % i, password='!') for i in range(options['threads'])
+        ])
+        Cart.objects.bulk_create([Cart(user=user) for user in users])
+        bump_catalog_version()
+        return [product.id for product in products], users
+
+    def run_profile(self, profile, mix, options):
+        connections.close_all()
+        with override_settings(SQLITE_PROFILE=profile), scratch_database('benchmark_sqlite_'):
+            product_ids, users = self.seed(options)
+            clients = []
+            for user in users:
+                client = Client()
+                client.force_login(user)
+                clients.append(client)
+
+            outcomes = Counter()
+            latencies = []
+            lock = threading.Lock()
+            operations = list(mix)
+            weights = [mix[name] for name in operations]
+
+            def customer(index):
+                client = clients[index]
+                rng = random.Random(index)
+                try:
+                    for _ in range(options['requests']):
+                        operation = rng.choices(operations, weights)[0]
+                        started = time.perf_counter()
+                        try:
+                            if operation == 'home':
+                                response = client.get(reverse('home'))
+                            elif operation == 'add_to_cart':
+                                response = client.get(reverse('add_to_cart', args=[rng.choice(product_ids)]))
+                            else:
+                                response = client.post(reverse('checkout'), {
+                                    'shipping_address': '1 Benchmark Road', 'payment_method': 'card',
+                                })
+                            result = operation if response.status_code < 400 else 'failed'
+                        except OperationalError as e:
+                            if 'locked' not in str(e):
+                                raise
+                            result = 'lock_errors'
+                        elapsed = time.perf_counter() - started
+                        with lock:
+                            outcomes[result] += 1
+                            latencies.append(elapsed)
+                finally:
+                    connections.close_all()
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=len(clients)) as pool:
+                list(pool.map(customer, range(len(clients))))
+            elapsed = time.perf_counter() - started
+
+        total = len(latencies)
+        succeeded = sum(outcomes[name] for name in OPERATIONS)
+        self.stdout.write('%-12s %9d %9.2f %8.1f %5d (%4.1f%%) %10.1f %10.1f' % (
+            profile, total, elapsed, succeeded / elapsed, outcomes['lock_errors'],
+            100.0 * outcomes['lock_errors'] / (total or 1),
+            _percentile(latencies, 0.5) * 1000, _percentile(latencies, 0.95) * 1000,
+        ))
+        self.stdout.write('%-12s %s' % ('', ', '.join('%s %d' % (name, outcomes[name]) for name in OPERATIONS + ('failed',))))
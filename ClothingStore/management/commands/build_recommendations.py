@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ClothingStore.models import CoPurchase, Recommendation
+from ClothingStore.recommendations import TOP_K, build_recommendations
+
+
+class Command(BaseCommand):
+    help = (
+        'Build the "customers also bought" lists from order history. Only '
+        'orders placed since the last build are read unless --full is given.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recount every order and rank every product.')
+        parser.add_argument('--top-k', type=int, default=TOP_K, help='Recommendations kept per product.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        build = build_recommendations(full=options['full'], k=options['top_k'])
+        self.stdout.write(self.style.SUCCESS(
+            '%s: %d orders read, %d product pairs, %d recommendations in %.1fs.' % (
+                build, build.orders, CoPurchase.objects.count(), Recommendation.objects.count(),
+                time.perf_counter() - started)
+        ))
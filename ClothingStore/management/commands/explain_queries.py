@@ -0,0 +1,115 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ClothingStore import search
+from ClothingStore.facets import facet_index
+from ClothingStore.instrumentation import fingerprint
+from ClothingStore.models import Order, Product, User
+
+
+class Command(BaseCommand):
+    help = (
+        'Request the storefront and staff pages with the test client, run '
+        'EXPLAIN QUERY PLAN for every SELECT they issue and flag any that '
+        'fall back to a full table scan. Nothing the requests write is kept.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fail-on-scan', action='store_true',
+            help='Exit with an error if any query does a full table scan.',
+        )
+
+    def view_requests(self):
+        """``(label, user, path, data)`` of the pages whose queries are checked."""
+        product = Product.objects.order_by('id').first()
+        order = Order.objects.order_by('-id').first()
+        if product is None or order is None:
+            raise CommandError('No products or orders to request pages for; run seed_store first.')
+        customer = order.user
+        staff = User.objects.filter(is_staff=True).order_by('id').first()
+
+        requests = [
+            ('home', None, reverse('home'), {}),
+            ('home: filtered', None, reverse('home'), {'color': product.color, 'size': product.size, 'sort': 'rating'}),
+            ('product_search', None, reverse('product_search'), {'q': product.name}),
+            ('product_detail', None, reverse('product_detail', args=[product.id]), {}),
+            ('product_detail: signed in', customer, reverse('product_detail', args=[product.id]), {}),
+            ('cart', customer, reverse('cart'), {}),
+            ('profile', customer, reverse('profile'), {}),
+            ('order_history', customer, reverse('order_history'), {}),
+            ('order_detail', customer, reverse('order_detail', args=[order.id]), {}),
+        ]
+        if staff is not None:
+            requests += [
+                ('admin_dashboard', staff, reverse('admin_dashboard'), {}),
+                ('manage_products', staff, reverse('manage_products'), {}),
+                ('manage_orders', staff, reverse('manage_orders'), {}),
+                ('manage_orders: by status', staff, reverse('manage_orders'), {'status': 'ordered'}),
+                ('manage_users', staff, reverse('manage_users'), {}),
+            ]
+        return requests
+
+    def captured_queries(self):
+        """``(label, sql)`` of each distinct SELECT, with the route that first issued it."""
+        # Fresh caches, so no page is served from a cached fragment.
+        caches = {
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'explain_queries'},
+            'sessions': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'explain_queries_sessions'},
+        }
+        queries = {}
+        with override_settings(CACHES=caches, ALLOWED_HOSTS=settings.ALLOWED_HOSTS + ['testserver']), transaction.atomic():
+            # The in-memory indexes read the whole catalog once per catalog
+            # version by design; build them before capturing.
+            facet_index.ensure_built()
+            search.search_products('')
+            for label, user, path, data in self.view_requests():
+                client = Client()
+                if user is not None:
+                    client.force_login(user)
+                with CaptureQueriesContext(connection) as captured:
+                    client.get(path, data)
+                for query in captured.captured_queries:
+                    sql = query['sql']
+                    if sql.lstrip().upper().startswith('SELECT'):
+                        queries.setdefault(fingerprint(sql, length=None), (label, sql))
+            transaction.set_rollback(True)
+        return list(queries.values())
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('EXPLAIN QUERY PLAN output is only parsed for SQLite.')
+
+        scans = []
+        for label, sql in self.captured_queries():
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN %s' % sql)
+                plan = [row[-1] for row in cursor.fetchall()]
+            # Scans of subquery results and of covering indexes are not table scans.
+            full_scan = [
+                line for line in plan
+                if line.startswith('SCAN ') and 'INDEX' not in line and not line.startswith('SCAN (')
+            ]
+            # A keyset page walks the table in key order and stops at its LIMIT.
+            paged = ' LIMIT ' in sql and not any('FOR ORDER BY' in line for line in plan)
+            if full_scan and paged:
+                self.stdout.write(self.style.WARNING('PAGE %s' % label))
+            else:
+                style = self.style.ERROR if full_scan else self.style.SUCCESS
+                self.stdout.write(style('%s %s' % ('SCAN' if full_scan else 'OK  ', label)))
+            self.stdout.write('       %s' % fingerprint(sql))
+            for line in plan:
+                self.stdout.write('         %s' % line)
+            if full_scan and not paged:
+                scans.append(label)
+
+        if scans:
+            message = '%d %s a full table scan: %s' % (
+                len(scans), 'query does' if len(scans) == 1 else 'queries do', ', '.join(sorted(set(scans))))
+            if options['fail_on_scan']:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
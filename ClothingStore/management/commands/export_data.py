@@ -0,0 +1,39 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ClothingStore.exports import EXPORTS, FORMATS, stream_export
+from ClothingStore.orders import parse_date_param
+
+
+class Command(BaseCommand):
+    help = 'Stream an export of orders, order items, products or users to a file or stdout.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=sorted(EXPORTS))
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output with gzip.')
+        parser.add_argument('--date-from', help='First day to include (YYYY-MM-DD).')
+        parser.add_argument('--date-to', help='Last day to include (YYYY-MM-DD).')
+        parser.add_argument('--output', default='-', help='File to write to; "-" for stdout.')
+
+    def handle(self, *args, **options):
+        dates = {}
+        for option in ('date_from', 'date_to'):
+            value = options[option]
+            dates[option] = parse_date_param(value)
+            if value and dates[option] is None:
+                raise CommandError('Invalid date: %s' % value)
+
+        chunks = stream_export(options['name'], options['format'], options['gzip'], **dates)
+        if options['output'] == '-':
+            self.write_chunks(chunks, sys.stdout.buffer)
+            sys.stdout.buffer.flush()
+        else:
+            with open(options['output'], 'wb') as output:
+                self.write_chunks(chunks, output)
+            self.stderr.write('Wrote %s.' % options['output'])
+
+    def write_chunks(self, chunks, output):
+        for chunk in chunks:
+            output.write(chunk)
@@ -0,0 +1,39 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from ClothingStore.images import DERIVATIVE_FORMATS, DERIVATIVE_WIDTHS, build_derivatives
+from ClothingStore.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate the responsive WebP and JPEG derivatives of product images. '
+        'By default only images without recorded derivatives are processed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Process every product image.')
+        parser.add_argument('--force', action='store_true', help='Rewrite derivatives that already exist.')
+        parser.add_argument('--workers', type=int, default=None, help='Image processes; 0 processes images inline.')
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image='')
+        if not (options['all'] or options['force']):
+            products = products.filter(image_widths=[])
+        names = list(products.order_by('image').values_list('image', flat=True).distinct())
+        self.stdout.write('%d images, %d widths x %d formats each.' % (
+            len(names), len(DERIVATIVE_WIDTHS), len(DERIVATIVE_FORMATS)))
+
+        started = time.perf_counter()
+        if options['workers'] == 0:
+            recorded, failures = build_derivatives(names, force=options['force'])
+        else:
+            with ProcessPoolExecutor(max_workers=options['workers'] or os.cpu_count()) as pool:
+                recorded, failures = build_derivatives(names, pool, force=options['force'])
+        for name, e in failures:
+            self.stderr.write('%s: %s' % (name, e))
+        self.stdout.write(self.style.SUCCESS('Generated derivatives of %d images in %.1fs.' % (
+            recorded, time.perf_counter() - started)))
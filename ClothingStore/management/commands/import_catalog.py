@@ -0,0 +1,34 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ClothingStore.catalog_import import BATCH_SIZE, import_catalog
+
+
+class Command(BaseCommand):
+    help = (
+        'Import products from a CSV or JSON Lines manifest keyed by sku. '
+        'Rows whose content hash is unchanged since the last import are skipped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('manifest', help='Path to a .csv or .jsonl manifest.')
+        parser.add_argument('--images', help='Directory or zip archive with the images the manifest names.')
+        parser.add_argument('--workers', type=int, default=None, help='Image processes; 0 processes images inline.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        images = options['images']
+        if images and not os.path.exists(images):
+            raise CommandError('No such image directory or archive: %s' % images)
+        started = time.perf_counter()
+        try:
+            with open(options['manifest'], 'rb') as manifest:
+                report = import_catalog(
+                    manifest, options['manifest'], images, options['workers'], options['batch_size'])
+        except OSError as e:
+            raise CommandError(e)
+        for line, message in report.errors:
+            self.stderr.write('line %d: %s' % (line, message))
+        self.stdout.write(self.style.SUCCESS('%s in %.1fs.' % (report, time.perf_counter() - started)))
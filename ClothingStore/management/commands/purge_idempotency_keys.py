@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from ClothingStore.idempotency import IDEMPOTENCY_TTL, purge_expired_keys
+
+
+class Command(BaseCommand):
+    help = 'Delete idempotency keys claimed more than %d hours ago.' % (IDEMPOTENCY_TTL // 3600)
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('Deleted %d expired idempotency keys.' % purge_expired_keys()))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from ClothingStore.models import ProductSalesRollup, SalesRollup
+from ClothingStore.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the hourly and daily sales rollups from order history.'
+
+    def handle(self, *args, **options):
+        rebuild_rollups()
+        self.stdout.write(self.style.SUCCESS(
+            'Rebuilt %d sales rollups and %d product rollups.' % (
+                SalesRollup.objects.count(), ProductSalesRollup.objects.count())
+        ))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from ClothingStore.models import Product
+from ClothingStore.search import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the product full-text search index from the database.'
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            'Indexed %d products with %s.' % (Product.objects.count(), type(backend).__name__)
+        ))
@@ -0,0 +1,34 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy the SQLite primary into each SQLite replica with the online backup '
+        'API, standing in for replication when developing with two SQLite files.'
+    )
+
+    def handle(self, *args, **options):
+        primary = connections['default']
+        if primary.vendor != 'sqlite':
+            raise CommandError('The primary is not an SQLite database.')
+        replicas = [alias for alias in settings.DATABASE_REPLICAS if connections[alias].vendor == 'sqlite']
+        if not replicas:
+            raise CommandError('No SQLite replicas configured in DATABASE_REPLICA_URLS.')
+
+        source = sqlite3.connect(primary.settings_dict['NAME'])
+        try:
+            for alias in replicas:
+                connections[alias].close()
+                target = sqlite3.connect(connections[alias].settings_dict['NAME'])
+                try:
+                    source.backup(target)
+                finally:
+                    target.close()
+                self.stdout.write('%s <- %s' % (connections[alias].settings_dict['NAME'], primary.settings_dict['NAME']))
+        finally:
+            source.close()
+        self.stdout.write(self.style.SUCCESS('Refreshed %d replica(s).' % len(replicas)))
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ClothingStore.management.seeding import SEED_PASSWORD, STAFF_USERNAME, seed_store
+from ClothingStore.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        'Fill the database with a synthetic store: users, categories, products, '
+        'carts, orders and reviews, generated from a fixed random seed so every '
+        'run with the same arguments produces the same data.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--categories', type=int, default=8)
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--carts', type=int, default=200, help='Users that get a stored cart.')
+        parser.add_argument('--orders', type=int, default=5000)
+        parser.add_argument('--reviews', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per INSERT.')
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username=STAFF_USERNAME).exists():
+            raise CommandError('This database has already been seeded.')
+        if options['carts'] > options['users']:
+            raise CommandError('--carts cannot exceed --users.')
+
+        started = time.perf_counter()
+        store = seed_store(
+            users=options['users'], categories=options['categories'], products=options['products'],
+            carts=options['carts'], orders=options['orders'], reviews=options['reviews'],
+            seed=options['seed'], batch_size=options['batch_size'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            'Seeded %d users, %d categories, %d products, %d carts, %d orders and %d reviews in %.1fs. '
+            'Every account, including staff user "%s", has the password "%s".' % (
+                len(store.user_ids), len(store.category_ids), len(store.product_ids), options['carts'],
+                len(store.order_ids), options['reviews'], time.perf_counter() - started, STAFF_USERNAME, SEED_PASSWORD)
+        ))
@@ -0,0 +1,105 @@
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections
+from django.db.models import Sum
+
+from ClothingStore.cart import CART_SESSION_KEY, SessionCart
+from ClothingStore.checkout import place_order
+from ClothingStore.management.scratch import scratch_database
+from ClothingStore.models import Cart, Category, OrderItem, Product, User
+from ClothingStore.stock import OutOfStockError
+
+
+class Command(BaseCommand):
+    help = (
+        'Run concurrent checkouts against a throwaway SQLite database in WAL '
+        'mode and verify that stock reservation never oversells.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--customers', type=int, default=400)
+        parser.add_argument('--products', type=int, default=3)
+        parser.add_argument('--stock', type=int, default=100, help='Initial stock per product.')
+        parser.add_argument('--quantity', type=int, default=1, help='Units bought per checkout.')
+        parser.add_argument('--busy-timeout', type=float, default=30, help='SQLite busy timeout in seconds.')
+        parser.add_argument('--retries', type=int, default=50, help='Attempts per checkout on "database is locked".')
+
+    def handle(self, *args, **options):
+        with scratch_database('stress_checkout_', busy_timeout=options['busy_timeout']):
+            self.run_stress(options)
+
+    def seed(self, options):
+        category = Category.objects.create(name='stress')
+        products = Product.objects.bulk_create([
+            Product(
+                name='Drop %d' % i, description='Limited drop', image='products/red.jpeg', category=category,
+                size='M', color='red', price=Decimal('25.00'), stock=options['stock'],
+            )
+            for i in range(options['products'])
+        ])
+        users = User.objects.bulk_create([
+            User(username='stress%d' % i, password='!') for i in range(options['customers'])
+        ])
+        Cart.objects.bulk_create([Cart(user=user) for user in users])
+        return products, users
+
+    def run_stress(self, options):
+        products, users = self.seed(options)
+        outcomes = Counter()
+        lock = threading.Lock()
+
+        def checkout(index):
+            user = users[index]
+            product = products[index % len(products)]
+            session = {CART_SESSION_KEY: {'items': {str(product.id): options['quantity']}, 'dirty_since': time.time()}}
+            cart = SessionCart(SimpleNamespace(session=session), user)
+            try:
+                for attempt in range(options['retries']):
+                    try:
+                        place_order(cart, user, 'Stress Street', 'card')
+                        result = 'ordered'
+                        break
+                    except OutOfStockError:
+                        result = 'sold_out'
+                        break
+                    except OperationalError as e:
+                        if 'locked' not in str(e):
+                            raise
+                        with lock:
+                            outcomes['lock_errors'] += 1
+                        time.sleep(0.005 * (attempt + 1))
+                else:
+                    result = 'gave_up'
+                with lock:
+                    outcomes[result] += 1
+            finally:
+                connections.close_all()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+            list(pool.map(checkout, range(len(users))))
+        elapsed = time.perf_counter() - started
+
+        oversold = []
+        for product in Product.objects.filter(id__in=[product.id for product in products]):
+            sold = OrderItem.objects.filter(product=product).aggregate(units=Sum('quantity'))['units'] or 0
+            if product.stock < 0 or sold > options['stock'] or sold + product.stock != options['stock']:
+                oversold.append(product.name)
+            self.stdout.write('%s: sold %d of %d, %d left' % (product.name, sold, options['stock'], product.stock))
+
+        self.stdout.write(
+            'checkouts: %(ordered)d ordered, %(sold_out)d sold out, %(gave_up)d gave up, '
+            '%(lock_errors)d lock retries' % {key: outcomes[key] for key in ('ordered', 'sold_out', 'gave_up', 'lock_errors')}
+        )
+        self.stdout.write('throughput: %.1f checkouts/s over %.2fs with %d threads' % (
+            len(users) / elapsed, elapsed, options['threads']))
+        if oversold:
+            raise CommandError('Oversold: %s' % ', '.join(oversold))
+        self.stdout.write(self.style.SUCCESS('No oversells.'))
@@ -0,0 +1,45 @@
+import os
+import resource
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from django.core.management.base import CommandError
+from django.db import connection
+
+
+@contextmanager
+def scratch_database(prefix='scratch_', busy_timeout=None):
+    """
+    Run the block against a throwaway, fully migrated SQLite database.
+
+    The database lives in a temporary directory, is tuned by the configured
+    ``SQLITE_PROFILE`` like the real one and is destroyed afterwards, so
+    benchmarks can seed as many rows as they like without touching the real
+    database.
+    """
+    if connection.vendor != 'sqlite':
+        raise CommandError('Benchmarks run against a temporary SQLite database.')
+
+    tmpdir = tempfile.mkdtemp(prefix=prefix)
+    connection.settings_dict['TEST'] = dict(connection.settings_dict.get('TEST') or {}, NAME=os.path.join(tmpdir, 'scratch.sqlite3'))
+    if busy_timeout is not None:
+        connection.settings_dict.setdefault('OPTIONS', {})['timeout'] = busy_timeout
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield connection.settings_dict['NAME']
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def status_kb(field):
+    """Read a ``kB`` value such as ``VmRSS`` or ``VmHWM`` for this process."""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
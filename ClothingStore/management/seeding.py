@@ -0,0 +1,146 @@
+import random
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from ClothingStore import search
+from ClothingStore.catalog import bump_catalog_version
+from ClothingStore.models import Cart, CartItem, Category, Order, OrderItem, Product, Review, User
+from ClothingStore.recommendations import build_recommendations
+from ClothingStore.rollups import rebuild_rollups
+
+# Every seeded account logs in with this password.
+SEED_PASSWORD = 'seed-password'
+USERNAME_PREFIX = 'seed-user-'
+STAFF_USERNAME = 'seed-staff'
+
+CATEGORY_NAMES = ('female', 'male', 'kids', 'sportswear', 'accessories', 'footwear', 'ethnic', 'outerwear')
+GARMENTS = ('shirt', 't-shirt', 'dress', 'saree', 'jeans', 'jacket', 'hoodie', 'skirt', 'kurta', 'sweater')
+ADJECTIVES = ('classic', 'slim', 'linen', 'cotton', 'silk', 'summer', 'winter', 'striped', 'printed', 'casual')
+COLORS = ('red', 'blue', 'black', 'white', 'green', 'yellow', 'grey', 'pink')
+IMAGES = ('products/red.jpeg', 'products/red_shirt.jpg', 'products/black_shirt1.jpg', 'products/checks_shirt.jpg')
+STATUS_WEIGHTS = {
+    'ordered': 15, 'on_the_way': 15, 'delivered': 50, 'cancelled': 10, 'return_requested': 5, 'return_received': 5,
+}
+RATING_WEIGHTS = (5, 5, 15, 35, 40)
+
+
+class SeededStore:
+    """Primary keys of the rows ``seed_store`` created."""
+
+    def __init__(self, staff, user_ids, category_ids, product_ids, order_ids):
+        self.staff = staff
+        self.user_ids = user_ids
+        self.category_ids = category_ids
+        self.product_ids = product_ids
+        self.order_ids = order_ids
+
+
+def seed_store(users=1000, categories=8, products=2000, carts=200, orders=5000, reviews=5000, seed=0, batch_size=1000):
+    """
+    Fill the database with a store of the given size.
+
+    Rows are generated by a ``random.Random(seed)``, so the same arguments
+    always produce the same users, catalog, carts, orders and reviews (dates
+    are relative to now). Everything is written with ``bulk_create``, and the
+    data that signals and checkouts would normally keep up to date (rating
+    aggregates, search index, sales rollups, recommendations, catalog
+    version) is then built in one pass each.
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+    statuses = list(STATUS_WEIGHTS)
+    status_weights = [STATUS_WEIGHTS[status] for status in statuses]
+
+    with transaction.atomic():
+        category_objects = Category.objects.bulk_create([
+            Category(name=CATEGORY_NAMES[i] if i < len(CATEGORY_NAMES) else 'category %d' % i)
+            for i in range(categories)
+        ])
+
+        # One hash for every account: hashing thousands of passwords would dominate the run.
+        password = make_password(SEED_PASSWORD)
+        staff = User.objects.create(
+            username=STAFF_USERNAME, password=password, email='staff@example.com', is_staff=True,
+        )
+        user_objects = User.objects.bulk_create([
+            User(
+                username='%s%05d' % (USERNAME_PREFIX, i), password=password, email='user%d@example.com' % i,
+                contact_number='555%07d' % i, address='%d Seed Street' % (i + 1),
+                dob=date(1960, 1, 1) + timedelta(days=rng.randrange(15000)),
+            )
+            for i in range(users)
+        ], batch_size=batch_size)
+
+        # Reviews are drawn first so the products are created with their rating aggregates.
+        review_rows = [
+            (rng.randrange(products), rng.randrange(users), rng.choices(range(1, 6), RATING_WEIGHTS)[0])
+            for _ in range(reviews if products and users else 0)
+        ]
+        aggregates = [[0] * 6 for _ in range(products)]
+        for product, _, rating in review_rows:
+            aggregates[product][0] += 1
+            aggregates[product][rating] += 1
+
+        product_objects = []
+        for i in range(products):
+            color = rng.choice(COLORS)
+            garment = rng.choice(GARMENTS)
+            counts = aggregates[i]
+            product_objects.append(Product(
+                name='%s %s %s' % (rng.choice(ADJECTIVES).capitalize(), color, garment),
+                description='A %s %s in %s, item %d of the seeded catalog.' % (rng.choice(ADJECTIVES), garment, color, i),
+                image=rng.choice(IMAGES), category=rng.choice(category_objects), size=rng.choice('SML'),
+                color=color, price=Decimal(rng.randrange(499, 9999)) / 100, stock=rng.randrange(0, 500),
+                sku='SEED-%06d' % i, rating_count=counts[0],
+                rating_sum=sum(stars * counts[stars] for stars in range(1, 6)),
+                **{'rating_%d' % stars: counts[stars] for stars in range(1, 6)},
+            ))
+        product_objects = Product.objects.bulk_create(product_objects, batch_size=batch_size)
+
+        Review.objects.bulk_create([
+            Review(
+                product=product_objects[product], user=user_objects[user], rating=rating,
+                comment='Seeded review: %d out of 5.' % rating,
+            )
+            for product, user, rating in review_rows
+        ], batch_size=batch_size)
+
+        cart_items = []
+        for cart in Cart.objects.bulk_create([Cart(user=user) for user in user_objects[:carts]], batch_size=batch_size):
+            for product in rng.sample(product_objects, min(len(product_objects), rng.randint(1, 5))):
+                cart_items.append(CartItem(cart=cart, product=product, quantity=rng.randint(1, 3)))
+        CartItem.objects.bulk_create(cart_items, batch_size=batch_size)
+
+        order_objects = []
+        order_lines = []
+        for _ in range(orders if products and users else 0):
+            lines = [
+                (product, rng.randint(1, 3))
+                for product in rng.sample(product_objects, min(len(product_objects), rng.randint(1, 4)))
+            ]
+            order_objects.append(Order(
+                user=rng.choice(user_objects), ordered_date=now - timedelta(seconds=rng.randrange(365 * 24 * 3600)),
+                shipping_address='%d Seed Street' % rng.randint(1, 999), payment_method=rng.choice(('card', 'cash_on_delivery')),
+                total_cost=sum(product.price * quantity for product, quantity in lines),
+                status=rng.choices(statuses, status_weights)[0],
+            ))
+            order_lines.append(lines)
+        order_objects = Order.objects.bulk_create(order_objects, batch_size=batch_size)
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, quantity=quantity)
+            for order, lines in zip(order_objects, order_lines)
+            for product, quantity in lines
+        ], batch_size=batch_size)
+
+    search.rebuild_index()
+    rebuild_rollups()
+    build_recommendations(full=True)
+    bump_catalog_version()
+    return SeededStore(
+        staff, [user.id for user in user_objects], [category.id for category in category_objects],
+        [product.id for product in product_objects], [order.id for order in order_objects],
+    )
@@ -0,0 +1,107 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.utils.functional import SimpleLazyObject
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from .cart import SessionCart
+from .routers import REPLICA_PIN_SECONDS, REPLICA_PIN_SESSION_KEY, end_request, start_request
+
+
+class HybridMiddleware:
+    """
+    Base for middleware that runs natively under both WSGI and ASGI, so an
+    async view is awaited without a thread hop. Subclasses implement
+    ``__call__`` for the sync chain and ``__acall__`` for the async one.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.handle(request)
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """
+    ``WhiteNoiseMiddleware`` that also runs natively under ASGI: static
+    files are looked up and opened in a thread, every other request is
+    awaited straight through.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve)(static_file, request)
+        return await self.get_response(request)
+
+
+class CartMiddleware(HybridMiddleware):
+    """Attach a lazily loaded, request-scoped ``SessionCart`` as ``request.cart``."""
+
+    def handle(self, request):
+        request.cart = SimpleLazyObject(lambda: SessionCart(request))
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        request.cart = SimpleLazyObject(lambda: SessionCart(request))
+        return await self.get_response(request)
+
+
+class PrimaryPinningMiddleware(HybridMiddleware):
+    """
+    Track database routing per request and keep a user's reads on the
+    primary for ``REPLICA_PIN_SECONDS`` after a request of theirs wrote, so
+    they see their own orders, reviews and profile changes at once.
+    """
+
+    def start(self, pinned_until):
+        return start_request(pinned=pinned_until > time.time())
+
+    def finish(self, request, state):
+        if state.wrote:
+            request.session[REPLICA_PIN_SESSION_KEY] = time.time() + REPLICA_PIN_SECONDS
+
+    def handle(self, request):
+        token = self.start(request.session.get(REPLICA_PIN_SESSION_KEY, 0))
+        try:
+            response = self.get_response(request)
+        finally:
+            state = end_request(token)
+        self.finish(request, state)
+        return response
+
+    async def __acall__(self, request):
+        # The session may have to be loaded: never from the event loop.
+        token = self.start(await sync_to_async(request.session.get)(REPLICA_PIN_SESSION_KEY, 0))
+        try:
+            response = await self.get_response(request)
+        finally:
+            state = end_request(token)
+        self.finish(request, state)
+        return response
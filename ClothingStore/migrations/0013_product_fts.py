@@ -0,0 +1,35 @@
+from django.db import migrations
+
+FTS_TABLE = 'ClothingStore_product_fts'
+
+
+def create_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        'CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5('
+        'name, description, category, '
+        'tokenize="unicode61 remove_diacritics 2", prefix="2 3")' % FTS_TABLE
+    )
+    schema_editor.execute(
+        'INSERT INTO %s (rowid, name, description, category) '
+        'SELECT p.id, p.name, p.description, c.name '
+        'FROM ClothingStore_product p JOIN ClothingStore_category c ON c.id = p.category_id' % FTS_TABLE
+    )
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS %s' % FTS_TABLE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ClothingStore', '0012_alter_user_managers_alter_user_dob'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.0.6 on 2026-10-18 12:32
+
+from collections import Counter, defaultdict
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_ratings(apps, schema_editor):
+    Product = apps.get_model('ClothingStore', 'Product')
+    Review = apps.get_model('ClothingStore', 'Review')
+    histograms = defaultdict(Counter)
+    rows = Review.objects.order_by().values_list('product_id', 'rating').annotate(count=Count('id'))
+    for product_id, rating, count in rows:
+        histograms[product_id][rating] += count
+    for product_id, histogram in histograms.items():
+        Product.objects.filter(id=product_id).update(
+            rating_count=sum(histogram.values()),
+            rating_sum=sum(rating * count for rating, count in histogram.items()),
+            **{'rating_%d' % rating: count for rating, count in histogram.items()},
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ClothingStore', '0017_product_sku'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_1',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_2',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_3',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_4',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_5',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 12:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ClothingStore', '0018_product_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='image_widths',
+            field=models.JSONField(default=list, editable=False),
+        ),
+    ]
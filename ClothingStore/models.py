@@ -42,10 +42,35 @@ class Product(models.Model):
     size = models.CharField(max_length=1)
     color = models.CharField(max_length=50)
     price = models.DecimalField(max_digits=10, decimal_places=2)
+    stock = models.PositiveIntegerField(null=True, blank=True, help_text='Units on hand; empty means stock is not tracked.')
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True, help_text='Key used by catalog imports.')
+    import_hash = models.CharField(max_length=64, blank=True, editable=False)
+    # Widths of the responsive derivatives made by images.py; empty until generated.
+    image_widths = models.JSONField(default=list, editable=False)
+    # Review aggregates, maintained by the Review signals in signals.py.
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_1 = models.PositiveIntegerField(default=0, editable=False)
+    rating_2 = models.PositiveIntegerField(default=0, editable=False)
+    rating_3 = models.PositiveIntegerField(default=0, editable=False)
+    rating_4 = models.PositiveIntegerField(default=0, editable=False)
+    rating_5 = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.name
 
+    @property
+    def rating_average(self):
+        return round(self.rating_sum / self.rating_count, 1) if self.rating_count else None
+
+    def rating_histogram(self):
+        """``(stars, count, percent)`` from 5 stars down to 1."""
+        return [
+            (stars, count, round(count * 100 / self.rating_count) if self.rating_count else 0)
+            for stars in range(5, 0, -1)
+            for count in [getattr(self, 'rating_%d' % stars)]
+        ]
+
 
 class Order(models.Model):
     STATUS_CHOICES = (
@@ -56,6 +81,16 @@ class Order(models.Model):
         ('return_requested', 'Return Requested'),
         ('return_received', 'Return Received and Refund Issued'),
     )
+    # The statuses an order may move to from each status. Every status
+    # change, by customers or staff, goes through this table.
+    STATUS_TRANSITIONS = {
+        'ordered': ('on_the_way', 'cancelled'),
+        'on_the_way': ('delivered', 'cancelled'),
+        'delivered': ('return_requested',),
+        'cancelled': ('return_requested',),
+        'return_requested': ('return_received',),
+        'return_received': (),
+    }
 
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     products = models.ManyToManyField(Product, through='OrderItem')
@@ -64,6 +99,14 @@ class Order(models.Model):
     payment_method = models.CharField(max_length=50)
     total_cost = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='ordered')
+    stock_reserved = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-ordered_date'], name='order_user_date_idx'),
+            # Incremental recommendation builds read the recently placed orders.
+            models.Index(fields=['ordered_date'], name='order_date_idx'),
+        ]
 
     def __str__(self):
         return f'Order #{self.pk}'
@@ -71,6 +114,14 @@ class Order(models.Model):
     def get_total(self):
         return self.total_cost
 
+    @classmethod
+    def statuses_leading_to(cls, status):
+        return [source for source, targets in cls.STATUS_TRANSITIONS.items() if status in targets]
+
+    def next_status_choices(self):
+        labels = dict(self.STATUS_CHOICES)
+        return [(status, labels[status]) for status in self.STATUS_TRANSITIONS.get(self.status, ())]
+
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, related_name='order_items', on_delete=models.CASCADE)
@@ -91,6 +142,11 @@ class CartItem(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'product'], name='unique_cart_product'),
+        ]
+
     def __str__(self):
         return f'{self.product.name} ({self.quantity})'
     
@@ -101,5 +157,133 @@ class Review(models.Model):
     comment = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', '-created_at'], name='review_product_created_idx'),
+        ]
+
     def __str__(self):
         return f'{self.user.username}\'s review for {self.product.name}'
+
+
+class SalesRollup(models.Model):
+    """
+    Sales totals for one hour or one day, kept up to date by checkout and
+    order status changes so the dashboard never scans ``Order``.
+
+    Orders are counted in the period they were placed in; the ``*_count``
+    columns hold how many of those orders are currently in each status.
+    """
+    HOUR = 'hour'
+    DAY = 'day'
+    PERIOD_CHOICES = (
+        (HOUR, 'Hour'),
+        (DAY, 'Day'),
+    )
+
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    start = models.DateTimeField()
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    orders = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    ordered_count = models.IntegerField(default=0)
+    on_the_way_count = models.IntegerField(default=0)
+    delivered_count = models.IntegerField(default=0)
+    cancelled_count = models.IntegerField(default=0)
+    return_requested_count = models.IntegerField(default=0)
+    return_received_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'start'], name='unique_sales_rollup_period'),
+        ]
+
+    def __str__(self):
+        return f'{self.get_period_display()} from {self.start:%Y-%m-%d %H:%M}'
+
+    @staticmethod
+    def status_field(status):
+        return f'{status}_count'
+
+
+class ProductSalesRollup(models.Model):
+    """Units and revenue per product per day; category totals join through ``product``."""
+    day = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'product'], name='unique_product_sales_rollup_day'),
+        ]
+
+    def __str__(self):
+        return f'{self.product_id} on {self.day}'
+
+
+class CoPurchase(models.Model):
+    """
+    How many orders contained both ``product`` and ``other``, stored once
+    per pair with ``product_id < other_id``. The diagonal row
+    (``product == other``) counts the orders containing the product.
+    Maintained by ``recommendations.build_recommendations``.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    other = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'other'], name='unique_co_purchase_pair'),
+        ]
+
+    def __str__(self):
+        return f'{self.product_id} with {self.other_id}: {self.count}'
+
+
+class Recommendation(models.Model):
+    """The top co-purchased products of ``product``, best first by ``rank``."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['rank']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'rank'], name='unique_recommendation_rank'),
+        ]
+
+    def __str__(self):
+        return f'{self.recommended_id} for {self.product_id} (#{self.rank})'
+
+
+class RecommendationBuild(models.Model):
+    """
+    One run of the recommendation builder; the latest holds the watermark.
+    ``recent_order_ids`` are the orders it counted that the next build reads
+    again, as they fall in its recount window.
+    """
+    built_at = models.DateTimeField(default=timezone.now)
+    watermark = models.DateTimeField()
+    recent_order_ids = models.JSONField(default=list)
+    orders = models.PositiveIntegerField()
+    full = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f'{"Full" if self.full else "Incremental"} build of orders placed up to {self.watermark:%Y-%m-%d %H:%M:%S}'
+
+
+class IdempotencyKey(models.Model):
+    """
+    A claimed ``idempotency_key`` of one view and user. ``location`` is
+    empty while the first request is in flight and holds its redirect once
+    it has completed. Claimed by ``idempotency.idempotent``.
+    """
+    key = models.CharField(max_length=255, unique=True)
+    location = models.CharField(max_length=2048, blank=True)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return self.key
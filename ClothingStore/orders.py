@@ -0,0 +1,68 @@
+from django.db import transaction
+from django.utils.dateparse import parse_date
+
+from .models import Order
+from .rollups import record_status_changes
+from .stock import release_order_stock
+
+ORDERS_PER_PAGE = 100
+
+
+class InvalidStatusError(ValueError):
+    pass
+
+
+def transition_orders(orders, status):
+    """
+    Move every order in ``orders`` that may go to ``status`` there.
+
+    The eligible rows are selected for update and changed with a single
+    ``UPDATE ... WHERE id IN``, inside one transaction together with the
+    stock release for cancellations and the sales rollup status counts, so
+    a batch of any size costs the same handful of queries. Orders whose current status does not allow the
+    move (see ``Order.STATUS_TRANSITIONS``) are left alone, which also
+    makes a repeated request a no-op. Returns the ids that were moved.
+    """
+    if status not in dict(Order.STATUS_CHOICES):
+        raise InvalidStatusError(status)
+    with transaction.atomic():
+        rows = list(
+            orders.select_for_update()
+            .filter(status__in=Order.statuses_leading_to(status))
+            .order_by()
+            .values_list('id', 'status', 'ordered_date')
+        )
+        moved = [order_id for order_id, _, _ in rows]
+        if moved:
+            Order.objects.filter(id__in=moved).update(status=status)
+            if status == 'cancelled':
+                release_order_stock(moved)
+            record_status_changes([(old_status, ordered_date) for _, old_status, ordered_date in rows], status)
+    return moved
+
+
+def parse_date_param(value):
+    try:
+        return parse_date(value or '')
+    except ValueError:
+        return None
+
+
+def filter_orders(params, queryset=None):
+    """Narrow ``queryset`` by the order console's filter parameters."""
+    queryset = Order.objects.all() if queryset is None else queryset
+    status = params.get('status')
+    if status in dict(Order.STATUS_CHOICES):
+        queryset = queryset.filter(status=status)
+    query = (params.get('q') or '').strip()
+    if query.isdigit():
+        queryset = queryset.filter(id=int(query))
+    elif query:
+        queryset = queryset.filter(user__username__iexact=query)
+    date_from = parse_date_param(params.get('date_from'))
+    if date_from:
+        queryset = queryset.filter(ordered_date__date__gte=date_from)
+    date_to = parse_date_param(params.get('date_to'))
+    if date_to:
+        queryset = queryset.filter(ordered_date__date__lte=date_to)
+    return queryset
@@ -0,0 +1,153 @@
+import datetime
+from bisect import bisect_right
+
+from django.core import signing
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+PER_PAGE = 24
+CURSOR_SALT = 'ClothingStore.pagination'
+
+
+def encode_cursor(values):
+    return signing.dumps(list(values), salt=CURSOR_SALT, compress=True, serializer=CursorSerializer)
+
+
+def decode_cursor(token):
+    if not token:
+        return None
+    try:
+        return signing.loads(token, salt=CURSOR_SALT, serializer=CursorSerializer)
+    except signing.BadSignature:
+        return None
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        # DjangoJSONEncoder rounds datetimes to milliseconds; a key compared
+        # for equality with the last row shown must round-trip exactly.
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class CursorSerializer:
+    def dumps(self, obj):
+        return CursorEncoder(separators=(',', ':')).encode(obj).encode('latin-1')
+
+    def loads(self, data):
+        return signing.JSONSerializer().loads(data)
+
+
+class KeysetPage:
+    """
+    One page of a keyset-paginated listing.
+
+    ``next_cursor`` holds the ``(sort_key, id)`` of the last row shown, so the
+    following page is fetched with an indexed range condition instead of an
+    OFFSET that grows with the page number.
+    """
+
+    def __init__(self, request, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.is_first = not request.GET.get('cursor')
+        params = request.GET.copy()
+        params.pop('cursor', None)
+        params.pop('format', None)
+        self.base_query = params.urlencode()
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def next_query(self):
+        params = 'cursor=%s' % self.next_cursor
+        return '%s&%s' % (self.base_query, params) if self.base_query else params
+
+
+def _keyset_queryset(request, queryset, order_by):
+    descending = order_by.startswith('-')
+    field = order_by.lstrip('-')
+    lookup = 'lt' if descending else 'gt'
+    ordering = [order_by, '-id' if descending else 'id'] if field != 'id' else [order_by]
+    queryset = queryset.order_by(*ordering)
+
+    cursor = decode_cursor(request.GET.get('cursor'))
+    if cursor:
+        last_value, last_id = cursor
+        if field == 'id':
+            queryset = queryset.filter(**{'id__%s' % lookup: last_id})
+        else:
+            queryset = queryset.filter(
+                Q(**{'%s__%s' % (field, lookup): last_value}) |
+                Q(**{field: last_value, 'id__%s' % lookup: last_id})
+            )
+    return queryset, field
+
+
+def _keyset_page(request, items, field, per_page):
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        last = items[-1]
+        next_cursor = encode_cursor([getattr(last, field), last.pk])
+    return KeysetPage(request, items, next_cursor)
+
+
+def paginate_queryset(request, queryset, order_by='id', per_page=PER_PAGE):
+    """
+    Keyset-paginate ``queryset`` on ``order_by`` with ``id`` as tie-breaker.
+
+    ``order_by`` is a single field name, optionally prefixed with ``-``.
+    """
+    queryset, field = _keyset_queryset(request, queryset, order_by)
+    return _keyset_page(request, list(queryset[:per_page + 1]), field, per_page)
+
+
+async def apaginate_queryset(request, queryset, order_by='id', per_page=PER_PAGE):
+    """``paginate_queryset`` for async views."""
+    queryset, field = _keyset_queryset(request, queryset, order_by)
+    return _keyset_page(request, [item async for item in queryset[:per_page + 1]], field, per_page)
+
+
+def _page_keys(request, keys, per_page):
+    cursor = decode_cursor(request.GET.get('cursor'))
+    start = bisect_right(keys, tuple(cursor)) if cursor else 0
+    page_keys = keys[start:start + per_page]
+    next_cursor = None
+    if start + per_page < len(keys):
+        next_cursor = encode_cursor(page_keys[-1])
+    return [pk for _, pk in page_keys], next_cursor
+
+
+def _in_order(rows, ids):
+    return [rows[pk] for pk in ids if pk in rows]
+
+
+def paginate_keys(request, keys, queryset, per_page=PER_PAGE):
+    """
+    Keyset-paginate an ascending list of ``(sort_key, id)`` tuples computed
+    in memory (e.g. search rankings), loading only the rows of the current
+    page from ``queryset``.
+    """
+    ids, next_cursor = _page_keys(request, keys, per_page)
+    rows = queryset.in_bulk(ids) if ids else {}
+    return KeysetPage(request, _in_order(rows, ids), next_cursor)
+
+
+async def apaginate_keys(request, keys, queryset, per_page=PER_PAGE):
+    """``paginate_keys`` for async views."""
+    ids, next_cursor = _page_keys(request, keys, per_page)
+    rows = await queryset.ain_bulk(ids) if ids else {}
+    return KeysetPage(request, _in_order(rows, ids), next_cursor)
@@ -0,0 +1,32 @@
+from django.db import transaction
+from django.db.models import F
+
+from .catalog import bump_catalog_version, touch_products
+from .facets import facet_index
+from .models import Product
+
+REVIEWS_PER_PAGE = 10
+
+
+def record_rating(product_id, rating, delta):
+    """
+    Add (``delta=1``) or remove (``delta=-1``) one rating from a product's
+    aggregates.
+
+    Count, sum and the histogram bucket move together in one UPDATE of
+    ``F()`` expressions, so concurrent reviews never lose an increment and
+    the aggregates commit or roll back with the review itself. The facet
+    index is patched once the transaction has committed.
+    """
+    bucket = 'rating_%d' % rating
+    Product.objects.filter(id=product_id).update(
+        rating_count=F('rating_count') + delta,
+        rating_sum=F('rating_sum') + delta * rating,
+        **{bucket: F(bucket) + delta},
+    )
+
+    def update_index():
+        facet_index.update_rating(product_id, delta, delta * rating, bump_catalog_version())
+        touch_products([product_id])
+
+    transaction.on_commit(update_index)
@@ -0,0 +1,216 @@
+import heapq
+import math
+from collections import Counter, defaultdict
+from datetime import timedelta
+from itertools import combinations, groupby
+from operator import itemgetter
+
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .catalog import touch_products
+from .models import CoPurchase, OrderItem, Product, Recommendation, RecommendationBuild
+
+TOP_K = 8
+# Orders with more distinct products than this are left out: they add
+# n^2 pairs of mostly noise (bulk or wholesale orders).
+MAX_BASKET = 50
+# Order lines fetched from the database cursor per round trip.
+CHUNK_SIZE = 10000
+# Product ids per ``IN`` clause, well under SQLite's variable limit.
+ID_BATCH = 500
+BULK_BATCH = 2000
+# Incremental builds read again the orders placed this long before the
+# previous build: a checkout still in flight when it ran commits an order
+# dated before it. Comfortably above the longest checkout transaction.
+RECOUNT_WINDOW = timedelta(minutes=10)
+
+
+def _chunks(values, size=ID_BATCH):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def iter_baskets(since=None):
+    """
+    Stream ``(order_id, ordered_date, sorted product ids)`` for the orders
+    placed since ``since``, or for every order.
+    """
+    rows = OrderItem.objects.all()
+    if since is not None:
+        rows = rows.filter(order__ordered_date__gte=since)
+    rows = (
+        rows.order_by('order_id')
+        .values_list('order_id', 'order__ordered_date', 'product_id')
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+    for (order_id, ordered_date), lines in groupby(rows, key=itemgetter(0, 1)):
+        yield order_id, ordered_date, sorted({product_id for _, _, product_id in lines})
+
+
+def count_co_purchases(baskets):
+    """
+    Count products and product pairs over ``baskets`` of sorted product ids.
+
+    Returns ``(counts, orders)``: ``counts`` maps ``(product_id, other_id)``
+    with ``product_id <= other_id`` to a number of orders, the diagonal
+    holding each product's own order count. Counting is done by
+    ``Counter.update`` over ``combinations``, which runs in C, so Python
+    code is only executed once per order.
+    """
+    counts = Counter()
+    orders = 0
+    for basket in baskets:
+        orders += 1
+        if len(basket) > MAX_BASKET:
+            continue
+        counts.update(zip(basket, basket))
+        counts.update(combinations(basket, 2))
+    return counts, orders
+
+
+def _execute_batches(sql, rows):
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), BULK_BATCH):
+            cursor.executemany(sql, rows[start:start + BULK_BATCH])
+
+
+def _store_counts(counts):
+    """
+    Add ``counts`` to the ``CoPurchase`` table with one upsert per batch:
+    ``INSERT ... ON CONFLICT DO UPDATE SET count = count + excluded.count``
+    (SQLite 3.24+ and PostgreSQL), so existing pairs are never read back.
+    """
+    table = connection.ops.quote_name(CoPurchase._meta.db_table)
+    _execute_batches(
+        'INSERT INTO %s (product_id, other_id, count) VALUES (%%s, %%s, %%s) '
+        'ON CONFLICT (product_id, other_id) DO UPDATE SET count = %s.count + excluded.count' % (table, table),
+        # Key order keeps the index inserts sequential.
+        sorted((product_id, other_id, count) for (product_id, other_id), count in counts.items()),
+    )
+
+
+def _split_counts(rows):
+    """Turn ``(product_id, other_id, count)`` rows into neighbour and order counts."""
+    neighbours = defaultdict(dict)
+    orders = {}
+    for product_id, other_id, count in rows:
+        if product_id == other_id:
+            orders[product_id] = count
+        else:
+            neighbours[product_id][other_id] = count
+            neighbours[other_id][product_id] = count
+    return neighbours, orders
+
+
+def _neighbour_counts(product_ids):
+    """
+    Load the stored co-purchase counts of ``product_ids`` as
+    ``{product: {other: count}}`` in both directions, plus the order count
+    of every product involved.
+    """
+    rows = CoPurchase.objects.values_list('product_id', 'other_id', 'count')
+    # Larger sets read the whole table: one scan beats many OR lookups.
+    if len(product_ids) <= ID_BATCH:
+        rows = rows.filter(Q(product_id__in=product_ids) | Q(other_id__in=product_ids))
+    neighbours, orders = _split_counts(rows.iterator(chunk_size=CHUNK_SIZE))
+    missing = {other_id for others in neighbours.values() for other_id in others} - orders.keys()
+    for chunk in _chunks(missing):
+        orders.update(
+            CoPurchase.objects.filter(product_id__in=chunk, other_id=F('product_id')).values_list('product_id', 'count')
+        )
+    return neighbours, orders
+
+
+def top_neighbours(counts, orders, product_id, k=TOP_K):
+    """
+    The ``k`` products most often bought with ``product_id`` as
+    ``(score, other_id)``, scored by cosine similarity so best sellers do
+    not top every list.
+    """
+    own = orders.get(product_id) or 1
+    return heapq.nlargest(k, (
+        (count / math.sqrt(own * (orders.get(other_id) or 1)), other_id)
+        for other_id, count in counts.items()
+    ))
+
+
+def _store_recommendations(product_ids, neighbours, orders, k):
+    """Replace the recommendations of ``product_ids`` (all products if ``None``)."""
+    if product_ids is None:
+        Recommendation.objects.all().delete()
+        product_ids = list(neighbours)
+    else:
+        for chunk in _chunks(product_ids):
+            Recommendation.objects.filter(product_id__in=chunk).delete()
+    # Plain executemany: model instances would cost more than the ranking.
+    _execute_batches(
+        'INSERT INTO %s (product_id, recommended_id, rank, score) VALUES (%%s, %%s, %%s, %%s)'
+        % connection.ops.quote_name(Recommendation._meta.db_table),
+        [
+            (product_id, other_id, rank, score)
+            for product_id in product_ids
+            for rank, (score, other_id) in enumerate(top_neighbours(neighbours.get(product_id, {}), orders, product_id, k), 1)
+        ],
+    )
+
+
+def build_recommendations(full=False, k=TOP_K):
+    """
+    Fold the orders placed since the last build into the co-purchase counts
+    and refresh the top-``k`` lists of the products they contain.
+
+    A ``full`` build (also the first one) recounts every order and ranks
+    every product. Incremental builds read the orders placed since the
+    previous build started, less ``RECOUNT_WINDOW``, and skip the ones
+    already counted, so orders committed out of date order are counted
+    exactly once. Scores of products outside them are not rescaled for the
+    new order counts of their neighbours until the next full build.
+    """
+    started = timezone.now()
+    previous = RecommendationBuild.objects.order_by('-id').first()
+    full = full or previous is None
+    counted = set() if full else set(previous.recent_order_ids)
+    # Every order read in the next build's window, counted now or before.
+    recent = []
+
+    def new_baskets():
+        for order_id, ordered_date, basket in iter_baskets(None if full else previous.watermark - RECOUNT_WINDOW):
+            if ordered_date >= started - RECOUNT_WINDOW:
+                recent.append(order_id)
+            if order_id not in counted:
+                yield basket
+
+    counts, orders = count_co_purchases(new_baskets())
+    affected = None if full else {product_id for pair in counts for product_id in pair}
+
+    with transaction.atomic():
+        if full:
+            CoPurchase.objects.all().delete()
+            _store_counts(counts)
+            # Every order was just counted in memory: rank from those counts.
+            neighbours, order_counts = _split_counts(
+                (product_id, other_id, count) for (product_id, other_id), count in counts.items()
+            )
+            _store_recommendations(None, neighbours, order_counts, k)
+        elif affected:
+            _store_counts(counts)
+            neighbours, order_counts = _neighbour_counts(affected)
+            _store_recommendations(affected, neighbours, order_counts, k)
+        build = RecommendationBuild.objects.create(
+            watermark=started, recent_order_ids=recent, orders=orders, full=full,
+        )
+
+    touch_products(Product.objects.values_list('id', flat=True) if full else affected)
+    return build
+
+
+async def arecommended_products(product, k=TOP_K):
+    """The stored recommendations of ``product``, in one query."""
+    recommendations = product.recommendations.select_related('recommended').only(
+        'rank', 'product_id', 'recommended__id', 'recommended__name', 'recommended__price',
+        'recommended__image', 'recommended__image_widths',
+    )
+    return [recommendation.recommended async for recommendation in recommendations[:k]]
@@ -0,0 +1,224 @@
+import datetime
+from collections import Counter
+from decimal import Decimal
+
+from django.apps import apps as global_apps
+from django.db import transaction
+from django.db.models import (
+    Case, Count, DecimalField, F, IntegerField, Q, Sum, Value, When,
+)
+from django.db.models.functions import TruncDate, TruncDay, TruncHour
+from django.utils import timezone
+
+from .models import Order, ProductSalesRollup, SalesRollup
+
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+# Ranges up to this many days are charted per hour, longer ones per day.
+HOURLY_CHART_DAYS = 2
+
+
+def period_starts(moment):
+    """Return the local ``(hour, day)`` period starts ``moment`` falls in."""
+    hour = timezone.localtime(moment).replace(minute=0, second=0, microsecond=0)
+    return hour, hour.replace(hour=0)
+
+
+def record_order(order, lines):
+    """
+    Add a newly placed ``order`` to the rollups.
+
+    ``lines`` are ``(product_id, quantity, line_total)`` tuples.
+    Missing rollup rows are created with ``ignore_conflicts`` and then
+    incremented in place with ``F()`` expressions, so the checkout runs the
+    same four queries whatever the size of the cart and concurrent
+    checkouts never overwrite each other's totals.
+    """
+    hour, day = period_starts(order.ordered_date)
+    units = sum(quantity for _, quantity, _ in lines)
+    status_field = SalesRollup.status_field(order.status)
+
+    SalesRollup.objects.bulk_create([
+        SalesRollup(period=SalesRollup.HOUR, start=hour),
+        SalesRollup(period=SalesRollup.DAY, start=day),
+    ], ignore_conflicts=True)
+    SalesRollup.objects.filter(
+        Q(period=SalesRollup.HOUR, start=hour) | Q(period=SalesRollup.DAY, start=day)
+    ).update(
+        revenue=F('revenue') + Value(order.total_cost, output_field=MONEY),
+        orders=F('orders') + 1,
+        units=F('units') + units,
+        **{status_field: F(status_field) + 1},
+    )
+
+    day = day.date()
+    ProductSalesRollup.objects.bulk_create([
+        ProductSalesRollup(day=day, product_id=product_id) for product_id, _, _ in lines
+    ], ignore_conflicts=True)
+    ProductSalesRollup.objects.filter(day=day, product_id__in=[line[0] for line in lines]).update(
+        units=F('units') + Case(
+            *[When(product_id=product_id, then=Value(quantity)) for product_id, quantity, _ in lines],
+            output_field=IntegerField(),
+        ),
+        revenue=F('revenue') + Case(
+            *[When(product_id=product_id, then=Value(total)) for product_id, _, total in lines],
+            output_field=MONEY,
+        ),
+    )
+
+
+def record_status_changes(changes, status):
+    """
+    Move orders between the status counts of their rollup periods.
+
+    ``changes`` are ``(old_status, ordered_date)`` pairs for orders that
+    just moved to ``status``. All touched hour and day rows are adjusted by
+    one CASE UPDATE, however many orders changed.
+    """
+    moved = Counter()
+    for old_status, ordered_date in changes:
+        for period, start in zip((SalesRollup.HOUR, SalesRollup.DAY), period_starts(ordered_date)):
+            moved[period, start, old_status] += 1
+    if not moved:
+        return
+
+    def delta(old_statuses):
+        totals = Counter()
+        for (period, start, old_status), count in moved.items():
+            if old_status in old_statuses:
+                totals[period, start] += count
+        return Case(
+            *[When(period=period, start=start, then=Value(count)) for (period, start), count in totals.items()],
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+
+    old_statuses = {old_status for _, _, old_status in moved}
+    updates = {
+        SalesRollup.status_field(old_status): F(SalesRollup.status_field(old_status)) - delta({old_status})
+        for old_status in old_statuses
+    }
+    target = SalesRollup.status_field(status)
+    updates[target] = F(target) + delta(old_statuses)
+    # start__in also matches rows of the other period that share a start
+    # (midnight); their CASE falls through to 0.
+    SalesRollup.objects.filter(start__in={start for _, start, _ in moved}).update(**updates)
+
+
+def rebuild_rollups(apps=global_apps, batch_size=1000):
+    """
+    Recompute every rollup row from ``Order``/``OrderItem`` history.
+
+    Aggregation happens in the database, grouped by period, so memory use
+    is bounded by the number of periods rather than orders. Product revenue
+    uses current prices, as order lines do not store the price paid.
+    Also used by the migration that introduces the rollups, with the
+    historical ``apps`` registry.
+    """
+    Order = apps.get_model('ClothingStore', 'Order')
+    OrderItem = apps.get_model('ClothingStore', 'OrderItem')
+    SalesRollup = apps.get_model('ClothingStore', 'SalesRollup')
+    ProductSalesRollup = apps.get_model('ClothingStore', 'ProductSalesRollup')
+    statuses = [status for status, _ in Order._meta.get_field('status').choices]
+
+    with transaction.atomic():
+        SalesRollup.objects.all().delete()
+        ProductSalesRollup.objects.all().delete()
+
+        for period, trunc in (('hour', TruncHour), ('day', TruncDay)):
+            units = dict(
+                OrderItem.objects.order_by()
+                .annotate(start=trunc('order__ordered_date'))
+                .values('start')
+                .annotate(units=Sum('quantity'))
+                .values_list('start', 'units')
+            )
+            rows = (
+                Order.objects.order_by()
+                .annotate(start=trunc('ordered_date'))
+                .values('start')
+                .annotate(
+                    revenue=Sum('total_cost'),
+                    orders=Count('id'),
+                    **{'%s_count' % status: Count('id', filter=Q(status=status)) for status in statuses},
+                )
+            )
+            SalesRollup.objects.bulk_create(
+                (SalesRollup(period=period, units=units.get(row['start']) or 0, **row) for row in rows.iterator()),
+                batch_size=batch_size,
+            )
+
+        rows = (
+            OrderItem.objects.order_by()
+            .annotate(day=TruncDate('order__ordered_date'))
+            .values('day', 'product_id')
+            .annotate(units=Sum('quantity'), revenue=Sum(F('quantity') * F('product__price'), output_field=MONEY))
+        )
+        ProductSalesRollup.objects.bulk_create(
+            (
+                ProductSalesRollup(day=row['day'], product_id=row['product_id'], units=row['units'], revenue=row['revenue'])
+                for row in rows.iterator()
+            ),
+            batch_size=batch_size,
+        )
+
+
+def sales_report(date_from, date_to):
+    """
+    Sales KPIs, a chart series and top sellers for ``date_from``..``date_to``
+    (inclusive local dates), read from the rollups only.
+    """
+    tz = timezone.get_current_timezone()
+    start = datetime.datetime.combine(date_from, datetime.time(), tzinfo=tz)
+    end = datetime.datetime.combine(date_to + datetime.timedelta(days=1), datetime.time(), tzinfo=tz)
+    statuses = [status for status, _ in Order.STATUS_CHOICES]
+    status_fields = [SalesRollup.status_field(status) for status in statuses]
+
+    days = SalesRollup.objects.filter(period=SalesRollup.DAY, start__gte=start, start__lt=end)
+    totals = days.aggregate(
+        revenue=Sum('revenue'), orders=Sum('orders'), units=Sum('units'),
+        **{field: Sum(field) for field in status_fields},
+    )
+    totals = {key: value or 0 for key, value in totals.items()}
+    totals['average_order'] = (
+        (Decimal(totals['revenue']) / totals['orders']).quantize(Decimal('0.01')) if totals['orders'] else Decimal('0.00')
+    )
+    labels = dict(Order.STATUS_CHOICES)
+    status_counts = [(labels[status], totals[field]) for status, field in zip(statuses, status_fields)]
+
+    hourly = (date_to - date_from).days < HOURLY_CHART_DAYS
+    step = datetime.timedelta(hours=1) if hourly else datetime.timedelta(days=1)
+    period = SalesRollup.HOUR if hourly else SalesRollup.DAY
+    by_start = {
+        timezone.localtime(row['start']): row
+        for row in SalesRollup.objects.filter(period=period, start__gte=start, start__lt=end)
+        .values('start', 'revenue', 'orders')
+    }
+    series = []
+    moment = start
+    while moment < end:
+        row = by_start.get(moment, {})
+        series.append({'start': moment, 'revenue': row.get('revenue') or 0, 'orders': row.get('orders') or 0})
+        moment = (moment + step).astimezone(tz)
+    peak = max((point['revenue'] for point in series), default=0)
+    for point in series:
+        point['share'] = int(point['revenue'] * 100 / peak) if peak else 0
+
+    products = ProductSalesRollup.objects.filter(day__gte=date_from, day__lte=date_to)
+    top_products = (
+        products.values('product_id', 'product__name')
+        .annotate(units=Sum('units'), revenue=Sum('revenue'))
+        .order_by('-units', 'product_id')[:10]
+    )
+    categories = (
+        products.values('product__category__name')
+        .annotate(units=Sum('units'), revenue=Sum('revenue'))
+        .order_by('-revenue')
+    )
+    return {
+        'totals': totals,
+        'status_counts': status_counts,
+        'series': series,
+        'hourly': hourly,
+        'top_products': list(top_products),
+        'categories': list(categories),
+    }
@@ -0,0 +1,109 @@
+import random
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Seconds a user's reads stay on the primary after one of their requests
+# wrote, comfortably above the replication lag.
+REPLICA_PIN_SECONDS = 10
+REPLICA_PIN_SESSION_KEY = 'primary_pinned_until'
+
+
+class RoutingState:
+    """Where the current request may read from, tracked per request."""
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.replica_reads = False
+        self.wrote = False
+        self.replica = None
+
+
+_routing = ContextVar('database_routing', default=None)
+
+
+def start_request(pinned=False):
+    return _routing.set(RoutingState(pinned))
+
+
+def end_request(token):
+    state = _routing.get()
+    _routing.reset(token)
+    return state
+
+
+def replica_reads(view):
+    """
+    Let GET and HEAD requests of ``view`` read from a replica. Reads go back
+    to the primary once the request writes, inside transactions and for
+    users pinned to the primary by a recent write.
+    """
+    def replica_state(request):
+        state = _routing.get()
+        if state is None or request.method not in ('GET', 'HEAD'):
+            return None
+        return state
+
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            state = replica_state(request)
+            if state is None:
+                return await view(request, *args, **kwargs)
+            state.replica_reads = True
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                state.replica_reads = False
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        state = replica_state(request)
+        if state is None:
+            return view(request, *args, **kwargs)
+        state.replica_reads = True
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            state.replica_reads = False
+    return wrapper
+
+
+class PrimaryReplicaRouter:
+    """
+    Send writes to the primary (``default``) and the reads of views marked
+    with ``replica_reads`` to one of ``settings.DATABASE_REPLICAS``, picked
+    once per request.
+    """
+
+    def db_for_read(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        state = _routing.get()
+        if (
+            not settings.DATABASE_REPLICAS or state is None or not state.replica_reads
+            or state.pinned or state.wrote or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return DEFAULT_DB_ALIAS
+        if state.replica is None:
+            state.replica = random.choice(settings.DATABASE_REPLICAS)
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _routing.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive the schema from the primary.
+        return db not in settings.DATABASE_REPLICAS
@@ -0,0 +1,237 @@
+import math
+import re
+import threading
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connection, transaction
+
+from .catalog import get_catalog_version
+from .models import Product
+
+FTS_TABLE = 'ClothingStore_product_fts'
+MAX_RESULTS = 1000
+
+# BM25 parameters, same defaults as SQLite's bm25().
+K1 = 1.2
+B = 0.75
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or '').lower())
+
+
+def product_rows(queryset=None):
+    # Whole-catalog builds read the primary: a replica may not have caught
+    # up with the catalog version the index is stamped with.
+    queryset = Product.objects.using(DEFAULT_DB_ALIAS) if queryset is None else queryset
+    return queryset.values_list('id', 'name', 'description', 'category__name')
+
+
+class FTS5Backend:
+    """
+    Ranked search over an SQLite FTS5 table keyed by product id.
+
+    Each query term is matched as a prefix, terms are OR-ed together and
+    results are ordered by the built-in bm25() rank.
+    """
+
+    def __init__(self):
+        self._available = None
+
+    def available(self):
+        if self._available is None:
+            self._available = (
+                connection.vendor == 'sqlite'
+                and FTS_TABLE in connection.introspection.table_names()
+            )
+        return self._available
+
+    def search(self, query, limit=MAX_RESULTS):
+        terms = tokenize(query)
+        if not terms:
+            return []
+        match = ' OR '.join('"%s"*' % term for term in terms)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT bm25(%s), rowid FROM %s WHERE %s MATCH %%s ORDER BY 1, 2 LIMIT %%s'
+                % (FTS_TABLE, FTS_TABLE, FTS_TABLE),
+                [match, limit],
+            )
+            return [(rank, product_id) for rank, product_id in cursor.fetchall()]
+
+    def index(self, rows, version=None):
+        rows = list(rows)
+        # One transaction, so concurrent saves of a product cannot both
+        # delete its row and then both insert it.
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany('DELETE FROM %s WHERE rowid = %%s' % FTS_TABLE, [(row[0],) for row in rows])
+            cursor.executemany(
+                'INSERT INTO %s (rowid, name, description, category) VALUES (%%s, %%s, %%s, %%s)' % FTS_TABLE,
+                rows,
+            )
+
+    def remove(self, product_id, version=None):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM %s WHERE rowid = %%s' % FTS_TABLE, [product_id])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM %s' % FTS_TABLE)
+        self.index(product_rows().iterator())
+
+
+class InvertedIndexBackend:
+    """
+    Pure-Python BM25 inverted index, used when FTS5 is not available.
+
+    Postings map each term to ``{product_id: term_frequency}``; the sorted
+    term list lets query terms match as prefixes, like the FTS5 backend.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._version = None
+        self._clear()
+
+    def _clear(self):
+        self.postings = defaultdict(dict)
+        self.doc_terms = {}
+        self.doc_lengths = {}
+        self.total_length = 0
+        self.terms = []
+
+    def available(self):
+        return True
+
+    def invalidate(self):
+        with self._lock:
+            self._version = None
+
+    def _ensure_built(self):
+        version = get_catalog_version()
+        if self._version != version:
+            self.rebuild(version)
+
+    def _add(self, product_id, *fields):
+        counts = Counter(term for field in fields for term in tokenize(field))
+        self.doc_terms[product_id] = counts
+        self.doc_lengths[product_id] = sum(counts.values())
+        self.total_length += self.doc_lengths[product_id]
+        for term, tf in counts.items():
+            self.postings[term][product_id] = tf
+
+    def _remove(self, product_id):
+        counts = self.doc_terms.pop(product_id, None)
+        if counts is None:
+            return
+        self.total_length -= self.doc_lengths.pop(product_id)
+        for term in counts:
+            self.postings[term].pop(product_id, None)
+            if not self.postings[term]:
+                del self.postings[term]
+
+    def rebuild(self, version=None):
+        with self._lock:
+            self._clear()
+            for row in product_rows().iterator():
+                self._add(*row)
+            self.terms = sorted(self.postings)
+            self._version = version
+
+    def index(self, rows, version):
+        with self._lock:
+            if self._version != version - 1:
+                self._version = None
+                return
+            for row in rows:
+                self._remove(row[0])
+                self._add(*row)
+            self.terms = sorted(self.postings)
+            self._version = version
+
+    def remove(self, product_id, version):
+        with self._lock:
+            if self._version != version - 1:
+                self._version = None
+                return
+            self._remove(product_id)
+            self.terms = sorted(self.postings)
+            self._version = version
+
+    def _expand(self, term):
+        start = bisect_left(self.terms, term)
+        end = start
+        while end < len(self.terms) and self.terms[end].startswith(term):
+            end += 1
+        return self.terms[start:end]
+
+    def search(self, query, limit=MAX_RESULTS):
+        self._ensure_built()
+        with self._lock:
+            doc_count = len(self.doc_lengths)
+            if not doc_count:
+                return []
+            avg_length = self.total_length / doc_count
+            scores = defaultdict(float)
+            for query_term in set(tokenize(query)):
+                for term in self._expand(query_term):
+                    postings = self.postings[term]
+                    idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                    for product_id, tf in postings.items():
+                        norm = K1 * (1 - B + B * self.doc_lengths[product_id] / avg_length)
+                        scores[product_id] += idf * tf * (K1 + 1) / (tf + norm)
+        ranked = sorted((-score, product_id) for product_id, score in scores.items())
+        return ranked[:limit]
+
+
+fts5_backend = FTS5Backend()
+python_backend = InvertedIndexBackend()
+
+
+def get_backend():
+    try:
+        if fts5_backend.available():
+            return fts5_backend
+    except OperationalError:
+        pass
+    return python_backend
+
+
+def search_products(query, limit=MAX_RESULTS):
+    """
+    Return ``(rank, product_id)`` pairs for ``query``, best match first.
+
+    Lower ranks are better, matching SQLite's bm25() convention, so the list
+    can be keyset-paginated in ascending order.
+    """
+    return get_backend().search(query, limit)
+
+
+def index_products(queryset, version=None):
+    get_backend().index(product_rows(queryset), version)
+
+
+def remove_product(product_id, version=None):
+    get_backend().remove(product_id, version)
+
+
+def reindex_products(product_ids, batch_size=500):
+    """
+    Index products written in bulk, which bypasses the ``post_save`` signal.
+
+    The in-memory backend rebuilds itself on the next search once the
+    catalog version has been bumped, so only FTS5 needs the rows.
+    """
+    backend = get_backend()
+    if backend is not fts5_backend:
+        return
+    product_ids = list(product_ids)
+    for start in range(0, len(product_ids), batch_size):
+        backend.index(product_rows(Product.objects.filter(id__in=product_ids[start:start + batch_size])))
+
+
+def rebuild_index():
+    get_backend().rebuild()
@@ -0,0 +1,87 @@
+from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import search
+from .cart import SessionCart
+from .catalog import bump_catalog_version, touch_products
+from .facets import facet_index
+from .models import Category, Product, Review
+from .ratings import record_rating
+
+
+# The indexes and version stamps live outside the database, so they are
+# only moved once the write has committed: a rolled back save must not
+# leave them describing rows that never existed.
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, **kwargs):
+    def update_indexes():
+        version = bump_catalog_version()
+        facet_index.update_product(instance, version)
+        search.index_products(Product.objects.filter(pk=instance.pk), version)
+        touch_products([instance.pk])
+
+    transaction.on_commit(update_indexes)
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    def update_indexes():
+        version = bump_catalog_version()
+        facet_index.remove_product(instance.pk, version)
+        search.remove_product(instance.pk, version)
+
+    transaction.on_commit(update_indexes)
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, created, **kwargs):
+    if created:
+        return
+
+    def update_indexes():
+        version = bump_catalog_version()
+        facet_index.invalidate()
+        search.index_products(instance.product_set.all(), version)
+        touch_products(instance.product_set.values_list('id', flat=True))
+
+    transaction.on_commit(update_indexes)
+
+
+@receiver(pre_save, sender=Review)
+def review_saving(sender, instance, **kwargs):
+    instance._previous_rating = None
+    if instance.pk:
+        instance._previous_rating = Review.objects.filter(pk=instance.pk).values_list('rating', flat=True).first()
+
+
+@receiver(post_save, sender=Review)
+def review_saved(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_rating', None)
+    if previous == instance.rating:
+        # Only the comment changed: the aggregates stand, the page does not.
+        transaction.on_commit(lambda: touch_products([instance.product_id]))
+        return
+    if previous is not None:
+        record_rating(instance.product_id, previous, -1)
+    record_rating(instance.product_id, instance.rating, 1)
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, **kwargs):
+    record_rating(instance.product_id, instance.rating, -1)
+
+
+@receiver(user_logged_in)
+def merge_cart_at_login(sender, request, user, **kwargs):
+    if request is not None and hasattr(request, 'session'):
+        request.cart = SessionCart.merge_at_login(request, user)
+
+
+@receiver(user_logged_out)
+def flush_cart_at_logout(sender, request, user, **kwargs):
+    if request is not None and user is not None and hasattr(request, 'session'):
+        SessionCart(request, user).flush()
@@ -0,0 +1,78 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+# Milliseconds a connection waits for the write lock before raising
+# "database is locked", unless the database OPTIONS set a ``timeout``.
+BUSY_TIMEOUT = 20000
+
+# Tuning applied to every new SQLite connection, selected by the
+# SQLITE_PROFILE setting.
+SQLITE_PROFILES = {
+    # SQLite's own behaviour: rollback journal, an fsync per commit and
+    # deferred transactions.
+    'default': {
+        'pragmas': {},
+        'immediate': False,
+    },
+    # For a checked-out database file: writers queue on the busy timeout
+    # and BEGIN IMMEDIATE, but the file keeps its rollback journal, so
+    # running the server does not switch it to WAL.
+    'development': {
+        'pragmas': {
+            'busy_timeout': BUSY_TIMEOUT,
+            'temp_store': 'MEMORY',
+        },
+        'immediate': True,
+    },
+    'production': {
+        'pragmas': {
+            # Readers and the single writer no longer block each other.
+            'journal_mode': 'WAL',
+            'busy_timeout': BUSY_TIMEOUT,
+            # In WAL mode only checkpoints fsync: a power cut can lose the
+            # last commits but never corrupts the database.
+            'synchronous': 'NORMAL',
+            'mmap_size': 256 * 1024 * 1024,
+            # Negative values are KiB: a 64 MiB page cache per connection.
+            'cache_size': -64 * 1024,
+            'temp_store': 'MEMORY',
+        },
+        'immediate': True,
+    },
+}
+
+
+def _begin_immediate(connection):
+    connection.cursor().execute('BEGIN IMMEDIATE')
+
+
+@receiver(connection_created)
+def apply_sqlite_profile(sender, connection, **kwargs):
+    """
+    Run the PRAGMAs of the configured profile on a new SQLite connection.
+
+    The production profile also opens every ``transaction.atomic()`` block
+    with ``BEGIN IMMEDIATE``. Reads here run in autocommit, so atomic blocks
+    are the write paths (checkout, stock, cart flushes, order updates). A
+    deferred ``BEGIN`` takes the write lock at its first write, and SQLite
+    fails a reader that tries to become a writer while another connection
+    holds that lock straight away with "database is locked", whatever the
+    busy timeout. Taking the lock at ``BEGIN`` makes writers queue on the
+    busy timeout instead. Django 5.1's ``OPTIONS['transaction_mode']`` does
+    the same; on 5.0 it takes overriding the connection's BEGIN.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    profile = SQLITE_PROFILES[getattr(settings, 'SQLITE_PROFILE', 'default')]
+    pragmas = dict(profile['pragmas'])
+    timeout = connection.settings_dict['OPTIONS'].get('timeout')
+    if 'busy_timeout' in pragmas and timeout is not None:
+        pragmas['busy_timeout'] = int(timeout * 1000)
+    for name, value in pragmas.items():
+        connection.connection.execute('PRAGMA %s = %s' % (name, value))
+
+    if profile['immediate']:
+        connection._start_transaction_under_autocommit = _begin_immediate.__get__(connection)
+    else:
+        connection.__dict__.pop('_start_transaction_under_autocommit', None)
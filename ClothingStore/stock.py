@@ -0,0 +1,69 @@
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, Sum, Value, When
+
+from .catalog import touch_products
+from .models import Order, OrderItem, Product
+
+
+class OutOfStockError(Exception):
+    def __init__(self, product_ids):
+        super().__init__('Insufficient stock for products %s' % sorted(product_ids))
+        self.product_ids = product_ids
+
+
+def _quantity_case(quantities):
+    return Case(
+        *[When(id=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+        output_field=PositiveIntegerField(),
+    )
+
+
+def reserve_stock(quantities, stock_levels):
+    """
+    Decrement stock for ``{product_id: quantity}`` in a single conditional UPDATE.
+
+    Every tracked product is decremented only ``WHERE stock >= quantity``, so
+    concurrent checkouts can never drive stock below zero and nothing is
+    read back and rewritten. ``stock_levels`` maps product ids to the stock
+    seen when pricing the cart; products with ``None`` are untracked. If
+    fewer rows were updated than requested the caller's transaction must
+    roll back, which ``OutOfStockError`` does when raised inside it.
+    """
+    tracked = {
+        product_id: quantity for product_id, quantity in quantities.items()
+        if stock_levels.get(product_id) is not None
+    }
+    if not tracked:
+        return
+    quantity = _quantity_case(tracked)
+    updated = Product.objects.filter(id__in=list(tracked), stock__gte=quantity).update(stock=F('stock') - quantity)
+    if updated != len(tracked):
+        short = [product_id for product_id, qty in tracked.items() if stock_levels[product_id] < qty]
+        raise OutOfStockError(short or list(tracked))
+    transaction.on_commit(lambda: touch_products(tracked))
+
+
+def release_order_stock(order_ids):
+    """
+    Give the reserved units of ``order_ids`` back, at most once per order.
+
+    Runs inside the transaction that cancelled the orders, after their rows
+    were locked, so only orders still flagged ``stock_reserved`` are
+    released and the flag is cleared in the same UPDATE batch. Quantities
+    are summed per product and returned with one CASE UPDATE, however many
+    orders are cancelled together.
+    """
+    reserved_ids = list(Order.objects.filter(id__in=order_ids, stock_reserved=True).values_list('id', flat=True))
+    if not reserved_ids:
+        return
+    Order.objects.filter(id__in=reserved_ids).update(stock_reserved=False)
+    quantities = dict(
+        OrderItem.objects.filter(order_id__in=reserved_ids)
+        .values('product_id')
+        .annotate(total=Sum('quantity'))
+        .values_list('product_id', 'total')
+    )
+    if quantities:
+        quantity = _quantity_case(quantities)
+        Product.objects.filter(id__in=list(quantities), stock__isnull=False).update(stock=F('stock') + quantity)
+        transaction.on_commit(lambda: touch_products(quantities))
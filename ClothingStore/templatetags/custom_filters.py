@@ -1,4 +1,14 @@
 from django import template
+from django.core.files.storage import default_storage
+from django.templatetags.static import static
+from django.utils.html import format_html
+
+from ClothingStore.idempotency import IDEMPOTENCY_FIELD, new_idempotency_key
+from ClothingStore.images import derivative_name, srcset
+
+# Derivative used as ``src`` by browsers without ``srcset`` support.
+FALLBACK_WIDTH = 640
+
 register = template.Library()
 
 @register.filter
@@ -6,4 +16,33 @@ def multiply(value, arg):
     try:
         return format(float(value) * float(arg), '.2f')
     except (ValueError, TypeError):
-        return ''
\ No newline at end of file
+        return ''
+
+@register.simple_tag
+def idempotency_key():
+    return format_html('<input type="hidden" name="{}" value="{}">', IDEMPOTENCY_FIELD, new_idempotency_key())
+
+@register.simple_tag
+def product_image(product, sizes='100vw', css_class='', style='', default='img/default.jpg', eager=False):
+    """
+    Render ``product.image`` as a ``<picture>`` with WebP and JPEG ``srcset``s
+    of its derivatives, letting the browser pick the smallest file for
+    ``sizes``. Falls back to the original until derivatives exist.
+    """
+    loading = format_html('fetchpriority="high"') if eager else format_html('loading="lazy"')
+    if not product.image:
+        return format_html('<img src="{}" alt="{}" class="{}" style="{}" {} decoding="async">',
+                           static(default), product.name, css_class, style, loading)
+    widths = product.image_widths
+    if not widths:
+        return format_html('<img src="{}" alt="{}" class="{}" style="{}" {} decoding="async">',
+                           product.image.url, product.name, css_class, style, loading)
+    name = product.image.name
+    fallback = max((width for width in widths if width <= FALLBACK_WIDTH), default=widths[0])
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" alt="{}" class="{}" style="{}" {} decoding="async"></picture>',
+        srcset(name, widths, 'webp'), sizes,
+        default_storage.url(derivative_name(name, fallback, 'jpg')), srcset(name, widths, 'jpg'), sizes,
+        product.name, css_class, style, loading,
+    )
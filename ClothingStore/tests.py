@@ -1,3 +1,1433 @@
-from django.test import TestCase
+import csv
+import datetime
+import gzip
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from decimal import Decimal
+from importlib import import_module
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core import signing
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from django.utils import timezone
+from PIL import ExifTags, Image
+
+from . import search
+from .cart import CART_FLUSH_INTERVAL, CART_SESSION_KEY
+from .catalog_import import import_catalog
+from .facets import facet_index
+from .fragments import acached_product_grid
+from .images import derivative_name
+from .instrumentation import InstrumentationMiddleware, fingerprint, metrics
+from .management.commands.benchmark_routes import ROUTES, named_routes
+from .management.seeding import seed_store
+from .models import (
+    Cart, CartItem, Category, CoPurchase, IdempotencyKey, Order, OrderItem, Product, ProductSalesRollup,
+    Recommendation, Review, SalesRollup, User,
+)
+from .orders import transition_orders
+from .pagination import CURSOR_SALT
+from .recommendations import build_recommendations
+from .rollups import rebuild_rollups
+from .routers import REPLICA_PIN_SESSION_KEY, PrimaryReplicaRouter, end_request, replica_reads, start_request
+
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests'},
+    'sessions': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-sessions'},
+}
+
+# Templates are rendered without a collectstatic manifest, and sessions are
+# cached in memory instead of the on-disk cache of a real deployment.
+test_settings = override_settings(
+    STORAGES={
+        'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    },
+    CACHES=TEST_CACHES,
+)
+
+
+def setUpModule():
+    test_settings.enable()
+
+
+def tearDownModule():
+    test_settings.disable()
+
+
+class FacetIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.female = Category.objects.create(name='female')
+        male = Category.objects.create(name='male')
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.products = [
+                Product.objects.create(
+                    name=name, description='Cotton', image='products/red.jpeg', category=category,
+                    size=size, color=color, price=Decimal(price),
+                )
+                for name, category, size, color, price in (
+                    ('Red tee', cls.female, 'M', 'red', '20.00'),
+                    ('Red dress', cls.female, 'S', 'red', '60.00'),
+                    ('Blue tee', male, 'M', 'blue', '49.99'),
+                    ('Red shirt', male, 'M', 'red', '150.00'),
+                )
+            ]
+
+    def home(self, **params):
+        return self.client.get(reverse('home'), params)
+
+    def names(self, response):
+        return sorted(re.findall(r'<h5 class="card-title">(.*?)</h5>', response.context['grid_html']))
+
+    def test_filters_intersect_and_each_facet_counts_the_others(self):
+        response = self.home(category='male', color='red')
+        self.assertEqual(self.names(response), ['Red shirt'])
+        counts = response.context['context']['facet_counts']
+        # A facet's counts ignore its own filter but apply all the others.
+        self.assertEqual(dict(counts['category']), {'female': 2, 'male': 1})
+        self.assertEqual(dict(counts['color']), {'red': 1, 'blue': 1})
+        self.assertEqual(dict(counts['size']), {'M': 1, 'S': 0})
+
+        response = self.home(size='M', price='0-50')
+        self.assertEqual(self.names(response), ['Blue tee', 'Red tee'])
+        counts = response.context['context']['facet_counts']
+        self.assertEqual(dict(counts['category']), {'female': 1, 'male': 1})
+        self.assertEqual([bucket['count'] for bucket in counts['price']], [2, 0, 1, 0])
+
+    def test_product_saves_reach_the_index_once_committed(self):
+        # The save below is rolled back after the test; the index is not.
+        self.addCleanup(facet_index.invalidate)
+        product = self.products[0]
+        self.home()
+        with self.captureOnCommitCallbacks() as callbacks:
+            product.color = 'blue'
+            product.save()
+        self.assertEqual(self.names(self.home(color='blue')), ['Blue tee'])
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.names(self.home(color='blue')), ['Blue tee', 'Red tee'])
+        counts = self.home().context['context']['facet_counts']
+        self.assertEqual(dict(counts['color']), {'red': 2, 'blue': 2})
+
+    def test_invalid_price_ranges_are_ignored(self):
+        everything = self.names(self.home())
+        self.assertEqual(len(everything), 4)
+        for price in ('abc', '10', '100-10', 'NaN-5', '1-2-3'):
+            self.assertEqual(self.names(self.home(price=price)), everything)
+        self.assertEqual(self.names(self.home(price='49.99-100')), ['Blue tee', 'Red dress'])
+
+
+class ProductGridCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='female')
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.products = [
+                Product.objects.create(
+                    name='Scarf %d' % i, description='Wool', image='products/red.jpeg', category=category,
+                    size='1', color='red', price=Decimal('15.00'),
+                )
+                for i in range(2)
+            ]
+        cls.user = User.objects.create_user(username='shopper', password='secret-pass-123')
+
+    def setUp(self):
+        # Fragments cached by other tests may show rows they rolled back.
+        caches['default'].clear()
+
+    def home(self, client):
+        """The response and the queries that loaded a page of grid rows."""
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(reverse('home'))
+        row_queries = [query['sql'] for query in queries if '"ClothingStore_product"."id" IN' in query['sql']]
+        return response, row_queries
+
+    def test_grid_is_rendered_once_and_cart_buttons_per_visitor(self):
+        self.client.force_login(self.user)
+        self.client.post(reverse('add_to_cart', args=[self.products[0].id]))
+        response, row_queries = self.home(self.client)
+        self.assertTrue(row_queries)
+        self.assertContains(response, 'Go to Cart', count=1)
+        self.assertContains(response, 'Add to Cart', count=1)
+        self.assertContains(response, reverse('add_to_cart', args=[self.products[1].id]))
+
+        response, row_queries = self.home(self.client_class())
+        self.assertEqual(row_queries, [])
+        self.assertNotContains(response, 'Go to Cart')
+        self.assertContains(response, 'Add to Cart', count=2)
+        self.assertNotContains(response, '<!-- cart-button:')
+
+    def test_catalog_changes_render_a_new_grid(self):
+        # The rename below is rolled back after the test; the index is not.
+        self.addCleanup(facet_index.invalidate)
+        self.home(self.client)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[0].name = 'Shawl'
+            self.products[0].save()
+        response, row_queries = self.home(self.client)
+        self.assertTrue(row_queries)
+        self.assertContains(response, 'Shawl')
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='shopper', password='secret-pass-123')
+        ordered_date = timezone.now()
+        cls.orders = Order.objects.bulk_create([
+            Order(user=cls.user, shipping_address='x', payment_method='card', ordered_date=ordered_date)
+            for _ in range(30)
+        ])
+        category = Category.objects.create(name='female')
+        # Rolled back products of earlier tests may still be indexed under
+        # the ids these get, with their ratings.
+        facet_index.invalidate()
+        with cls.captureOnCommitCallbacks(execute=True):
+            # Three ratings shared by ten products each.
+            cls.products = [
+                Product.objects.create(
+                    name='Scarf %d' % i, description='Wool', image='products/red.jpeg', category=category,
+                    size='1', color='red', price=Decimal('15.00'), rating_count=1, rating_sum=i % 3 + 1,
+                )
+                for i in range(30)
+            ]
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def order_pages(self, query=''):
+        pages = []
+        while query is not None:
+            orders = self.client.get('%s?%s' % (reverse('order_history'), query)).context['orders']
+            pages.append([order.id for order in orders])
+            query = orders.next_query if orders.has_next else None
+        return pages
+
+    def test_orders_with_the_same_date_page_by_id(self):
+        pages = self.order_pages()
+        self.assertEqual([len(page) for page in pages], [24, 6])
+        self.assertEqual(sum(pages, []), sorted((order.id for order in self.orders), reverse=True))
+
+    def test_products_with_the_same_rating_are_each_shown_once(self):
+        names, query = [], 'sort=rating'
+        while query is not None:
+            page = self.client.get('%s?%s&format=json' % (reverse('home'), query)).json()
+            names += re.findall(r'<h5 class="card-title">(.*?)</h5>', page['html'])
+            query = page['next_query']
+        by_rating = sorted(self.products, key=lambda product: (-product.rating_sum, product.id))
+        self.assertEqual(names, [product.name for product in by_rating])
+
+    def test_tampered_cursors_restart_from_the_first_page(self):
+        first_page = self.order_pages()[0]
+        cursor = self.client.get(reverse('order_history')).context['orders'].next_cursor
+        forged = signing.dumps([timezone.now().isoformat(), 0], salt=CURSOR_SALT, key='not-the-secret-key')
+        for token in (cursor[:-1] + ('A' if cursor[-1] != 'A' else 'B'), forged, 'garbage'):
+            response = self.client.get(reverse('order_history'), {'cursor': token})
+            self.assertEqual([order.id for order in response.context['orders']], first_page)
+
+
+class SearchIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='female')
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.scarf, cls.hat, cls.tee = [
+                Product.objects.create(
+                    name=name, description=description, image='products/red.jpeg', category=category,
+                    size='1', color='red', price=Decimal('15.00'),
+                )
+                for name, description in (
+                    ('Wool scarf', 'Wool'),
+                    ('Wool hat', 'Knitted from soft merino, with a folded brim and a pompom on top'),
+                    ('Cotton tee', 'Soft'),
+                )
+            ]
+
+    def setUp(self):
+        # The in-memory index outlives the rolled back test transactions.
+        search.python_backend.invalidate()
+        self.addCleanup(search.python_backend.invalidate)
+
+    def backends(self):
+        self.assertTrue(search.fts5_backend.available())
+        yield search.fts5_backend
+        with mock.patch.object(search.fts5_backend, 'available', return_value=False):
+            yield search.python_backend
+
+    def search(self, query):
+        response = self.client.get(reverse('product_search'), {'q': query})
+        return [product.name for product in response.context['products']]
+
+    def test_results_are_ranked_by_bm25(self):
+        for backend in self.backends():
+            with self.subTest(backend=type(backend).__name__):
+                self.assertIs(search.get_backend(), backend)
+                # The shorter document mentions "wool" twice.
+                self.assertEqual(self.search('wool'), ['Wool scarf', 'Wool hat'])
+                # Matching both terms beats matching one; terms match as prefixes.
+                self.assertEqual(self.search('sof hat'), ['Wool hat', 'Cotton tee'])
+                self.assertEqual(self.search('linen'), [])
+
+    def assert_renames_and_deletions_are_reindexed(self):
+        self.search('wool')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.scarf.name = 'Linen scarf'
+            self.scarf.description = 'Linen'
+            self.scarf.save()
+        self.assertEqual(self.search('wool'), ['Wool hat'])
+        self.assertEqual(self.search('linen'), ['Linen scarf'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.hat.delete()
+        self.assertEqual(self.search('wool'), [])
+
+    def test_fts5_reindexes_renamed_and_deleted_products(self):
+        self.assert_renames_and_deletions_are_reindexed()
+
+    def test_in_memory_index_follows_renamed_and_deleted_products(self):
+        with mock.patch.object(search.fts5_backend, 'available', return_value=False):
+            self.assert_renames_and_deletions_are_reindexed()
+
+    def test_rebuild_search_index_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM %s' % search.FTS_TABLE)
+        self.assertEqual(self.search('wool'), [])
+        out = io.StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'Indexed 3 products with FTS5Backend.')
+        self.assertEqual(self.search('wool'), ['Wool scarf', 'Wool hat'])
+
+
+class CheckoutPipelineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='shopper', password='secret-pass-123')
+        Cart.objects.create(user=cls.user)
+        category = Category.objects.create(name='female')
+        cls.products = Product.objects.bulk_create([
+            Product(
+                name='Product %d' % i, description='Description', image='products/red.jpeg',
+                category=category, size='M', color='red', price=Decimal('10.50'),
+            )
+            for i in range(200)
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def fill_cart(self, products, quantity=2):
+        session = self.client.session
+        session[CART_SESSION_KEY] = {
+            'items': {str(product.id): quantity for product in products},
+            'dirty_since': time.time(),
+        }
+        session.save()
+
+    def checkout(self):
+        return self.client.post(reverse('checkout'), {
+            'shipping_address': '1 Main Street',
+            'payment_method': 'cash_on_delivery',
+        })
+
+    def test_checkout_creates_order_with_quantities(self):
+        self.fill_cart(self.products[:3], quantity=2)
+        response = self.checkout()
+
+        order = Order.objects.get(user=self.user)
+        self.assertRedirects(response, reverse('order_placed', args=[order.id]))
+        self.assertEqual(order.total_cost, Decimal('63.00'))
+        self.assertEqual(
+            sorted(OrderItem.objects.filter(order=order).values_list('product_id', 'quantity')),
+            [(product.id, 2) for product in self.products[:3]],
+        )
+        self.assertFalse(CartItem.objects.filter(cart__user=self.user).exists())
+        self.assertEqual(self.client.session[CART_SESSION_KEY]['items'], {})
+
+    def test_checkout_query_count_is_independent_of_cart_size(self):
+        self.fill_cart(self.products[:1])
+        with self.assertNumQueries(15):
+            self.checkout()
+
+        self.fill_cart(self.products)
+        with self.assertNumQueries(15):
+            self.checkout()
+
+        self.assertEqual(OrderItem.objects.filter(order__user=self.user).count(), 201)
+
+    def test_failed_checkout_rolls_back(self):
+        self.fill_cart(self.products[:2])
+        with mock.patch('ClothingStore.checkout.OrderItem.objects.bulk_create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.checkout()
+
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(CartItem.objects.filter(cart__user=self.user).exists())
+        self.assertEqual(len(self.client.session[CART_SESSION_KEY]['items']), 2)
+
+        self.checkout()
+        self.assertEqual(OrderItem.objects.filter(order__user=self.user).count(), 2)
+
+
+class StockReservationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='shopper', password='secret-pass-123')
+        category = Category.objects.create(name='male')
+        cls.product = Product.objects.create(
+            name='Limited Tee', description='Drop', image='products/red.jpeg',
+            category=category, size='L', color='red', price=Decimal('20.00'), stock=3,
+        )
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def checkout(self, quantity):
+        session = self.client.session
+        session[CART_SESSION_KEY] = {'items': {str(self.product.id): quantity}, 'dirty_since': time.time()}
+        session.save()
+        return self.client.post(reverse('checkout'), {
+            'shipping_address': '1 Main Street',
+            'payment_method': 'card',
+        })
+
+    def test_checkout_reserves_stock(self):
+        self.checkout(2)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 1)
+        self.assertTrue(Order.objects.get(user=self.user).stock_reserved)
+
+    def test_insufficient_stock_rolls_back_checkout(self):
+        response = self.checkout(4)
+        self.assertRedirects(response, reverse('cart'), fetch_redirect_response=False)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+        self.assertFalse(Order.objects.exists())
+
+    def test_cancel_releases_stock_once(self):
+        self.checkout(2)
+        order = Order.objects.get(user=self.user)
+        self.client.get(reverse('cancel_it', args=[order.id]))
+        self.client.get(reverse('cancel_it', args=[order.id]))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+
+
+class IdempotentCheckoutTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='shopper', password='secret-pass-123')
+        category = Category.objects.create(name='female')
+        cls.product = Product.objects.create(
+            name='Saree', description='Silk', image='products/red.jpeg',
+            category=category, size='1', color='red', price=Decimal('99.00'),
+        )
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        session = self.client.session
+        session[CART_SESSION_KEY] = {'items': {str(self.product.id): 1}, 'dirty_since': time.time()}
+        session.save()
+
+    def test_replayed_checkout_returns_original_redirect(self):
+        data = {
+            'shipping_address': '1 Main Street',
+            'payment_method': 'card',
+            'idempotency_key': 'b7c1f0b2d7d54a7c9a0e5c1f2e3d4c5b',
+        }
+        first = self.client.post(reverse('checkout'), data)
+        with CaptureQueriesContext(connection) as queries:
+            replay = self.client.post(reverse('checkout'), data)
+
+        self.assertFalse([q for q in queries if 'ClothingStore_order' in q['sql']])
+        self.assertEqual(Order.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(replay['Location'], first['Location'])
+
+    def test_replayed_cancel_does_not_write(self):
+        self.client.post(reverse('checkout'), {'shipping_address': 'x', 'payment_method': 'card'})
+        order = Order.objects.get(user=self.user)
+        data = {'idempotency_key': '0f9e8d7c6b5a49382716f5e4d3c2b1a0'}
+        self.client.post(reverse('cancel_it', args=[order.id]), data)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('cancel_it', args=[order.id]), data)
+
+        self.assertFalse([q for q in queries if 'ClothingStore_order' in q['sql']])
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'cancelled')
+
+    def test_checkout_in_flight_is_not_run_twice(self):
+        key = 'c4d3e2f1a0b94c8d7e6f5a4b3c2d1e0f'
+        IdempotencyKey.objects.create(key='checkout:%s:%s' % (self.user.pk, key))
+        response = self.client.post(reverse('checkout'), {
+            'shipping_address': '1 Main Street', 'payment_method': 'card', 'idempotency_key': key,
+        })
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Order.objects.exists())
+
+
+class OrderPageQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='shopper', password='secret-pass-123')
+        cls.other = User.objects.create_user(username='regular', password='secret-pass-123')
+        category = Category.objects.create(name='male')
+        cls.products = Product.objects.bulk_create([
+            Product(
+                name='Product %d' % i, description='Description', image='products/red.jpeg',
+                category=category, size='S', color='black', price=Decimal('5.00'),
+            )
+            for i in range(500)
+        ])
+
+    def create_order(self, user, lines):
+        order = Order.objects.create(user=user, shipping_address='x', payment_method='card')
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, quantity=2) for product in self.products[:lines]
+        ])
+        return order
+
+    def test_order_detail_query_count_is_independent_of_line_count(self):
+        self.client.force_login(self.user)
+        for lines in (1, 500):
+            order = self.create_order(self.user, lines)
+            with self.assertNumQueries(3):
+                response = self.client.get(reverse('order_detail', args=[order.id]))
+            self.assertContains(response, '<strong>Quantity:</strong> 2', count=lines)
+
+    def test_order_history_query_count_is_independent_of_order_count(self):
+        for user, count in ((self.user, 10), (self.other, 10000)):
+            Order.objects.bulk_create([
+                Order(user=user, shipping_address='x', payment_method='card') for _ in range(count)
+            ])
+            self.client.force_login(user)
+            with self.assertNumQueries(2):
+                response = self.client.get(reverse('order_history'))
+            self.assertEqual(len(response.context['orders']), min(count, 24))
+
+
+class BulkOrderStatusTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user(username='warehouse', password='secret-pass-123', is_staff=True)
+        cls.customer = User.objects.create_user(username='customer', password='secret-pass-123')
+        category = Category.objects.create(name='male')
+        cls.product = Product.objects.create(
+            name='Stocked Tee', description='Drop', image='products/red.jpeg',
+            category=category, size='L', color='red', price=Decimal('20.00'), stock=0,
+        )
+
+    def setUp(self):
+        self.client.force_login(self.staff)
+
+    def create_orders(self, count, status='ordered', **kwargs):
+        return Order.objects.bulk_create([
+            Order(user=self.customer, shipping_address='x', payment_method='card', status=status, **kwargs)
+            for _ in range(count)
+        ])
+
+    def test_bulk_move_runs_a_fixed_number_of_queries(self):
+        for count in (1, 1000):
+            orders = self.create_orders(count)
+            ids = [order.id for order in orders]
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(reverse('bulk_update_order_status'), {
+                    'scope': 'filtered', 'filters': 'status=ordered', 'status': 'on_the_way',
+                })
+            self.assertEqual(response.status_code, 302)
+            order_queries = [q['sql'] for q in queries if 'ClothingStore_order' in q['sql']]
+            self.assertEqual(len(order_queries), 2)
+            self.assertEqual(Order.objects.filter(id__in=ids, status='on_the_way').count(), count)
+
+    def test_disallowed_transitions_are_skipped(self):
+        ordered = self.create_orders(2)
+        delivered = self.create_orders(2, status='delivered')
+        self.client.post(reverse('bulk_update_order_status'), {
+            'order_ids': [order.id for order in ordered + delivered], 'status': 'on_the_way',
+        })
+        self.assertEqual(Order.objects.filter(status='on_the_way').count(), 2)
+        self.assertEqual(Order.objects.filter(status='delivered').count(), 2)
+
+    def test_filtered_scope_moves_every_matching_order(self):
+        self.create_orders(150)
+        self.create_orders(5, status='delivered')
+        response = self.client.get(reverse('manage_orders'), {'status': 'delivered'})
+        self.assertEqual(len(response.context['orders']), 5)
+        self.client.post(reverse('bulk_update_order_status'), {
+            'scope': 'filtered', 'filters': 'status=ordered', 'status': 'on_the_way',
+        })
+        self.assertEqual(Order.objects.filter(status='on_the_way').count(), 150)
+
+    def test_bulk_cancel_releases_reserved_stock(self):
+        orders = self.create_orders(3, stock_reserved=True) + self.create_orders(1, status='delivered', stock_reserved=True)
+        OrderItem.objects.bulk_create([OrderItem(order=order, product=self.product, quantity=2) for order in orders])
+        self.client.post(reverse('bulk_update_order_status'), {
+            'order_ids': [order.id for order in orders], 'status': 'cancelled',
+        })
+        self.client.post(reverse('bulk_update_order_status'), {
+            'order_ids': [order.id for order in orders], 'status': 'cancelled',
+        })
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 6)
+
+
+class SalesRollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user(username='manager', password='secret-pass-123', is_staff=True)
+        cls.customer = User.objects.create_user(username='customer', password='secret-pass-123')
+        category = Category.objects.create(name='female')
+        cls.products = Product.objects.bulk_create([
+            Product(
+                name='Dress %d' % i, description='Summer', image='products/red.jpeg',
+                category=category, size='M', color='red', price=Decimal('12.50'),
+            )
+            for i in range(3)
+        ])
+
+    def checkout(self, quantities):
+        self.client.force_login(self.customer)
+        session = self.client.session
+        session[CART_SESSION_KEY] = {
+            'items': {str(product.id): quantity for product, quantity in zip(self.products, quantities)},
+            'dirty_since': time.time(),
+        }
+        session.save()
+        self.client.post(reverse('checkout'), {'shipping_address': '1 Main Street', 'payment_method': 'card'})
+        return Order.objects.latest('id')
+
+    def snapshot(self):
+        return (
+            list(SalesRollup.objects.order_by('period', 'start').values_list(
+                'period', 'start', 'revenue', 'orders', 'units', 'ordered_count', 'on_the_way_count', 'cancelled_count')),
+            list(ProductSalesRollup.objects.order_by('day', 'product_id').values_list('day', 'product_id', 'units', 'revenue')),
+        )
+
+    def test_incremental_rollups_match_a_rebuild(self):
+        first = self.checkout([1, 2, 0])
+        self.checkout([3, 0, 1])
+        transition_orders(Order.objects.filter(id=first.id), 'cancelled')
+        transition_orders(Order.objects.all(), 'on_the_way')
+
+        incremental = self.snapshot()
+        rebuild_rollups()
+        self.assertEqual(self.snapshot(), incremental)
+
+        day = SalesRollup.objects.get(period=SalesRollup.DAY)
+        self.assertEqual((day.orders, day.units, day.revenue), (2, 7, Decimal('87.50')))
+        self.assertEqual((day.cancelled_count, day.on_the_way_count, day.ordered_count), (1, 1, 0))
+
+    def test_dashboard_query_count_is_independent_of_order_volume(self):
+        self.client.force_login(self.staff)
+        for count in (1, 2000):
+            orders = Order.objects.bulk_create([
+                Order(user=self.customer, shipping_address='x', payment_method='card', total_cost=Decimal('10.00'))
+                for _ in range(count)
+            ])
+            OrderItem.objects.bulk_create([OrderItem(order=order, product=self.products[0]) for order in orders])
+            rebuild_rollups()
+            with self.assertNumQueries(5):
+                response = self.client.get(reverse('admin_dashboard'))
+        self.assertEqual(response.context['totals']['orders'], 2001)
+        self.assertEqual(response.context['top_products'][0]['units'], 2001)
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user(username='finance', password='secret-pass-123', is_staff=True)
+        cls.customer = User.objects.create_user(username='customer', password='secret-pass-123')
+        Order.objects.bulk_create([
+            Order(
+                user=cls.customer, shipping_address='x', payment_method='card', total_cost=Decimal('10.00'),
+                ordered_date=timezone.make_aware(datetime.datetime(2024, 5, day, 12)),
+            )
+            for day in (1, 2, 3)
+        ])
+
+    def test_export_streams_gzipped_csv_for_a_date_range(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('export_data', args=['orders']), {
+            'date_from': '2024-05-02', 'date_to': '2024-05-03',
+        })
+        self.assertTrue(response.streaming)
+        self.assertIn('orders-2024-05-02_2024-05-03.csv.gz', response['Content-Disposition'])
+        rows = list(csv.reader(io.StringIO(gzip.decompress(b''.join(response.streaming_content)).decode())))
+        self.assertEqual(rows[0][:3], ['id', 'user_id', 'user_username'])
+        self.assertEqual([row[3][:10] for row in rows[1:]], ['2024-05-02', '2024-05-03'])
+
+    def test_export_jsonl_without_gzip(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('export_data', args=['users']), {'format': 'jsonl', 'gzip': '0'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['username'] for line in lines], ['finance', 'customer'])
+        self.assertNotIn('password', lines[0])
+
+    async def test_export_streams_asynchronously_under_asgi(self):
+        await self.async_client.aforce_login(self.staff)
+        response = await self.async_client.get(reverse('export_data', args=['orders']), {'gzip': '0'})
+        # A sync iterator would be collected into a list before sending.
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(content.decode().splitlines()), 4)
+
+    def test_export_is_staff_only(self):
+        self.client.force_login(self.customer)
+        response = self.client.get(reverse('export_data', args=['orders']))
+        self.assertEqual(response.status_code, 302)
+
+
+class CatalogImportTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.image_dir = os.path.join(self.media_root, 'source')
+        os.makedirs(self.image_dir)
+        for name, color in (('tee.png', 'red'), ('dress.png', 'blue')):
+            Image.new('RGB', (40, 30), color).save(os.path.join(self.image_dir, name))
+        Category.objects.create(name='female')
+
+    def run_import(self, rows, encoding='utf-8'):
+        header = ['sku', 'name', 'description', 'category', 'size', 'color', 'price', 'stock', 'image']
+        manifest = io.StringIO()
+        writer = csv.writer(manifest)
+        writer.writerow(header)
+        writer.writerows(rows)
+        with self.settings(MEDIA_ROOT=self.media_root):
+            return import_catalog(io.BytesIO(manifest.getvalue().encode(encoding)), 'catalog.csv', self.image_dir, workers=0)
+
+    def test_import_is_incremental(self):
+        rows = [
+            ['TEE-1', 'Tee', 'Cotton', 'female', 'm', 'Red', '10.00', '5', 'tee.png'],
+            ['TEE-2', 'Tee', 'Cotton', 'male', 'L', 'red', '10.00', '', 'tee.png'],
+            ['DRESS-1', 'Dress', 'Silk', 'female', 'S', 'blue', '40.00', '', 'dress.png'],
+            ['BROKEN', 'Dress', 'Silk', 'female', 'S', 'blue', 'free', '', 'dress.png'],
+            ['MISSING', 'Dress', 'Silk', 'female', 'S', 'blue', '1.00', '', 'nope.png'],
+        ]
+        report = self.run_import(rows)
+        self.assertEqual((report.created, report.updated, report.unchanged, report.error_count), (3, 0, 0, 2))
+        self.assertEqual([line for line, _ in report.errors], [5, 6])
+        tee = Product.objects.get(sku='TEE-1')
+        self.assertEqual((tee.size, tee.color, tee.stock, tee.category.name), ('M', 'red', 5, 'female'))
+        self.assertEqual(tee.image.name, Product.objects.get(sku='TEE-2').image.name)
+        self.assertTrue(Category.objects.filter(name='male').exists())
+
+        rows[2][6] = '35.00'
+        report = self.run_import(rows[:3])
+        self.assertEqual((report.created, report.updated, report.unchanged), (0, 1, 2))
+        self.assertEqual(Product.objects.get(sku='DRESS-1').price, Decimal('35.00'))
+        self.assertEqual(Product.objects.count(), 3)
+
+    def test_image_paths_outside_media_are_row_errors(self):
+        report = self.run_import([
+            ['TEE-1', 'Tee', 'Cotton', 'female', 'M', 'red', '10.00', '', 'tee.png'],
+            ['ESCAPE', 'Tee', 'Cotton', 'female', 'M', 'red', '10.00', '', '../../etc/passwd'],
+        ])
+        self.assertEqual((report.created, report.error_count), (1, 1))
+        self.assertEqual(report.errors, [(3, 'image: ../../etc/passwd is outside the media directory.')])
+
+    def test_manifest_that_is_not_utf8_is_reported(self):
+        report = self.run_import([
+            ['TEE-1', 'Tee', 'Cotton', 'female', 'M', 'red', '10.00', '', 'tee.png'],
+            ['DRESS-1', 'Robe d\'été', 'Soie', 'female', 'S', 'blue', '40.00', '', 'dress.png'],
+        ], encoding='latin-1')
+        self.assertEqual((report.created, report.error_count), (1, 1))
+        self.assertEqual(report.errors, [(3, 'Not UTF-8 text; the rest of the manifest was not read.')])
+        self.assertTrue(Product.objects.filter(sku='TEE-1').exists())
+
+
+class RatingAggregateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = User.objects.bulk_create([User(username='reviewer%d' % i, password='!') for i in range(2000)])
+        category = Category.objects.create(name='female')
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.products = [
+                Product.objects.create(
+                    name='Scarf %d' % i, description='Wool', image='products/red.jpeg',
+                    category=category, size='1', color='red', price=Decimal('15.00'),
+                )
+                for i in range(3)
+            ]
+
+    def setUp(self):
+        # The callbacks captured below run as if the reviews committed, but
+        # the reviews themselves are rolled back after each test.
+        self.addCleanup(facet_index.invalidate)
+
+    def review(self, product, rating, user=None):
+        self.client.force_login(user or self.users[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('product_detail', args=[product.id]), {'rating': rating, 'comment': 'Nice'})
+
+    def test_aggregates_follow_review_creation_edits_and_deletion(self):
+        product = self.products[0]
+        self.review(product, 5, self.users[0])
+        self.review(product, 3, self.users[1])
+        review = Review.objects.get(user=self.users[1])
+        with self.captureOnCommitCallbacks(execute=True):
+            review.rating = 4
+            review.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.get(user=self.users[0]).delete()
+        product.refresh_from_db()
+        self.assertEqual((product.rating_count, product.rating_sum, product.rating_average), (1, 4, 4.0))
+        self.assertEqual([count for _, count, _ in product.rating_histogram()], [0, 1, 0, 0, 0])
+
+    def test_home_filters_and_sorts_by_rating(self):
+        self.review(self.products[1], 2)
+        self.review(self.products[2], 5)
+        response = self.client.get(reverse('home'), {'rating': '4'})
+        self.assertEqual([product['count'] for product in response.context['context']['facet_counts']['rating']], [1, 1, 2, 2])
+        self.assertContains(response, 'Scarf 2')
+        self.assertNotContains(response, 'Scarf 1')
+
+        response = self.client.get(reverse('home'), {'sort': 'rating'})
+        html = response.content.decode()
+        self.assertLess(html.index('Scarf 2'), html.index('Scarf 1'))
+        self.assertLess(html.index('Scarf 1'), html.index('Scarf 0'))
+
+    def test_product_detail_query_count_is_independent_of_review_count(self):
+        for product, count in ((self.products[0], 1), (self.products[1], 2000)):
+            Review.objects.bulk_create([Review(product=product, user=user, rating=4, comment='Fine') for user in self.users[:count]])
+            with self.assertNumQueries(3):
+                response = self.client.get(reverse('product_detail', args=[product.id]))
+            self.assertEqual(len(response.context['reviews']), min(count, 10))
+
+
+@mock.patch('ClothingStore.images.DERIVATIVE_WORKERS', 0)
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings = self.settings(MEDIA_ROOT=self.media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.category = Category.objects.create(name='female')
+        self.client.force_login(User.objects.create(username='staff', password='!', is_staff=True))
+
+    def upload(self, size=(2000, 1000), exif=None):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, 'red').save(buffer, 'JPEG', exif=exif or Image.Exif())
+        return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def test_upload_generates_stripped_derivatives_used_by_the_grid(self):
+        exif = Image.Exif()
+        exif[ExifTags.Base.Orientation] = 6
+        exif[ExifTags.Base.Make] = 'Camera'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('add_product'), {
+                'name': 'Dress', 'description': 'Silk', 'image': self.upload(exif=exif),
+                'category_id': self.category.id, 'size': 'M', 'color': 'red', 'price': '40.00',
+            })
+        product = Product.objects.get()
+        # Rotated to portrait 1000x2000, so no 1280 wide derivative is upscaled.
+        self.assertEqual(product.image_widths, [160, 320, 640, 1000])
+        for extension in ('webp', 'jpg'):
+            with Image.open(os.path.join(self.media_root, derivative_name(product.image.name, 1000, extension))) as image:
+                self.assertEqual(image.size, (1000, 2000))
+                self.assertFalse(image.getexif())
+
+        html = self.client.get(reverse('home')).content.decode()
+        self.assertIn('<source type="image/webp" srcset="/media/derivatives/', html)
+        self.assertIn('/media/%s 160w' % derivative_name(product.image.name, 160, 'webp'), html)
+        self.assertIn('loading="lazy"', html)
+
+    def test_replaced_image_shows_the_original_until_derivatives_exist(self):
+        product = Product.objects.create(
+            name='Dress', description='Silk', image='products/red.jpeg', category=self.category,
+            size='M', color='red', price=Decimal('40.00'), image_widths=[160, 183],
+        )
+        self.client.post(reverse('update_product', args=[product.id]), {
+            'name': 'Dress', 'description': 'Silk', 'image': self.upload((100, 50)),
+            'category_id': self.category.id, 'size': 'M', 'color': 'red', 'price': '40.00',
+        })
+        product.refresh_from_db()
+        self.assertEqual(product.image_widths, [])
+        self.assertContains(self.client.get(reverse('product_detail', args=[product.id])), 'src="%s"' % product.image.url)
+
+        call_command('generate_image_derivatives', workers=0, stdout=io.StringIO())
+        product.refresh_from_db()
+        self.assertEqual(product.image_widths, [100])
+
+    def test_replaced_images_lose_their_derivatives_once_committed(self):
+        products = [
+            Product.objects.create(
+                name='Dress', description='Silk', image=image, category=self.category,
+                size='M', color='red', price=Decimal('40.00'), image_widths=[160],
+            )
+            for image in ('products/own.jpeg', 'products/shared.jpeg', 'products/shared.jpeg')
+        ]
+        derivatives = {}
+        for image in ('products/own.jpeg', 'products/shared.jpeg'):
+            derivatives[image] = os.path.join(self.media_root, derivative_name(image, 160, 'webp'))
+            os.makedirs(os.path.dirname(derivatives[image]))
+            Image.new('RGB', (160, 80), 'red').save(derivatives[image], 'WEBP')
+
+        for product in products[:2]:
+            with self.captureOnCommitCallbacks() as callbacks:
+                self.client.post(reverse('update_product', args=[product.id]), {
+                    'name': 'Dress', 'description': 'Silk', 'image': self.upload((100, 50)),
+                    'category_id': self.category.id, 'size': 'M', 'color': 'red', 'price': '40.00',
+                })
+            # Nothing is deleted until the new image is committed.
+            self.assertTrue(os.path.exists(derivatives[product.image.name]))
+            for callback in callbacks:
+                callback()
+        self.assertFalse(os.path.exists(derivatives['products/own.jpeg']))
+        # Still shown by the third product.
+        self.assertTrue(os.path.exists(derivatives['products/shared.jpeg']))
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='female')
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.product = Product.objects.create(
+                name='Scarf', description='Wool', image='products/red.jpeg', category=cls.category,
+                size='1', color='red', price=Decimal('15.00'),
+            )
+        cls.user = User.objects.create_user(username='shopper', password='secret-pass-123')
+
+    def setUp(self):
+        # The first visit sets the CSRF cookie, which is part of the ETag.
+        self.client.get(reverse('home'))
+
+    def revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_catalog_pages_answer_304_until_the_catalog_changes(self):
+        for url in (reverse('home'), reverse('product_search') + '?q=scarf'):
+            response = self.client.get(url)
+            with self.assertNumQueries(0):
+                self.assertEqual(self.revalidate(url, response).status_code, 304)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.product.save()
+            self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_rolled_back_catalog_writes_leave_the_indexes_alone(self):
+        url = reverse('home')
+        response = self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                Product.objects.create(
+                    name='Phantom', description='Wool', image='products/red.jpeg', category=self.category,
+                    size='1', color='blue', price=Decimal('15.00'),
+                )
+                self.category.save()
+                self.product.delete()
+                transaction.set_rollback(True)
+        self.assertEqual(self.revalidate(url, response).status_code, 304)
+        response = self.client.get(reverse('product_search'), {'q': 'phantom'})
+        self.assertNotContains(response, 'Phantom')
+        response = self.client.get(url, {'color': 'red'})
+        self.assertContains(response, 'Scarf')
+
+    def test_product_page_follows_its_reviews_and_the_viewer(self):
+        url = reverse('product_detail', args=[self.product.id])
+        response = self.client.get(url)
+        self.assertEqual(self.revalidate(url, response).status_code, 304)
+
+        self.client.post(reverse('add_to_cart', args=[self.product.id]))
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+        response = self.client.get(url)
+        other = Product.objects.create(
+            name='Hat', description='Wool', image='products/red.jpeg', category=self.product.category,
+            size='1', color='red', price=Decimal('5.00'),
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(product=other, user=self.user, rating=5, comment='Warm')
+        self.assertEqual(self.revalidate(url, response).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(product=self.product, user=self.user, rating=5, comment='Warm')
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+        self.client.force_login(self.user)
+        response = self.client.get(url)
+        self.assertEqual(self.revalidate(url, response).status_code, 304)
+        self.client.logout()
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_media_supports_etags_and_ranges(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        with open(os.path.join(media_root, 'file.bin'), 'wb') as f:
+            f.write(bytes(range(256)) * 4)
+        url = '/media/file.bin'
+        with self.settings(MEDIA_ROOT=media_root):
+            response = self.client.get(url)
+            self.assertEqual((response.status_code, response['Accept-Ranges']), (200, 'bytes'))
+            self.assertEqual(len(b''.join(response.streaming_content)), 1024)
+            self.assertEqual(self.revalidate(url, response).status_code, 304)
+
+            partial = self.client.get(url, HTTP_RANGE='bytes=10-19')
+            self.assertEqual((partial.status_code, partial['Content-Range']), (206, 'bytes 10-19/1024'))
+            self.assertEqual(b''.join(partial.streaming_content), bytes(range(10, 20)))
+            suffix = self.client.get(url, HTTP_RANGE='bytes=-4', HTTP_IF_RANGE=response['ETag'])
+            self.assertEqual(b''.join(suffix.streaming_content), bytes(range(252, 256)))
+            self.assertEqual(self.client.get(url, HTTP_RANGE='bytes=2000-').status_code, 416)
+            self.assertEqual(self.client.get(url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"').status_code, 200)
+            self.assertEqual(self.client.get('/media/missing.bin').status_code, 404)
+
+
+class RecommendationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='shopper', password='secret-pass-123')
+        category = Category.objects.create(name='female')
+        cls.products = Product.objects.bulk_create([
+            Product(
+                name='Item %d' % i, description='Cotton', image='products/red.jpeg',
+                category=category, size='M', color='red', price=Decimal('10.00'),
+            )
+            for i in range(4)
+        ])
+
+    def order(self, *products, **fields):
+        order = Order.objects.create(user=self.user, shipping_address='1 Road', payment_method='card', **fields)
+        OrderItem.objects.bulk_create([OrderItem(order=order, product=product) for product in products])
+
+    def recommendations(self, product):
+        return list(Recommendation.objects.filter(product=product).values_list('recommended_id', flat=True))
+
+    def test_full_then_incremental_build(self):
+        a, b, c, d = self.products
+        self.order(a, b)
+        self.order(a, b)
+        self.order(a, c)
+        self.order(d)
+        build = build_recommendations()
+        self.assertEqual((build.full, build.orders), (True, 4))
+        self.assertEqual(self.recommendations(a), [b.id, c.id])
+        self.assertEqual(self.recommendations(b), [a.id])
+        self.assertEqual(self.recommendations(d), [])
+        self.assertEqual(CoPurchase.objects.get(product=a, other=a).count, 3)
+
+        self.order(c, d)
+        build = build_recommendations()
+        self.assertEqual((build.full, build.orders), (False, 1))
+        self.assertEqual(self.recommendations(d), [c.id])
+        self.assertEqual(self.recommendations(c), [d.id, a.id])
+        self.assertEqual(CoPurchase.objects.get(product=c, other=c).count, 2)
+
+        counts = dict(((pair.product_id, pair.other_id), pair.count) for pair in CoPurchase.objects.all())
+        build_recommendations(full=True)
+        self.assertEqual(counts, dict(((pair.product_id, pair.other_id), pair.count) for pair in CoPurchase.objects.all()))
+
+    def test_orders_committed_after_a_build_but_dated_before_it_are_counted_once(self):
+        a, b, c, d = self.products
+        self.order(a, b, id=1000)
+        build = build_recommendations()
+        # A checkout that was still in flight while the build read the orders:
+        # its order has an earlier id and date, but commits after the build.
+        self.order(c, d, id=999, ordered_date=build.watermark - datetime.timedelta(seconds=5))
+        build = build_recommendations()
+        self.assertEqual(build.orders, 1)
+        self.assertEqual(self.recommendations(c), [d.id])
+        build = build_recommendations()
+        self.assertEqual(build.orders, 0)
+        self.assertEqual(CoPurchase.objects.get(product=c, other=d).count, 1)
+        self.assertEqual(CoPurchase.objects.get(product=a, other=b).count, 1)
+
+    def test_product_page_lists_recommendations(self):
+        a, b, c, d = self.products
+        self.order(a, b)
+        build_recommendations()
+        response = self.client.get(reverse('product_detail', args=[a.id]))
+        self.assertContains(response, 'Customers also bought')
+        self.assertEqual(response.context['recommended'], [b])
+
+
+class SqliteProfileTests(SimpleTestCase):
+    def connect(self, profile):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        wrapper = connection.copy()
+        wrapper.settings_dict['NAME'] = os.path.join(directory, 'db.sqlite3')
+        self.addCleanup(wrapper.close)
+        with self.settings(SQLITE_PROFILE=profile):
+            wrapper.ensure_connection()
+        return wrapper
+
+    def pragma(self, wrapper, name):
+        return wrapper.connection.execute('PRAGMA %s' % name).fetchone()[0]
+
+    def test_production_profile_tunes_connection_and_begins_immediate(self):
+        wrapper = self.connect('production')
+        self.assertEqual(self.pragma(wrapper, 'journal_mode'), 'wal')
+        self.assertEqual(self.pragma(wrapper, 'synchronous'), 1)
+        self.assertEqual(self.pragma(wrapper, 'busy_timeout'), 20000)
+        self.assertEqual(self.pragma(wrapper, 'cache_size'), -64 * 1024)
+        with CaptureQueriesContext(wrapper) as queries:
+            wrapper._start_transaction_under_autocommit()
+        self.assertEqual(queries[-1]['sql'], 'BEGIN IMMEDIATE')
+        wrapper.connection.rollback()
+
+    def test_development_profile_leaves_the_journal_mode_alone(self):
+        wrapper = self.connect('development')
+        self.assertEqual(self.pragma(wrapper, 'journal_mode'), 'delete')
+        self.assertEqual(self.pragma(wrapper, 'busy_timeout'), 20000)
+        with CaptureQueriesContext(wrapper) as queries:
+            wrapper._start_transaction_under_autocommit()
+        self.assertEqual(queries[-1]['sql'], 'BEGIN IMMEDIATE')
+        wrapper.connection.rollback()
+
+    def test_default_profile_keeps_sqlite_settings(self):
+        wrapper = self.connect('default')
+        self.assertEqual(self.pragma(wrapper, 'journal_mode'), 'delete')
+        self.assertEqual(self.pragma(wrapper, 'synchronous'), 2)
+        with CaptureQueriesContext(wrapper) as queries:
+            wrapper._start_transaction_under_autocommit()
+        self.assertEqual(queries[-1]['sql'], 'BEGIN')
+        wrapper.connection.rollback()
+
+
+class ReplicaRoutingTests(SimpleTestCase):
+    databases = {'default'}
+
+    def route(self, method='get', pinned=False, write=False):
+        router = PrimaryReplicaRouter()
+        routed = []
+
+        @replica_reads
+        def view(request):
+            if write:
+                router.db_for_write(Product)
+            routed.append(router.db_for_read(Product))
+            return HttpResponse()
+
+        token = start_request(pinned)
+        try:
+            with self.settings(DATABASE_REPLICAS=['replica0']):
+                view(getattr(RequestFactory(), method)('/'))
+        finally:
+            end_request(token)
+        return routed[0]
+
+    def test_reads_of_marked_views_go_to_a_replica(self):
+        self.assertEqual(self.route(), 'replica0')
+
+    def test_writes_pins_and_unsafe_methods_stay_on_the_primary(self):
+        self.assertEqual(self.route(write=True), 'default')
+        self.assertEqual(self.route(pinned=True), 'default')
+        self.assertEqual(self.route(method='post'), 'default')
+        with self.settings(DATABASE_REPLICAS=['replica0']):
+            self.assertEqual(PrimaryReplicaRouter().db_for_read(Product), 'default')
+
+    def test_version_stamped_builds_read_the_primary(self):
+        # 'replica0' is not a configured database: reading it would raise.
+        @replica_reads
+        def view(request):
+            facet_index.build()
+            search.python_backend.rebuild()
+            async_to_sync(acached_product_grid)(request, {'view': 'replica-routing-test'}, [(1, 1)])
+            return HttpResponse()
+
+        token = start_request()
+        try:
+            with self.settings(DATABASE_REPLICAS=['replica0']):
+                view(RequestFactory().get('/'))
+        finally:
+            end_request(token)
+            facet_index.invalidate()
+            search.python_backend.invalidate()
+
+
+class PrimaryPinningTests(TestCase):
+    def test_only_writing_requests_pin_the_user_to_the_primary(self):
+        category = Category.objects.create(name='female')
+        product = Product.objects.create(
+            name='Dress', description='Silk', image='products/red.jpeg', category=category,
+            size='M', color='red', price=Decimal('10.00'),
+        )
+        self.client.force_login(User.objects.create(username='shopper', password='!'))
+        self.client.get(reverse('home'))
+        self.client.get(reverse('product_detail', args=[product.id]))
+        self.assertNotIn(REPLICA_PIN_SESSION_KEY, self.client.session)
+        self.client.post(reverse('product_detail', args=[product.id]), {'rating': 5, 'comment': 'Nice'})
+        self.assertGreater(self.client.session[REPLICA_PIN_SESSION_KEY], time.time())
+
+
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='shopper', password='secret-pass-123')
+        category = Category.objects.create(name='female')
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.product = Product.objects.create(
+                name='Linen dress', description='Summer linen', image='products/red.jpeg', category=category,
+                size='M', color='red', price=Decimal('10.00'),
+            )
+        Order.objects.create(user=cls.user, shipping_address='1 Road', payment_method='card', total_cost=Decimal('10.00'))
+
+    async def test_catalog_and_history_pages_render_under_asgi(self):
+        await self.async_client.aforce_login(self.user)
+        for url in (reverse('home'), reverse('product_search') + '?q=linen', reverse('product_detail', args=[self.product.id])):
+            response = await self.async_client.get(url)
+            self.assertContains(response, 'Linen dress')
+        response = await self.async_client.get(reverse('order_history'))
+        self.assertEqual(len(response.context['orders']), 1)
+
+    async def test_pages_load_a_database_session_off_the_event_loop(self):
+        with self.settings(SESSION_ENGINE='django.contrib.sessions.backends.cached_db'):
+            await self.async_client.aforce_login(self.user)
+            # A cold session cache: the session has to come from the database.
+            await sync_to_async(caches['sessions'].clear)()
+            for url in (reverse('home'), reverse('order_history')):
+                response = await self.async_client.get(url)
+                self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.context['orders']), 1)
+
+    async def test_order_history_requires_login(self):
+        response = await self.async_client.get(reverse('order_history'))
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('?next=%s' % reverse('order_history'), response.url)
+
+    async def test_login_and_signup_hash_off_the_event_loop(self):
+        response = await self.async_client.post(reverse('login'), {'username': 'shopper', 'password': 'wrong'})
+        self.assertContains(response, 'Invalid username or password.')
+        response = await self.async_client.post(reverse('login'), {'username': 'shopper', 'password': 'secret-pass-123'})
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+        response = await self.async_client.get(reverse('order_history'))
+        self.assertEqual(response.status_code, 200)
+
+        response = await self.async_client.post(reverse('signup'), {
+            'username': 'newcomer', 'email': 'new@example.com', 'dob': '1990-01-01', 'contact_number': '123',
+            'address': '2 Road', 'password1': 'another-pass-456', 'password2': 'another-pass-456',
+        })
+        self.assertRedirects(response, reverse('login'), fetch_redirect_response=False)
+        user = await User.objects.aget(username='newcomer')
+        self.assertTrue(user.check_password('another-pass-456'))
+
+
+class InstrumentationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user(username='operator', password='secret-pass-123', is_staff=True)
+        cls.customer = User.objects.create_user(username='customer', password='secret-pass-123')
+        category = Category.objects.create(name='female')
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.products = [
+                Product.objects.create(name='Shirt %d' % i, description='Cotton', image='products/red.jpeg',
+                                       category=category, size='M', color='red', price=Decimal('10.00'))
+                for i in range(6)
+            ]
+
+    def setUp(self):
+        metrics.reset()
+
+    def test_fingerprint_ignores_values_and_in_list_lengths(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM p WHERE id IN (%s, %s, %s) AND name = 'a''b' LIMIT 21"),
+            fingerprint('SELECT *  FROM p WHERE id IN (%s) AND name = \'x\' LIMIT 5'),
+        )
+
+    def test_repeated_queries_are_reported_per_view(self):
+        def get_response(request):
+            for product in self.products:
+                Product.objects.filter(id=product.id).exists()
+            return HttpResponse()
+
+        request = RequestFactory().get(reverse('home'))
+        request.resolver_match = resolve(reverse('home'))
+        with self.settings(METRICS_SAMPLE_RATE=1):
+            InstrumentationMiddleware(get_response)(request)
+        with self.settings(METRICS_SAMPLE_RATE=0):
+            InstrumentationMiddleware(get_response)(request)
+        [view] = metrics.snapshot()['views']
+        self.assertEqual((view['view'], view['requests'], view['sampled']), ('home', 2, 1))
+        self.assertEqual(view['max_queries'], 6)
+        [query] = view['n_plus_one']
+        self.assertEqual((query['requests'], query['max_repeats']), (1, 6))
+        self.assertIn('"ClothingStore_product"', query['sql'])
+
+    async def test_queries_of_async_views_are_recorded(self):
+        with self.settings(METRICS_SAMPLE_RATE=1):
+            await self.async_client.get(reverse('product_detail', args=[self.products[0].id]))
+        [view] = metrics.snapshot()['views']
+        self.assertEqual(view['view'], 'product_detail')
+        self.assertGreater(view['max_queries'], 0)
+
+    def test_metrics_pages_are_staff_only(self):
+        with self.settings(METRICS_SAMPLE_RATE=1):
+            self.client.get(reverse('home'))
+        self.client.force_login(self.customer)
+        self.assertEqual(self.client.get(reverse('request_metrics_json')).status_code, 302)
+
+        self.client.force_login(self.staff)
+        home = next(view for view in self.client.get(reverse('request_metrics_json')).json()['views'] if view['view'] == 'home')
+        self.assertEqual(home['sampled'], 1)
+        self.assertGreater(home['avg_template_ms'], 0)
+        self.assertGreater(home['max_queries'], 0)
+        self.assertEqual(sum(home['duration_histogram'].values()), 1)
+        self.assertContains(self.client.get(reverse('request_metrics')), 'home')
+
+
+class SeedStoreTests(TestCase):
+    SIZES = dict(users=6, categories=3, products=12, carts=2, orders=10, reviews=20)
+
+    def snapshot(self):
+        return (
+            list(Product.objects.order_by('sku').values_list('name', 'price', 'category__name', 'rating_count', 'rating_sum')),
+            list(Order.objects.order_by('id').values_list('user__username', 'status', 'total_cost')),
+            list(Review.objects.order_by('id').values_list('product__sku', 'user__username', 'rating')),
+            CartItem.objects.count(),
+        )
+
+    def test_same_seed_produces_the_same_store(self):
+        with transaction.atomic():
+            seed_store(seed=7, **self.SIZES)
+            first = self.snapshot()
+            transaction.set_rollback(True)
+        seed_store(seed=7, **self.SIZES)
+        self.assertEqual(self.snapshot(), first)
+        self.assertEqual(len(first[2]), 20)
+        for product in Product.objects.all():
+            ratings = list(product.reviews.values_list('rating', flat=True))
+            self.assertEqual((product.rating_count, product.rating_sum), (len(ratings), sum(ratings)))
+
+    def test_command_refuses_to_seed_twice(self):
+        sizes = ['--%s=%d' % item for item in self.SIZES.items()]
+        call_command('seed_store', *sizes, stdout=io.StringIO())
+        self.assertEqual(User.objects.filter(username__startswith='seed-user-').count(), 6)
+        with self.assertRaises(CommandError):
+            call_command('seed_store', *sizes, stdout=io.StringIO())
+
+    def test_every_named_route_has_a_benchmark_plan(self):
+        self.assertEqual(set(named_routes()) - set(ROUTES), set())
+
+    def test_explain_queries_checks_the_sql_the_views_issue(self):
+        seed_store(**self.SIZES)
+        sessions = Session.objects.count()
+        output = io.StringIO()
+        call_command('explain_queries', stdout=output)
+        output = output.getvalue()
+        self.assertIn('OK   order_history', output)
+        self.assertIn('USING INDEX order_user_date_idx', output)
+        self.assertIn('USING INDEX review_product_created_idx', output)
+        self.assertEqual(Session.objects.count(), sessions)
+
+
+class SessionCartTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='female')
+        cls.scarf, cls.hat = Product.objects.bulk_create([
+            Product(
+                name=name, description='Wool', image='products/red.jpeg', category=category,
+                size='1', color='red', price=Decimal('15.00'),
+            )
+            for name in ('Scarf', 'Hat')
+        ])
+        cls.user = User.objects.create_user(username='shopper', password='secret-pass-123')
+        CartItem.objects.create(cart=Cart.objects.create(user=cls.user), product=cls.scarf, quantity=2)
+
+    def login(self):
+        response = self.client.post(reverse('login'), {'username': 'shopper', 'password': 'secret-pass-123'})
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+
+    def stored_items(self):
+        return dict(CartItem.objects.filter(cart__user=self.user).values_list('product_id', 'quantity'))
+
+    def session_items(self):
+        return self.client.session[CART_SESSION_KEY]['items']
+
+    def test_stored_cart_is_loaded_at_login(self):
+        self.login()
+        self.assertEqual(self.session_items(), {str(self.scarf.id): 2})
+        self.assertContains(self.client.get(reverse('cart')), 'Scarf')
+
+    def test_anonymous_cart_is_merged_at_login_and_flushed_at_logout(self):
+        self.client.post(reverse('add_to_cart', args=[self.scarf.id]))
+        self.client.post(reverse('add_to_cart', args=[self.hat.id]))
+        self.login()
+        self.assertEqual(self.session_items(), {str(self.scarf.id): 3, str(self.hat.id): 1})
+        self.assertEqual(self.stored_items(), {self.scarf.id: 2})
+        self.client.post(reverse('logout'))
+        self.assertEqual(self.stored_items(), {self.scarf.id: 3, self.hat.id: 1})
+
+    def test_cart_actions_only_write_the_session_until_logout(self):
+        self.login()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('add_to_cart', args=[self.hat.id]))
+            self.client.post(reverse('update_cart', args=[self.scarf.id]), {'quantity': 5})
+            self.client.post(reverse('remove_from_cart', args=[self.hat.id]))
+        self.assertEqual(self.writes(queries), [])
+        self.assertEqual(self.stored_items(), {self.scarf.id: 2})
+        self.client.post(reverse('logout'))
+        self.assertEqual(self.stored_items(), {self.scarf.id: 5})
+
+    def writes(self, queries):
+        return [query['sql'] for query in queries if not query['sql'].startswith('SELECT')]
+
+    def test_cart_is_priced_in_one_query_and_read_without_writes(self):
+        CartItem.objects.create(cart=self.user.cart, product=self.hat, quantity=3)
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('cart'))
+        self.assertEqual(self.writes(queries), [])
+        # Lines and the total come from one query with a window SUM.
+        self.assertEqual(len([query for query in queries if 'SUM(' in query['sql']]), 1)
+        self.assertEqual(
+            [(line.product.name, line.quantity, line.get_total_item_price()) for line in response.context['cart_items']],
+            [('Scarf', 2, Decimal('30.00')), ('Hat', 3, Decimal('45.00'))],
+        )
+        self.assertEqual(response.context['total_cost'], Decimal('75.00'))
+
+    def test_browsing_never_creates_a_cart(self):
+        browser = User.objects.create_user(username='browser', password='secret-pass-123')
+        self.client.force_login(browser)
+        with CaptureQueriesContext(connection) as queries:
+            for url in (reverse('home'), reverse('product_detail', args=[self.scarf.id]), reverse('cart')):
+                self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(self.writes(queries), [])
+        self.assertFalse(Cart.objects.filter(user=browser).exists())
+
+    def test_carts_unflushed_for_too_long_are_written_on_the_next_action(self):
+        self.login()
+        session = self.client.session
+        session[CART_SESSION_KEY] = {'items': {str(self.hat.id): 1}, 'dirty_since': time.time() - CART_FLUSH_INTERVAL}
+        session.save()
+        self.client.post(reverse('add_to_cart', args=[self.hat.id]))
+        self.assertEqual(self.stored_items(), {self.hat.id: 2})
+        self.assertIsNone(self.client.session[CART_SESSION_KEY]['dirty_since'])
+
+
+class SessionCullingTests(TestCase):
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location, ignore_errors=True)
+
+    def test_sessions_survive_cache_culling(self):
+        sessions = {
+            'BACKEND': 'ClothingStore.caches.SessionFileCache', 'LOCATION': self.location,
+            'OPTIONS': {'MAX_ENTRIES': 5, 'CULL_FREQUENCY': 1},
+        }
+        with self.settings(CACHES=dict(TEST_CACHES, sessions=sessions)):
+            SessionStore = import_module(settings.SESSION_ENGINE).SessionStore
+            first = SessionStore()
+            first[CART_SESSION_KEY] = {'items': {'1': 2}, 'dirty_since': None}
+            first.create()
+            stale = SessionStore()
+            stale.set_expiry(-1)
+            stale.create()
+            with self.assertNumQueries(0):
+                for _ in range(10):
+                    SessionStore().create()
+            self.assertEqual(len(caches['sessions']._list_cache_files()), 11)
+            self.assertEqual(SessionStore(first.session_key)[CART_SESSION_KEY]['items'], {'1': 2})
@@ -11,8 +11,8 @@ urlpatterns = [
     path('edit-profile/', views.edit_profile, name='edit_profile'),
     path('cart/', views.view_cart, name='cart'),
     path('add-to-cart/<int:product_id>/', views.add_to_cart, name='add_to_cart'),
-    path('update-cart/<int:cart_item_id>/', views.update_cart, name='update_cart'),
-    path('remove-from-cart/<int:cart_item_id>/', views.remove_from_cart, name='remove_from_cart'),
+    path('update-cart/<int:product_id>/', views.update_cart, name='update_cart'),
+    path('remove-from-cart/<int:product_id>/', views.remove_from_cart, name='remove_from_cart'),
     path('checkout/', views.checkout, name='checkout'),
     path('order_placed/<int:order_id>/', views.order_placed, name='order_placed'),
     path('cancel-order/<int:order_id>/', views.cancel_it, name='cancel_it'),
@@ -20,16 +20,21 @@ urlpatterns = [
     path('order-history/', views.order_history, name='order_history'),
     path('order-detail/<int:order_id>/', views.order_detail, name='order_detail'),
     path('custom-admin/dashboard/', views.admin_dashboard, name='admin_dashboard'),
+    path('custom-admin/metrics/', views.request_metrics, name='request_metrics'),
+    path('custom-admin/metrics.json', views.request_metrics_json, name='request_metrics_json'),
     path('custom-admin/manage-products/', views.manage_products, name='manage_products'),
     path('custom-admin/add-product/', views.add_product, name='add_product'),
     path('custom-admin/update-product/<int:product_id>/', views.update_product, name='update_product'),
     path('custom-admin/delete-product/<int:product_id>/', views.delete_product, name='delete_product'),
+    path('custom-admin/import-products/', views.import_products, name='import_products'),
     path('custom-admin/manage-categories/', views.manage_categories, name='manage_categories'),
     path('custom-admin/add-category/', views.add_category, name='add_category'),
     path('custom-admin/update-category/<int:category_id>/', views.update_category, name='update_category'),
     path('custom-admin/delete-category/<int:category_id>/', views.delete_category, name='delete_category'),
     path('custom-admin/manage-orders/', views.manage_orders, name='manage_orders'),
     path('custom-admin/update-order-status/<int:order_id>/', views.update_order_status, name='update_order_status'),
+    path('custom-admin/bulk-update-order-status/', views.bulk_update_order_status, name='bulk_update_order_status'),
+    path('custom-admin/export/<str:name>/', views.export_data, name='export_data'),
     path('custom-admin/manage-users/', views.manage_users, name='manage_users'),
     path('custom-admin/promote-to-staff/<int:user_id>/', views.promote_to_staff, name='promote_to_staff'),
     path('custom-admin/delete-user/<int:user_id>/', views.delete_user, name='delete_user'),
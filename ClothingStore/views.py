@@ -1,42 +1,74 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from asgiref.sync import sync_to_async
+from django.shortcuts import aget_object_or_404, render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib import messages
-from django.db.models import Q
 from .models import Product, Order, OrderItem, Review
-from .forms import SignUpForm, UserEditForm, ReviewForm, CheckoutForm
-from django.contrib.auth import login, authenticate, logout
-from django.views.decorators.http import require_POST
+from .forms import SignUpForm, UserEditForm, ReviewForm, CheckoutForm, ProductImportForm
+from django.contrib.auth import alogin, logout
+from django.contrib.auth.hashers import make_password
+from django.views.decorators.http import condition, require_POST
+from django.db import transaction
 from django.utils import timezone
-from .models import Product, Category, Order, User, Cart, CartItem
+from .models import Product, Category, Order, User
 from django.utils.dateparse import parse_date
+from datetime import timedelta
 from django.contrib.auth import update_session_auth_hash
-
-
-def home(request):
-    products = Product.objects.all()
+from .exports import EXPORTS, FORMATS, astream_export, export_filename, stream_export
+from .facets import facet_index, parse_min_rating, parse_price_range
+from .catalog_import import IMPORT_VIEW_WORKERS, import_catalog
+from .checkout import EmptyCartError, place_order
+from .async_views import alogin_required, authenticate_user, resolve_request, run_hashing
+from .conditional import catalog_etag, product_etag
+from .fragments import acached_product_grid, layer_cart_buttons
+from .idempotency import idempotent
+from .images import schedule_derivative_cleanup, schedule_derivatives
+from .instrumentation import metrics
+from .pagination import apaginate_keys, apaginate_queryset, paginate_queryset
+from .ratings import REVIEWS_PER_PAGE
+from .recommendations import arecommended_products
+from .routers import replica_reads
+from .rollups import sales_report
+from .search import search_products
+from .orders import ORDERS_PER_PAGE, InvalidStatusError, filter_orders, parse_date_param, transition_orders
+from .stock import OutOfStockError
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, JsonResponse, QueryDict, StreamingHttpResponse
+from django.urls import reverse
+
+
+@replica_reads
+@resolve_request
+@condition(etag_func=catalog_etag)
+async def home(request):
     category = request.GET.get('category', '')
     color = request.GET.get('color', '').lower()
     size = request.GET.get('size', '').upper()
     price = request.GET.get('price','')
-    filters_applied = any([category, color, size, price])
-
-    if category:
-        products = products.filter(category__name=category)
-    if color:
-        products = products.filter(color=color)
-    if size:
-        products = products.filter(size=size)
-    if price and price != "Min-Max":
-        min_price, max_price = map(int, price.split('-'))
-        products = products.filter(price__gte=min_price, price__lte=max_price)
+    min_rating = parse_min_rating(request.GET.get('rating', ''))
+    sort = 'rating' if request.GET.get('sort') == 'rating' else ''
+    filters_applied = any([category, color, size, price, min_rating])
+
+    price_range = parse_price_range(price)
+    product_keys, facet_counts = await facet_index.aquery(category, color, size, price_range, min_rating, sort)
+    filters = {
+        'category': category,
+        'color': color,
+        'size': size,
+        'price': '%s-%s' % price_range if price_range else '',
+        'rating': min_rating or '',
+        'sort': sort,
+    }
+    grid_html, products = await acached_product_grid(request, filters, product_keys)
 
-    cart_items = []
-    if request.user.is_authenticated:
-        cart, created = Cart.objects.get_or_create(user=request.user)
-        cart_items = cart.items.all()
+    cart_product_ids = request.cart.product_ids()
+    grid_html = layer_cart_buttons(request, grid_html, cart_product_ids)
 
-    cart_product_ids = [item.product.id for item in cart_items]
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'html': grid_html,
+            'next_query': products.next_query if products.has_next else None,
+        })
 
     context = {
         'products': products,
@@ -45,20 +77,27 @@ def home(request):
         'current_color': color,
         'current_size': size,
         'current_price': price if filters_applied else '',
+        'current_rating': min_rating,
+        'current_sort': sort,
+        'facet_counts': facet_counts,
     }
 
     return render(request, 'home.html', {
         'products': products,
+        'grid_html': grid_html,
         'cart_product_ids': cart_product_ids,
         'context': context
     })
 
 
-def signup(request):
+@resolve_request
+async def signup(request):
     if request.method == 'POST':
         form = SignUpForm(request.POST)
-        if form.is_valid():
-            form.save()
+        # Validation checks the username is free; the hash runs on the hashing pool.
+        if await sync_to_async(form.is_valid)():
+            form.instance.password = await run_hashing(make_password, form.cleaned_data['password1'])
+            await form.instance.asave()
             return redirect('login')
     else:
         form = SignUpForm()
@@ -90,15 +129,15 @@ def forgot_password(request):
             return redirect('forgot_password')
     return render(request, 'forgot_password.html')
 
-def user_login(request):
+@resolve_request
+async def user_login(request):
     error_message = None
     if request.method == 'POST':
         username = request.POST.get('username')
         password = request.POST.get('password')
-        user = authenticate(username=username, password=password)
-        print(user)
+        user = await authenticate_user(username, password)
         if user:
-            login(request, user)
+            await alogin(request, user)
             return redirect('home')
         else:
             error_message = 'Invalid username or password.'
@@ -126,97 +165,69 @@ def edit_profile(request):
     return render(request, 'edit_profile.html', {'form': form})
 
 
-@login_required
 def add_to_cart(request, product_id):
     product = get_object_or_404(Product, id=product_id)
-    cart, created = Cart.objects.get_or_create(user=request.user)
-    cart_item, created = CartItem.objects.get_or_create(cart=cart, product=product)
-    if not created:
-        cart_item.quantity += 1
-        cart_item.save()
+    request.cart.add(product.id)
     return redirect('cart')
 
-@login_required
 def view_cart(request):
-    cart, created = Cart.objects.get_or_create(user=request.user)
-    cart_items = cart.items.all()
-    total_cost = sum(item.product.price * item.quantity for item in cart_items)
-    return render(request, 'cart.html', {'cart_items': cart_items, 'total_cost': total_cost})
+    return render(request, 'cart.html', {'cart_items': request.cart.lines(), 'total_cost': request.cart.total()})
 
-@login_required
-def update_cart(request, cart_item_id):
-    cart_item = get_object_or_404(CartItem, id=cart_item_id)
+def update_cart(request, product_id):
     if request.method == 'POST':
         quantity = request.POST.get('quantity')
         if quantity:
-            cart_item.quantity = int(quantity)
-            cart_item.save()
+            request.cart.set(product_id, int(quantity))
     return redirect('cart')
 
-@login_required
-def remove_from_cart(request, cart_item_id):
-    cart_item = get_object_or_404(CartItem, id=cart_item_id)
-    cart_item.delete()
+def remove_from_cart(request, product_id):
+    request.cart.remove(product_id)
     return redirect('cart')
 
 
 @login_required
+@idempotent
 def checkout(request):
-    try:
-        # Get the user's cart
-        cart = Cart.objects.get(user=request.user)
-        cart_items = CartItem.objects.filter(cart=cart)
-
-        # Calculate the total cost
-        total_cost = sum(item.product.price * item.quantity for item in cart_items)
-
-        if request.method == 'POST':
-            shipping_address = request.POST.get('shipping_address')
-            payment_method = request.POST.get('payment_method')
-
-            # Create a new order
-            order = Order.objects.create(
-                user=request.user,
-                shipping_address=shipping_address,
-                payment_method=payment_method,
-                ordered_date=timezone.now(),
-                status='ordered',
-                total_cost=total_cost  # Set total cost here
-            )
-
-            # Add products to the order
-            for item in cart_items:
-                order.products.add(item.product)
-
-            # Clear the cart
-            cart_items.delete()
-
-            # Redirect to the order placed page
-            return redirect('order_placed', order_id=order.id)
-
-        return render(request, 'checkout.html', {'cart_items': cart_items, 'total_cost': total_cost})
-
-    except Cart.DoesNotExist:
+    session_cart = request.cart
+    if not session_cart:
         messages.error(request, 'Your cart is empty.')
         return redirect('home')
 
+    if request.method == 'POST':
+        try:
+            order = place_order(
+                session_cart,
+                request.user,
+                shipping_address=request.POST.get('shipping_address'),
+                payment_method=request.POST.get('payment_method'),
+            )
+        except EmptyCartError:
+            messages.error(request, 'Your cart is empty.')
+            return redirect('home')
+        except OutOfStockError as e:
+            names = Product.objects.filter(id__in=e.product_ids).values_list('name', flat=True)
+            messages.error(request, 'Not enough stock left for: %s.' % ', '.join(names))
+            return redirect('cart')
+        return redirect('order_placed', order_id=order.id)
+
+    return render(request, 'checkout.html', {'cart_items': session_cart.lines(), 'total_cost': session_cart.total()})
+
 @login_required
+@idempotent
 def cancel_it(request, order_id):
     order = get_object_or_404(Order, id=order_id, user=request.user)
-    if order.status in ['ordered', 'on_the_way']:
-        order.status = 'cancelled'
-        order.save()
+    # A repeated cancel finds the order already cancelled and writes nothing
+    if transition_orders(Order.objects.filter(id=order.id), 'cancelled'):
         messages.success(request, "Order has been successfully cancelled.")
     else:
         messages.error(request, "Cannot cancel this order.")
     return redirect('order_history')
 
 @login_required
+@idempotent
 def request_return(request, order_id):
     order = get_object_or_404(Order, id=order_id, user=request.user)
-    if order.status in ['cancelled','delivered']:
-        order.status = 'return_requested'
-        order.save()
+    if transition_orders(Order.objects.filter(id=order.id), 'return_requested'):
         messages.success(request, 'Return requested successfully.')
     return redirect('order_history')
 
@@ -230,62 +241,127 @@ def order_placed(request, order_id):
     return render(request, 'order_placed.html', {'order': order})
 
 
-@login_required
-def order_history(request):
-    orders = Order.objects.filter(user=request.user).order_by('-ordered_date')
+@replica_reads
+@alogin_required
+@resolve_request
+async def order_history(request):
+    orders = Order.objects.filter(user=request.user).only('id', 'ordered_date', 'status', 'total_cost')
+    orders = await apaginate_queryset(request, orders, order_by='-ordered_date')
     return render(request, 'order_history.html', {'orders': orders})
 
 @login_required
 def order_detail(request, order_id):
-    order = get_object_or_404(Order, id=order_id, user=request.user)
-    return render(request, 'order_detail.html', {'order': order})
-
-def product_search(request):
+    order = get_object_or_404(
+        Order.objects.only('id', 'ordered_date', 'status', 'total_cost'),
+        id=order_id, user=request.user,
+    )
+    items = order.order_items.select_related('product__category').only(
+        'id', 'quantity', 'order_id',
+        'product__id', 'product__name', 'product__image', 'product__image_widths', 'product__price', 'product__description',
+        'product__size', 'product__color', 'product__category__name',
+    )
+    return render(request, 'order_detail.html', {'order': order, 'items': items})
+
+@replica_reads
+@resolve_request
+@condition(etag_func=catalog_etag)
+async def product_search(request):
     query = request.GET.get('q')
     if query:
-        products = Product.objects.filter(
-            Q(name__icontains=query) | 
-            Q(description__icontains=query) |
-            Q(category__name__icontains=query)
-        )
+        # Ranking uses raw SQL or the in-memory index: both are sync.
+        keys = await sync_to_async(search_products)(query)
+        products = await apaginate_keys(request, keys, Product.objects.all())
     else:
-        products = Product.objects.all()
+        products = await apaginate_queryset(request, Product.objects.all())
     return render(request, 'product_search.html', {'products': products})
 
 
-def product_detail(request, product_id):
-    product = get_object_or_404(Product, id=product_id)
-    reviews = product.reviews.order_by('-created_at')
-    
-    cart_items = []
-    if request.user.is_authenticated:
-        cart, created = Cart.objects.get_or_create(user=request.user)
-        cart_items = cart.items.all()
+def _save_review(form, product, user):
+    new_review = form.save(commit=False)
+    new_review.product = product
+    new_review.user = user
+    # The rating aggregates are updated by the Review signals.
+    with transaction.atomic():
+        new_review.save()
+
 
-    cart_product_ids = [item.product.id for item in cart_items]
+@replica_reads
+@resolve_request
+@condition(etag_func=product_etag)
+async def product_detail(request, product_id):
+    product = await aget_object_or_404(Product.objects.select_related('category'), id=product_id)
+    
+    cart_product_ids = request.cart.product_ids()
 
     if request.method == 'POST':
         form = ReviewForm(request.POST)
-        if form.is_valid():
-            new_review = form.save(commit=False)
-            new_review.product = product
-            new_review.user = request.user
-            new_review.save()
+        if await sync_to_async(form.is_valid)():
+            await sync_to_async(_save_review)(form, product, request.user)
             return redirect('product_detail', product_id=product_id)
     else:
         form = ReviewForm()
+
+    reviews = product.reviews.select_related('user').only(
+        'id', 'rating', 'comment', 'created_at', 'product_id', 'user__username',
+    )
+    reviews = await apaginate_queryset(request, reviews, order_by='-created_at', per_page=REVIEWS_PER_PAGE)
     
-    return render(request, 'product_detail.html', {'product': product, 'reviews': reviews, 'cart_product_ids': cart_product_ids, 'form': form})
+    return render(request, 'product_detail.html', {
+        'product': product,
+        'reviews': reviews,
+        'recommended': await arecommended_products(product),
+        'cart_product_ids': cart_product_ids,
+        'form': form,
+    })
 
 
 @staff_member_required
 def admin_dashboard(request):
-    return render(request, 'admin_dashboard.html')
+    today = timezone.localdate()
+    date_to = parse_date_param(request.GET.get('date_to')) or today
+    date_from = parse_date_param(request.GET.get('date_from')) or date_to - timedelta(days=29)
+    if date_from > date_to:
+        date_from, date_to = date_to, date_from
+    report = sales_report(date_from, date_to)
+    exports = [('orders', 'Orders'), ('order_items', 'Order items'), ('products', 'Products'), ('users', 'Users')]
+    return render(request, 'admin_dashboard.html', dict(report, date_from=date_from, date_to=date_to, exports=exports))
+
+
+@staff_member_required
+def request_metrics(request):
+    if request.method == 'POST':
+        metrics.reset()
+        return redirect('request_metrics')
+    return render(request, 'metrics.html', metrics.snapshot())
+
+
+@staff_member_required
+def request_metrics_json(request):
+    return JsonResponse(metrics.snapshot())
+
+
+@staff_member_required
+def export_data(request, name):
+    if name not in EXPORTS:
+        raise Http404('Unknown export.')
+    format = request.GET.get('format') if request.GET.get('format') in FORMATS else 'csv'
+    compress = request.GET.get('gzip', '1') != '0'
+    date_from = parse_date_param(request.GET.get('date_from'))
+    date_to = parse_date_param(request.GET.get('date_to'))
+    # Under ASGI Django only streams an async iterator without buffering it.
+    stream = astream_export if isinstance(request, ASGIRequest) else stream_export
+    response = StreamingHttpResponse(
+        stream(name, format, compress, date_from, date_to),
+        content_type='application/gzip' if compress else FORMATS[format],
+    )
+    response['Content-Disposition'] = 'attachment; filename="%s"' % export_filename(
+        name, format, compress, date_from, date_to)
+    return response
 
 
 @staff_member_required
 def manage_products(request):
-    products = Product.objects.all()
+    products = paginate_queryset(request, Product.objects.select_related('category'))
     categories = Category.objects.all()
     return render(request, 'manage_products.html', {'products': products, 'categories': categories})
 
@@ -299,10 +375,12 @@ def add_product(request):
     size = request.POST.get('size')
     color = request.POST.get('color')
     price = request.POST.get('price')
+    stock = request.POST.get('stock') or None
     
     if name and description and image and category_id and size and color and price:
         category = get_object_or_404(Category, id=category_id)
-        Product.objects.create(name=name, description=description, image=image, category=category, size=size, color=color, price=price)
+        product = Product.objects.create(name=name, description=description, image=image, category=category, size=size, color=color, price=price, stock=stock)
+        schedule_derivatives(product.image.name)
     return redirect('manage_products')
 
 @require_POST
@@ -316,18 +394,28 @@ def update_product(request, product_id):
     size = request.POST.get('size')
     color = request.POST.get('color')
     price = request.POST.get('price')
+    stock = request.POST.get('stock')
     
     if name and description and category_id and size and color and price:
         category = get_object_or_404(Category, id=category_id)
+        replaced_image = product.image.name
         product.name = name
         product.description = description
         if image:
             product.image = image
+            product.image_widths = []
         product.category = category
         product.size = size
         product.color = color
         product.price = price
-        product.save()
+        if stock is not None:
+            product.stock = stock or None
+        # Not the rating aggregates: reviews may have moved them since the load.
+        product.save(update_fields=['name', 'description', 'image', 'image_widths', 'category', 'size', 'color', 'price', 'stock'])
+        if image:
+            schedule_derivatives(product.image.name)
+            if replaced_image and replaced_image != product.image.name:
+                schedule_derivative_cleanup(replaced_image)
     return redirect('manage_products')
 
 @require_POST
@@ -337,6 +425,18 @@ def delete_product(request, product_id):
     product.delete()
     return redirect('manage_products')
 
+@staff_member_required
+def import_products(request):
+    report = None
+    if request.method == 'POST':
+        form = ProductImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            manifest = form.cleaned_data['manifest']
+            report = import_catalog(manifest, manifest.name, form.cleaned_data['images'], IMPORT_VIEW_WORKERS)
+    else:
+        form = ProductImportForm()
+    return render(request, 'import_products.html', {'form': form, 'report': report})
+
 @staff_member_required
 def manage_categories(request):
     categories = Category.objects.all()
@@ -369,22 +469,57 @@ def delete_category(request, category_id):
 
 @staff_member_required
 def manage_orders(request):
-    orders = Order.objects.all()
-    return render(request, 'manage_orders.html', {'orders': orders})
+    orders = filter_orders(request.GET).select_related('user').only(
+        'id', 'ordered_date', 'status', 'total_cost', 'user__username',
+    )
+    orders = paginate_queryset(request, orders, order_by='-id', per_page=ORDERS_PER_PAGE)
+    return render(request, 'manage_orders.html', {
+        'orders': orders,
+        'status_choices': Order.STATUS_CHOICES,
+        'filters': request.GET,
+    })
+
+def _manage_orders_redirect(request):
+    query = request.POST.get('filters', '')
+    return redirect('%s?%s' % (reverse('manage_orders'), query) if query else reverse('manage_orders'))
 
 @require_POST
 @staff_member_required
+@idempotent
 def update_order_status(request, order_id):
     order = get_object_or_404(Order, id=order_id)
-    status = request.POST.get('status')
-    if status in dict(Order.STATUS_CHOICES).keys():
-        order.status = status
-        order.save()
-    return redirect('manage_orders')
+    try:
+        moved = transition_orders(Order.objects.filter(id=order.id), request.POST.get('status'))
+    except InvalidStatusError:
+        moved = []
+    if moved:
+        messages.success(request, 'Order status updated successfully.')
+    else:
+        messages.error(request, 'Order #%d cannot move to that status.' % order.id)
+    return _manage_orders_redirect(request)
+
+@require_POST
+@staff_member_required
+@idempotent
+def bulk_update_order_status(request):
+    """Move the selected orders, or every order matching the filters, in one batch."""
+    if request.POST.get('scope') == 'filtered':
+        orders = filter_orders(QueryDict(request.POST.get('filters', '')))
+    else:
+        order_ids = [int(order_id) for order_id in request.POST.getlist('order_ids') if order_id.isdigit()]
+        orders = Order.objects.filter(id__in=order_ids)
+    try:
+        moved = transition_orders(orders, request.POST.get('status'))
+    except InvalidStatusError:
+        messages.error(request, 'Choose a status to move the orders to.')
+        return _manage_orders_redirect(request)
+    messages.success(request, '%d order(s) moved to %s; orders that cannot make that move were left unchanged.' % (
+        len(moved), dict(Order.STATUS_CHOICES)[request.POST['status']]))
+    return _manage_orders_redirect(request)
 
 @staff_member_required
 def manage_users(request):
-    users = User.objects.all()
+    users = paginate_queryset(request, User.objects.all())
     return render(request, 'manage_users.html', {'users': users})
 
 @require_POST
@@ -401,13 +536,3 @@ def delete_user(request, user_id):
     user = get_object_or_404(User, id=user_id)
     user.delete()
     return redirect('manage_users')
-
-@staff_member_required
-def update_order_status(request, order_id):
-    order = get_object_or_404(Order, id=order_id)
-    if request.method == 'POST':
-        new_status = request.POST.get('status')
-        order.status = new_status
-        order.save()
-        messages.success(request, 'Order status updated successfully.')
-    return redirect('manage_orders')
\ No newline at end of file
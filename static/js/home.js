@@ -0,0 +1,60 @@
+let sidebarOpen = false;
+
+function toggleNav() {
+  const sidebar = document.getElementById("filterSidebar");
+  const main = document.getElementById("main");
+  const toggleBtn = document.getElementById("filterToggleBtn");
+
+  if (sidebarOpen) {
+    sidebar.style.width = "0";
+    main.style.marginLeft = "0";
+    toggleBtn.innerHTML = "&#9776; Open Filters";
+  } else {
+    sidebar.style.width = "250px";
+    main.style.marginLeft = "250px";
+    toggleBtn.innerHTML = "&#9776; Close Filters";
+  }
+
+  sidebarOpen = !sidebarOpen;
+}
+
+function clearFilters() {
+  sessionStorage.setItem('clearFiltersOnLoad', 'true');
+}
+
+const loadMore = document.getElementById('load-more');
+if (loadMore && 'IntersectionObserver' in window) {
+  const grid = document.querySelector('#main .row');
+  const observer = new IntersectionObserver((entries) => {
+    if (!entries[0].isIntersecting || loadMore.dataset.loading) {
+      return;
+    }
+    loadMore.dataset.loading = 'true';
+    fetch(loadMore.href + '&format=json')
+      .then((response) => response.json())
+      .then((data) => {
+        grid.insertAdjacentHTML('beforeend', data.html);
+        if (data.next_query) {
+          loadMore.href = '?' + data.next_query;
+          delete loadMore.dataset.loading;
+        } else {
+          observer.disconnect();
+          loadMore.remove();
+        }
+      });
+  });
+  observer.observe(loadMore);
+}
+
+window.addEventListener('load', () => {
+  const shouldClear = sessionStorage.getItem('clearFiltersOnLoad') === 'true';
+  if (shouldClear) {
+    sessionStorage.removeItem('clearFiltersOnLoad');
+    const url = new URL(window.location.href);
+    url.searchParams.delete('category');
+    url.searchParams.delete('color');
+    url.searchParams.delete('size');
+    url.searchParams.delete('price');
+    window.location.href = url.toString();
+  }
+});
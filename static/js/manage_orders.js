@@ -0,0 +1,5 @@
+document.getElementById('select-all-orders').addEventListener('change', function () {
+  document.querySelectorAll('.order-select').forEach(function (box) {
+    box.checked = this.checked;
+  }, this);
+});